@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import config
+import datetime as dt
+import itertools
+import logging
+import math
+import os
+import numpy as np
+import polars as pl
+import sqlalchemy as db
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from constituent_index import ConstituentIndex, load_constituent_index
+from database import get_engine
+from price_panel import open_price_panel
+from transformations import scan_stock_prices
+
+
+@dataclass(frozen=True)
+class PricePanel:
+    """Dense dates x tickers close prices, NaN where no price is stored."""
+
+    dates: np.ndarray
+    tickers: np.ndarray
+    close: np.ndarray
+
+    def returns(self) -> np.ndarray:
+        """
+        Simple returns from the last stored close, NaN on missing sessions.
+
+        A return spanning missing sessions is booked on the next stored close,
+        so gaps in the stored prices don't drop price moves.
+        """
+        returns = np.full(self.close.shape, np.nan)
+        returns[1:] = self.close[1:] / self.filled_close()[:-1] - 1
+        return returns
+
+    def filled_close(self) -> np.ndarray:
+        """Close prices carried forward over missing sessions."""
+        return _forward_fill(self.close)
+
+
+@dataclass(frozen=True)
+class BacktestResult:
+    """Daily portfolio series and summary statistics of one backtest."""
+
+    daily: pl.DataFrame
+    stats: dict
+
+
+# Policies map a panel and its membership mask (or None), plus keyword
+# parameters, to dates x tickers signals.
+Policy = Callable[..., np.ndarray]
+
+
+def _forward_fill(matrix: np.ndarray) -> np.ndarray:
+    """Carries the last non-NaN value of each column forward."""
+    valid = ~np.isnan(matrix)
+    rows = np.where(valid, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return matrix[rows, np.arange(matrix.shape[1])]
+
+
+def _rolling_mean(matrix: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over window rows, NaN until the window is full."""
+    sums = np.nancumsum(matrix, axis=0)
+    counts = np.cumsum(~np.isnan(matrix), axis=0)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    means = np.full(matrix.shape, np.nan)
+    full = counts == window
+    means[full] = sums[full] / window
+    return means
+
+
+def load_price_panel(
+    engine: db.Engine,
+    start_date: dt.date | str | None = None,
+    end_date: dt.date | str | None = None,
+    tickers: list[str] | None = None,
+    source: str = "database",
+    parquet_dir: Path | None = None,
+    panel_dir: Path | None = None,
+) -> PricePanel:
+    """
+    Reads stored close prices into a dense panel.
+
+    Prices come from stock_prices, or from its Parquet export with
+    source="parquet" or "auto" (see scan_stock_prices), or from the
+    memory-mapped price panel with source="panel". Every ticker ever stored
+    is included, delisted ones too, so the universe can be restricted point
+    in time afterwards.
+    """
+    parquet_dir = parquet_dir or config.PRICES_PARQUET_DIR
+    panel_dir = panel_dir or config.PRICE_PANEL_DIR
+    if source == "panel":
+        return _slice_price_panel(panel_dir, start_date, end_date, tickers)
+    prices = (
+        scan_stock_prices(
+            engine,
+            tickers=tickers,
+            start_date=start_date,
+            end_date=end_date,
+            columns=["close"],
+            source=source,
+            parquet_dir=parquet_dir,
+        )
+        .drop_nulls("close")
+        .collect()
+    )
+    dates = np.unique(prices["date"].to_numpy().astype("datetime64[D]"))
+    panel_tickers = np.unique(prices["ticker"].to_numpy().astype(str))
+    close = np.full((len(dates), len(panel_tickers)), np.nan)
+    rows = np.searchsorted(dates, prices["date"].to_numpy().astype("datetime64[D]"))
+    columns = np.searchsorted(panel_tickers, prices["ticker"].to_numpy().astype(str))
+    close[rows, columns] = prices["close"].to_numpy()
+    return PricePanel(dates, panel_tickers, close)
+
+
+def _slice_price_panel(
+    panel_dir: Path,
+    start_date: dt.date | str | None,
+    end_date: dt.date | str | None,
+    tickers: list[str] | None,
+) -> PricePanel:
+    """Close prices of the memory-mapped price panel, without the empty sessions and tickers."""
+    mapped = open_price_panel(panel_dir)
+    columns = mapped.columns(start_date, end_date)
+    rows = np.arange(len(mapped.tickers))
+    if tickers is not None:
+        rows = np.array(
+            sorted(mapped.ticker_rows[t] for t in tickers if t in mapped.ticker_rows),
+            dtype=np.int64,
+        )
+    close = mapped.fields["close"][rows, columns].astype(np.float64)
+    stored = ~np.isnan(close)
+    kept, sessions = stored.any(axis=1), stored.any(axis=0)
+    panel_tickers = mapped.tickers[rows[kept]]
+    order = np.argsort(panel_tickers)
+    return PricePanel(
+        mapped.sessions[columns][sessions],
+        panel_tickers[order],
+        close[kept][:, sessions][order].T,
+    )
+
+
+def membership_mask(panel: PricePanel, index: ConstituentIndex) -> np.ndarray:
+    """Dates x tickers mask of the panel cells whose ticker was an index member that day."""
+    return index.is_member(panel.tickers[None, :], panel.dates[:, None])
+
+
+def momentum_policy(
+    panel: PricePanel,
+    members: np.ndarray | None = None,
+    lookback: int = 252,
+    skip: int = 21,
+    top_n: int = 50,
+) -> np.ndarray:
+    """Equal weights on the top_n members by return from lookback to skip sessions ago."""
+    close = panel.filled_close()
+    momentum = np.full(close.shape, np.nan)
+    momentum[lookback:] = (
+        close[lookback - skip : len(close) - skip] / close[:-lookback] - 1
+    )
+    momentum[np.isnan(panel.close)] = np.nan
+    if members is not None:
+        momentum[~members] = np.nan
+    return _top_n(momentum, top_n)
+
+
+def moving_average_policy(
+    panel: PricePanel,
+    members: np.ndarray | None = None,
+    fast: int = 50,
+    slow: int = 200,
+) -> np.ndarray:
+    """Equal weights on the members whose fast moving average is above the slow one."""
+    close = panel.filled_close()
+    fast_mean = _rolling_mean(close, fast)
+    slow_mean = _rolling_mean(close, slow)
+    with np.errstate(invalid="ignore"):
+        signal = (fast_mean > slow_mean).astype(float)
+    if members is not None:
+        signal[~members] = 0.0
+    return signal
+
+
+def _top_n(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """1 for the top_n highest scores of each row, 0 elsewhere."""
+    ranked = np.where(np.isnan(scores), -np.inf, scores)
+    count = min(top_n, scores.shape[1])
+    top = np.argpartition(-ranked, count - 1, axis=1)[:, :count]
+    signal = np.zeros(scores.shape)
+    np.put_along_axis(signal, top, 1.0, axis=1)
+    signal[np.isneginf(ranked)] = 0.0
+    return signal
+
+
+POLICIES: dict[str, Policy] = {
+    "momentum": momentum_policy,
+    "moving_average": moving_average_policy,
+}
+
+
+def run_backtest(
+    panel: PricePanel,
+    signal: np.ndarray,
+    members: np.ndarray | None = None,
+    rebalance_every: int = 21,
+    cost_bps: float = 5.0,
+) -> BacktestResult:
+    """
+    Backtests a long-only policy over the panel.
+
+    Target weights are the positive signal values of the names that are index
+    members and have a price on the decision session, normalized to sum to
+    one, and are held from the close of that session. Between rebalances,
+    weights drift with prices. Turnover is measured against the drifted
+    weights and charged cost_bps per unit traded.
+
+    Args:
+        signal: Dates x tickers scores from a policy, NaN or <= 0 for no position.
+        members: Dates x tickers membership mask (see membership_mask). Without
+            it every name with a price is investable.
+        rebalance_every: Sessions between rebalances.
+    """
+    returns = np.nan_to_num(panel.returns())
+    investable = ~np.isnan(panel.close)
+    if members is not None:
+        investable &= members
+    target = np.where(investable & (signal > 0), signal, 0.0)
+    totals = target.sum(axis=1, keepdims=True)
+    target = np.divide(target, totals, out=np.zeros_like(target), where=totals > 0)
+
+    sessions = len(panel.dates)
+    rebalances = np.zeros(sessions, dtype=bool)
+    rebalances[::rebalance_every] = True
+    weights = np.zeros(panel.close.shape)
+    portfolio_returns = np.zeros(sessions)
+    turnover = np.zeros(sessions)
+    # Rebalances reset the weights, so the drift is compounded between them
+    # one block at a time, each block being vectorized across names.
+    starts = np.flatnonzero(rebalances)
+    for start, end in zip(starts, np.append(starts[1:], sessions)):
+        growth = np.cumprod(1 + returns[start + 1 : end], axis=0)
+        block = np.vstack([target[start], target[start] * growth])
+        value = block.sum(axis=1)
+        weights[start:end] = np.divide(
+            block,
+            value[:, None],
+            out=np.zeros_like(block),
+            where=value[:, None] > 0,
+        )
+        period_returns = np.ones(len(block))
+        period_returns[1:] = np.divide(
+            value[1:], value[:-1], out=np.ones(len(block) - 1), where=value[:-1] > 0
+        )
+        portfolio_returns[start + 1 : end] = period_returns[1:] - 1
+        if end < sessions:
+            drifted = weights[end - 1] * (1 + returns[end])
+            held = drifted.sum()
+            portfolio_returns[end] = held - 1 if weights[end - 1].any() else 0.0
+            drifted = drifted / held if held > 0 else drifted
+            turnover[end] = np.abs(target[end] - drifted).sum()
+    turnover[0] = np.abs(target[0]).sum()
+    portfolio_returns -= turnover * cost_bps / 10_000
+
+    equity = np.cumprod(1 + portfolio_returns)
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    daily = pl.DataFrame(
+        {
+            "date": panel.dates,
+            "return": portfolio_returns,
+            "equity": equity,
+            "drawdown": drawdown,
+            "turnover": turnover,
+            "positions": (weights > 0).sum(axis=1),
+        }
+    ).with_columns(pl.col("date").cast(pl.Date))
+    return BacktestResult(daily, summarize(daily))
+
+
+def summarize(daily: pl.DataFrame) -> dict:
+    """Annualized return, volatility, Sharpe ratio, maximum drawdown and turnover."""
+    periods = config.TRADING_DAYS_PER_YEAR
+    years = max(len(daily) / periods, 1 / periods)
+    final_equity = daily["equity"][-1] if len(daily) else 1.0
+    volatility = (daily["return"].std() or 0.0) * math.sqrt(periods)
+    annual_return = final_equity ** (1 / years) - 1 if final_equity > 0 else -1.0
+    return {
+        "total_return": final_equity - 1,
+        "annual_return": annual_return,
+        "annual_volatility": volatility,
+        "sharpe": (daily["return"].mean() * periods / volatility)
+        if volatility
+        else None,
+        "max_drawdown": daily["drawdown"].min() if len(daily) else 0.0,
+        "annual_turnover": daily["turnover"].sum() / years,
+        "average_positions": daily["positions"].mean() if len(daily) else 0.0,
+    }
+
+
+_sweep_panel: PricePanel | None = None
+_sweep_members: np.ndarray | None = None
+
+
+def _init_sweep_worker(panel: PricePanel, members: np.ndarray | None) -> None:
+    global _sweep_panel, _sweep_members
+    _sweep_panel, _sweep_members = panel, members
+
+
+def _run_sweep_point(
+    policy: Policy, policy_params: dict, backtest_params: dict
+) -> dict:
+    signal = policy(_sweep_panel, _sweep_members, **policy_params)
+    result = run_backtest(_sweep_panel, signal, _sweep_members, **backtest_params)
+    return {**policy_params, **backtest_params, **result.stats}
+
+
+def run_parameter_sweep(
+    panel: PricePanel,
+    policy: Policy,
+    grid: dict[str, list],
+    members: np.ndarray | None = None,
+    workers: int | None = None,
+) -> pl.DataFrame:
+    """
+    Backtests policy over every combination of the grid parameters.
+
+    Grid keys are policy arguments, or rebalance_every and cost_bps for the
+    backtest itself. Combinations run on a process pool whose workers receive
+    the panel once, at start-up; policy must be a module-level function.
+
+    Returns:
+        One row per combination with its parameters and summary statistics.
+    """
+    backtest_keys = {"rebalance_every", "cost_bps"}
+    points = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid.keys(), values))
+        points.append(
+            (
+                {k: v for k, v in params.items() if k not in backtest_keys},
+                {k: v for k, v in params.items() if k in backtest_keys},
+            )
+        )
+    workers = min(workers or os.cpu_count() or 1, len(points))
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_sweep_worker,
+        initargs=(panel, members),
+    ) as executor:
+        rows = list(
+            executor.map(
+                _run_sweep_point,
+                itertools.repeat(policy),
+                *zip(*points),
+            )
+        )
+    return pl.DataFrame(rows)
+
+
+def _parse_grid(specs: list[str]) -> dict[str, list]:
+    """Parses name=value1,value2 parameter specs."""
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        grid[name] = [
+            float(value) if "." in value else int(value) for value in values.split(",")
+        ]
+    return grid
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses the backtest command line options."""
+    parser = argparse.ArgumentParser(description="Backtest a trading policy.")
+    parser.add_argument("--policy", choices=list(POLICIES), default="momentum")
+    parser.add_argument("--start-date", default=None)
+    parser.add_argument("--end-date", default=None)
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=V1[,V2...]",
+        help="Policy or backtest parameter; several values run a sweep.",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--source",
+        choices=["auto", "database", "parquet", "panel"],
+        default="database",
+        help="Where the close prices are read from.",
+    )
+    parser.add_argument(
+        "--all-tickers",
+        action="store_true",
+        help="Ignore index membership (survivorship-biased).",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args()
+    engine = get_engine(config.POSTGRES_URL)
+    panel = load_price_panel(engine, args.start_date, args.end_date, source=args.source)
+    members = (
+        None
+        if args.all_tickers
+        else membership_mask(panel, load_constituent_index(engine))
+    )
+    logging.info(
+        f"Loaded {len(panel.tickers)} tickers over {len(panel.dates)} sessions."
+    )
+    grid = _parse_grid(args.param)
+    policy = POLICIES[args.policy]
+    if any(len(values) > 1 for values in grid.values()):
+        results = run_parameter_sweep(panel, policy, grid, members, args.workers)
+        with pl.Config(tbl_rows=-1, tbl_cols=-1):
+            print(results.sort("sharpe", descending=True, nulls_last=True))
+    else:
+        params = {name: values[0] for name, values in grid.items()}
+        backtest_params = {
+            k: params.pop(k) for k in ("rebalance_every", "cost_bps") if k in params
+        }
+        result = run_backtest(
+            panel, policy(panel, members, **params), members, **backtest_params
+        )
+        for name, value in result.stats.items():
+            print(f"{name:>18}: {value}")
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import config
+import datetime as dt
+import itertools
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import polars as pl
+import sqlalchemy as db
+from pathlib import Path
+from typing import Callable
+from database import (
+    create_corporate_actions_table,
+    create_feature_dirty_table,
+    create_price_coverage_table,
+    create_price_quarantine_table,
+    create_price_table,
+    create_sp500_changes_table,
+    create_sp500_companies_table,
+    create_unavailable_prices_table,
+    create_work_units_table,
+    get_engine,
+    load_data_to_db,
+)
+from fake_provider import FakePriceProvider
+from fetch_scheduler import TokenBucket
+from price_coverage import rebuild_price_coverage
+from price_sync import sync_missing_prices
+from trading_calendar import sessions_series
+from transformations import (
+    catch_missing_prices,
+    creating_sp500_index_timeline,
+    expand_sp500_index_timeline,
+    get_missing_price_ranges,
+    price_coverage_transformations,
+    sp500_changes_transformations,
+    sp500_companies_transformations,
+)
+from utils import extract_wikipedia_tables
+
+
+BENCHMARK_TABLES = [
+    "stock_prices",
+    "stock_price_bars",
+    "tickers",
+    "stock_prices_coverage",
+    "sp500_companies",
+    "sp500_changes",
+    "etl_work_units",
+    "stock_prices_unavailable",
+    "corporate_actions",
+    "stock_prices_quarantine",
+    "feature_dirty_tickers",
+]
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses the benchmark command line options."""
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the ETL hot paths on synthetic S&P 500 data."
+    )
+    parser.add_argument("--tickers", type=int, default=100, help="Current members.")
+    parser.add_argument("--years", type=int, default=5, help="Length of the window.")
+    parser.add_argument(
+        "--end-date", default="2024-12-31", help="Last day of the window."
+    )
+    parser.add_argument(
+        "--gap-density",
+        type=float,
+        default=0.05,
+        help="Share of member sessions without prices.",
+    )
+    parser.add_argument(
+        "--gap-length", type=int, default=5, help="Sessions per missing block."
+    )
+    parser.add_argument(
+        "--churn",
+        type=float,
+        default=0.05,
+        help="Index changes per year, as a share of the members.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--db-url",
+        default=None,
+        help="Database to run against (defaults to a temporary SQLite file). "
+        "Its benchmark tables are dropped first, so they must be empty unless "
+        "--drop-existing is given.",
+    )
+    parser.add_argument(
+        "--drop-existing",
+        action="store_true",
+        help="Drop the benchmark tables of --db-url even if they hold rows.",
+    )
+    parser.add_argument(
+        "--skip-fetch", action="store_true", help="Skip the fetch loop benchmark."
+    )
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file.")
+    parser.add_argument(
+        "--compare", type=Path, default=None, help="Previous JSON results file."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown of the median reported as a regression.",
+    )
+    return parser.parse_args()
+
+
+def _ticker_name(index: int) -> str:
+    """Synthetic four letter ticker for an index (AAAA, AAAB, ...)."""
+    letters = []
+    for _ in range(4):
+        index, remainder = divmod(index, 26)
+        letters.append(chr(ord("A") + remainder))
+    return "".join(reversed(letters))
+
+
+def _wiki_date(date: dt.date) -> str:
+    """Formats a date the way the Wikipedia changes table does."""
+    return f"{date:%B} {date.day}, {date.year}"
+
+
+def generate_index_data(
+    tickers: int,
+    start_date: dt.date,
+    end_date: dt.date,
+    churn: float,
+    rng: np.random.Generator,
+) -> tuple[list[dict], list[dict]]:
+    """
+    Generates raw sp500_companies and sp500_changes rows.
+
+    Every change adds one of the current members and removes a former one, so
+    the number of members stays constant over the whole window.
+    """
+    companies = [
+        {
+            "symbol": _ticker_name(i),
+            "security": f"Company {i}",
+            "gics_sector": f"Sector {i % 11}",
+            "gics_sub_industry": f"Industry {i % 60}",
+            "headquarters_location": "Nowhere",
+            "date_added": "",
+            "cik": f"{i:010d}",
+            "founded": str(1900 + i % 120),
+        }
+        for i in range(tickers)
+    ]
+    years = (end_date - start_date).days / 365.25
+    change_count = min(tickers, int(round(churn * tickers * years)))
+    days = np.sort(rng.integers(0, (end_date - start_date).days, change_count))
+    added = rng.permutation(tickers)[:change_count]
+    changes = [
+        {
+            "effective_date": _wiki_date(start_date + dt.timedelta(days=int(day))),
+            "added_ticker": _ticker_name(int(added[i])),
+            "added_security": f"Company {added[i]}",
+            "removed_ticker": _ticker_name(tickers + i),
+            "removed_security": f"Company {tickers + i}",
+            "reason": "Market capitalization change.",
+        }
+        for i, day in enumerate(days)
+    ]
+    return companies, changes
+
+
+def generate_prices(
+    timeline_df: pl.DataFrame,
+    trading_days: pl.Series,
+    gap_density: float,
+    gap_length: int,
+    rng: np.random.Generator,
+) -> pl.DataFrame:
+    """
+    Generates daily bars for every member session, minus blocks of gap_length
+    sessions dropped with probability gap_density.
+    """
+    members = (
+        expand_sp500_index_timeline(timeline_df, trading_days)
+        .collect()
+        .join(
+            trading_days.to_frame("date").with_row_index("session"),
+            on="date",
+        )
+        .with_columns((pl.col("session") // gap_length).alias("block"))
+    )
+    blocks = members.select("ticker", "block").unique(maintain_order=True)
+    dropped = blocks.filter(pl.Series(rng.random(len(blocks)) < gap_density))
+    prices = members.join(dropped, on=["ticker", "block"], how="anti")
+    close = 100 * np.exp(rng.normal(0, 0.01, len(prices)).cumsum() / 100)
+    return prices.select(
+        pl.col("date").cast(pl.Datetime),
+        "ticker",
+        pl.Series("open", close * 0.995),
+        pl.Series("high", close * 1.01),
+        pl.Series("low", close * 0.99),
+        pl.Series("close", close),
+        pl.Series("volume", rng.integers(10_000, 10_000_000, len(prices))),
+    )
+
+
+def generate_wikipedia_html(companies: list[dict], changes: list[dict]) -> str:
+    """Renders the companies and changes as the two Wikipedia tables."""
+    constituents = "".join(
+        "<tr>" + "".join(f"<td>{value}</td>" for value in row.values()) + "</tr>"
+        for row in companies
+    )
+    change_rows = "".join(
+        "<tr>"
+        + "".join(
+            f"<td>{row[key]}</td>"
+            for key in (
+                "effective_date",
+                "added_ticker",
+                "added_security",
+                "removed_ticker",
+                "removed_security",
+                "reason",
+            )
+        )
+        + "</tr>"
+        for row in changes
+    )
+    return (
+        "<html><body>"
+        '<table id="constituents"><tr><th>Symbol</th><th>Security</th>'
+        "<th>GICS Sector</th><th>GICS Sub-Industry</th>"
+        "<th>Headquarters Location</th><th>Date added</th><th>CIK</th>"
+        f"<th>Founded</th></tr>{constituents}</table>"
+        '<table id="changes"><tr><th rowspan="2">Effective Date</th>'
+        '<th colspan="2">Added</th><th colspan="2">Removed</th>'
+        '<th rowspan="2">Reason</th></tr>'
+        "<tr><th>Ticker</th><th>Security</th><th>Ticker</th><th>Security</th></tr>"
+        f"{change_rows}</table>"
+        "</body></html>"
+    )
+
+
+def use_data_dir(data_dir: Path) -> None:
+    """Points every data path of config into data_dir, so a run leaves data/ untouched."""
+    base_dir = config.BASE_DIR / "data"
+    for name, value in list(vars(config).items()):
+        if isinstance(value, Path) and value.is_relative_to(base_dir):
+            setattr(config, name, data_dir / value.relative_to(base_dir))
+
+
+def reset_database(engine: db.Engine, drop_existing: bool = False) -> None:
+    """
+    Drops the tables and views the benchmark writes to.
+
+    Raises:
+        RuntimeError: If any of them holds rows and drop_existing is not set,
+            so a benchmark pointed at a real database leaves it untouched.
+    """
+    inspector = db.inspect(engine)
+    views = set(inspector.get_view_names())
+    tables = set(inspector.get_table_names())
+    with engine.connect() as connection:
+        filled = [
+            name
+            for name in BENCHMARK_TABLES
+            if name in tables | views
+            and connection.execute(db.text(f"SELECT 1 FROM {name} LIMIT 1")).first()
+        ]
+    if filled and not drop_existing:
+        raise RuntimeError(
+            f"Tables {filled} are not empty; pass --drop-existing to drop them."
+        )
+    with engine.begin() as connection:
+        for name in BENCHMARK_TABLES:
+            if name in views:
+                connection.execute(db.text(f"DROP VIEW {name}"))
+        for name in BENCHMARK_TABLES:
+            if name in tables:
+                cascade = " CASCADE" if engine.dialect.name == "postgresql" else ""
+                connection.execute(db.text(f"DROP TABLE {name}{cascade}"))
+
+
+def measure(
+    results: dict,
+    name: str,
+    function: Callable[[], object],
+    repeat: int,
+    rows: int | None = None,
+) -> object:
+    """Times function repeat times and records the runs under name."""
+    runs, value = [], None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        value = function()
+        runs.append(time.perf_counter() - started_at)
+    median = statistics.median(runs)
+    results[name] = {
+        "runs": runs,
+        "min": min(runs),
+        "median": median,
+        "rows": rows,
+        "rows_per_second": rows / median if rows and median else None,
+    }
+    logging.info(f"{name}: median {median:.3f}s over {repeat} runs.")
+    return value
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace, engine: db.Engine) -> dict:
+    """Generates the synthetic dataset and times every hot path on it."""
+    rng = np.random.default_rng(args.seed)
+    end_date = dt.date.fromisoformat(args.end_date)
+    start_date = end_date.replace(year=end_date.year - args.years)
+    fetch_end_date = str(end_date + dt.timedelta(days=1))
+    trading_days = sessions_series(start_date, end_date)
+    results = {}
+
+    reset_database(engine, args.drop_existing)
+    create_sp500_companies_table(engine)
+    create_sp500_changes_table(engine)
+    create_price_table(engine, first_year=start_date.year, last_year=end_date.year)
+    create_price_coverage_table(engine)
+    create_work_units_table(engine)
+    create_unavailable_prices_table(engine)
+    create_corporate_actions_table(engine)
+    create_price_quarantine_table(engine)
+    create_feature_dirty_table(engine)
+
+    companies, changes = generate_index_data(
+        args.tickers, start_date, end_date, args.churn, rng
+    )
+    html = generate_wikipedia_html(companies, changes)
+
+    def parse_tables() -> dict:
+        return extract_wikipedia_tables(html, ["constituents", "changes"])
+
+    measure(
+        results,
+        "parse_wikipedia_table",
+        parse_tables,
+        args.repeat,
+        rows=len(companies) + len(changes),
+    )
+    load_data_to_db(companies, "sp500_companies", engine)
+    load_data_to_db(changes, "sp500_changes", engine)
+
+    companies_df = sp500_companies_transformations(engine)
+    changes_df = sp500_changes_transformations(engine)
+    timeline_df = measure(
+        results,
+        "creating_sp500_index_timeline",
+        lambda: creating_sp500_index_timeline(changes_df, companies_df, trading_days),
+        args.repeat,
+        rows=len(changes_df) + len(companies_df),
+    )
+
+    prices = generate_prices(
+        timeline_df, trading_days, args.gap_density, args.gap_length, rng
+    )
+    price_rows = prices.to_dicts()
+    measure(
+        results,
+        "load_data_to_db.insert",
+        lambda: load_data_to_db(price_rows, "stock_prices", engine, mode="upsert"),
+        1,
+        rows=len(price_rows),
+    )
+    sample_rows = price_rows[: min(len(price_rows), 100_000)]
+    upsert_runs = itertools.count(1)
+
+    def upsert_sample() -> dict:
+        factor = 1 + next(upsert_runs) / 1000
+        rows = [{**row, "close": row["close"] * factor} for row in sample_rows]
+        return load_data_to_db(rows, "stock_prices", engine, mode="upsert")
+
+    measure(
+        results,
+        "load_data_to_db.upsert",
+        upsert_sample,
+        args.repeat,
+        rows=len(sample_rows),
+    )
+    rebuild_price_coverage(engine)
+
+    coverage_df = price_coverage_transformations(engine)
+    missing_df = measure(
+        results,
+        "catch_missing_prices",
+        lambda: catch_missing_prices(coverage_df, timeline_df, trading_days),
+        args.repeat,
+        rows=len(coverage_df),
+    )
+    measure(
+        results,
+        "get_missing_price_ranges",
+        lambda: get_missing_price_ranges(str(start_date), fetch_end_date, engine),
+        args.repeat,
+        rows=len(missing_df),
+    )
+
+    if not args.skip_fetch:
+        provider = FakePriceProvider(latency=(0.001, 0.005), seed=args.seed)
+        stats = measure(
+            results,
+            "fetch_loop",
+            lambda: sync_missing_prices(
+                engine,
+                str(start_date),
+                fetch_end_date,
+                provider.fetch,
+                limiter=TokenBucket(rate=1000.0, capacity=1000.0),
+            ),
+            1,
+            rows=len(missing_df),
+        )
+        results["fetch_loop"]["provider_calls"] = provider.calls
+        results["fetch_loop"].update(stats)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "polars": pl.__version__,
+            "sqlalchemy": db.__version__,
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "parameters": {
+                "tickers": args.tickers,
+                "years": args.years,
+                "end_date": args.end_date,
+                "gap_density": args.gap_density,
+                "gap_length": args.gap_length,
+                "churn": args.churn,
+                "repeat": args.repeat,
+                "seed": args.seed,
+            },
+            "dataset": {
+                "sessions": len(trading_days),
+                "changes": len(changes),
+                "price_rows": len(price_rows),
+                "missing_ranges": len(missing_df),
+            },
+        },
+        "results": results,
+    }
+
+
+def compare_results(current: dict, previous: dict, threshold: float) -> list[str]:
+    """Logs the median of every benchmark against a previous run and returns the regressions."""
+    if current["meta"]["parameters"] != previous["meta"]["parameters"]:
+        logging.warning("Benchmark parameters differ from the compared run.")
+    regressions = []
+    for name, result in current["results"].items():
+        baseline = previous["results"].get(name)
+        if baseline is None:
+            continue
+        ratio = result["median"] / baseline["median"] if baseline["median"] else 1.0
+        logging.info(
+            f"{name}: {baseline['median']:.3f}s -> {result['median']:.3f}s "
+            f"({ratio - 1:+.1%})"
+        )
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        use_data_dir(Path(temporary_dir) / "data")
+        engine = get_engine(
+            args.db_url or f"sqlite:///{Path(temporary_dir) / 'benchmark.db'}"
+        )
+        try:
+            report = run_benchmarks(args, engine)
+        except RuntimeError as e:
+            logging.error(f"Benchmark aborted: {e}")
+            sys.exit(2)
+        finally:
+            engine.dispose()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+        logging.info(f"Benchmark results written to {args.output}.")
+    else:
+        print(output)
+    if args.compare:
+        previous = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare_results(report, previous, args.threshold)
+        if regressions:
+            logging.error(f"Regressions over {args.threshold:.0%}: {regressions}")
+            sys.exit(1)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import hashlib
+import logging
+import os
+import numpy as np
+import polars as pl
+import sqlalchemy as db
+from pathlib import Path
+from trading_calendar import load_sessions
+from transformations import (
+    creating_sp500_index_timeline,
+    sp500_changes_transformations,
+    sp500_companies_transformations,
+)
+
+
+class ConstituentIndex:
+    """
+    Point-in-time S&P 500 membership.
+
+    The history is cut into segments at every addition and removal date, and
+    a segments x tickers boolean matrix records who was a member during each
+    segment. Dates and tickers are located with binary searches, so single
+    lookups take logarithmic time and bulk lookups are a vectorized gather.
+    Dates on or after the last boundary resolve to the current membership,
+    dates before the first one to no membership at all.
+    """
+
+    def __init__(
+        self,
+        boundaries: np.ndarray,
+        tickers: np.ndarray,
+        membership: np.ndarray,
+        fingerprint: str = "",
+    ) -> None:
+        self.boundaries = boundaries.astype("datetime64[D]")
+        self.tickers = tickers.astype(str)
+        self.membership = membership.astype(bool)
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_timeline(
+        cls, timeline_df: pl.DataFrame, open_end: dt.date, fingerprint: str = ""
+    ) -> "ConstituentIndex":
+        """
+        Builds the index from membership intervals (ticker, added_date,
+        removed_date exclusive). Intervals ending on or after open_end are
+        treated as ongoing.
+        """
+        tickers = np.sort(timeline_df["ticker"].unique().to_numpy().astype(str))
+        added = timeline_df["added_date"].to_numpy().astype("datetime64[D]")
+        removed = timeline_df["removed_date"].to_numpy().astype("datetime64[D]")
+        ongoing = removed >= np.datetime64(open_end, "D")
+        boundaries = np.unique(np.concatenate([added, removed[~ongoing]]))
+
+        columns = np.searchsorted(tickers, timeline_df["ticker"].to_numpy().astype(str))
+        start_rows = np.searchsorted(boundaries, added)
+        end_rows = np.where(
+            ongoing, len(boundaries), np.searchsorted(boundaries, removed)
+        )
+        delta = np.zeros((len(boundaries) + 1, len(tickers)), dtype=np.int32)
+        np.add.at(delta, (start_rows, columns), 1)
+        np.add.at(delta, (end_rows, columns), -1)
+        membership = delta.cumsum(axis=0)[:-1] > 0
+        return cls(boundaries, tickers, membership, fingerprint)
+
+    def _rows(self, dates) -> np.ndarray:
+        """Segment of each date, -1 for dates before the first boundary."""
+        days = np.asarray(dates, dtype="datetime64[D]")
+        return np.searchsorted(self.boundaries, days, side="right") - 1
+
+    def _columns(self, tickers) -> tuple[np.ndarray, np.ndarray]:
+        """Column of each ticker and whether the ticker is known at all."""
+        tickers = np.asarray(tickers, dtype=str)
+        columns = np.searchsorted(self.tickers, tickers)
+        clipped = np.minimum(columns, len(self.tickers) - 1)
+        known = (columns < len(self.tickers)) & (self.tickers[clipped] == tickers)
+        return clipped, known
+
+    def members_on(self, date: dt.date | str) -> list[str]:
+        """Tickers that were members of the index on date."""
+        row = int(self._rows(date))
+        if row < 0:
+            return []
+        return self.tickers[self.membership[row]].tolist()
+
+    def membership_of(self, ticker: str) -> list[tuple[dt.date, dt.date | None]]:
+        """Membership spells of ticker as (added, removed) pairs, removed being exclusive and None while ongoing."""
+        column, known = self._columns([ticker])
+        if not known[0]:
+            return []
+        flags = np.concatenate([[False], self.membership[:, column[0]], [False]])
+        changes = np.flatnonzero(flags[1:] != flags[:-1])
+        spells = []
+        for start, end in zip(changes[::2], changes[1::2]):
+            removed = self.boundaries[end] if end < len(self.boundaries) else None
+            spells.append(
+                (
+                    self.boundaries[start].astype(dt.date),
+                    removed.astype(dt.date) if removed is not None else None,
+                )
+            )
+        return spells
+
+    def is_member(self, tickers, dates) -> np.ndarray:
+        """Vectorized membership test of (ticker, date) pairs."""
+        rows = self._rows(dates)
+        columns, known = self._columns(tickers)
+        rows, columns, known = np.broadcast_arrays(rows, columns, known)
+        valid = known & (rows >= 0)
+        result = np.zeros(rows.shape, dtype=bool)
+        result[valid] = self.membership[rows[valid], columns[valid]]
+        return result
+
+    def membership_matrix(self, dates) -> np.ndarray:
+        """Dates x tickers membership matrix, with columns ordered as self.tickers."""
+        rows = self._rows(dates)
+        matrix = self.membership[np.maximum(rows, 0)]
+        matrix[rows < 0] = False
+        return matrix
+
+    def save(self, path: Path | None = None) -> None:
+        """Persists the index as a compressed NumPy archive with packed bits."""
+        path = path or config.CONSTITUENT_INDEX_PATH
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f".{path.stem}.tmp.npz")
+        np.savez_compressed(
+            temporary_path,
+            boundaries=self.boundaries.astype(np.int64),
+            tickers=self.tickers,
+            membership=np.packbits(self.membership, axis=1),
+            ticker_count=len(self.tickers),
+            fingerprint=self.fingerprint,
+        )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: Path | None = None) -> "ConstituentIndex":
+        """Loads an index written by save."""
+        path = path or config.CONSTITUENT_INDEX_PATH
+        with np.load(path) as archive:
+            ticker_count = int(archive["ticker_count"])
+            return cls(
+                archive["boundaries"].astype("datetime64[D]"),
+                archive["tickers"],
+                np.unpackbits(archive["membership"], axis=1, count=ticker_count),
+                str(archive["fingerprint"]),
+            )
+
+
+def _source_tables(engine: db.Engine) -> tuple[pl.DataFrame, pl.DataFrame, str]:
+    """Reads the transformed companies and changes tables and fingerprints them."""
+    companies_df = sp500_companies_transformations(engine)
+    changes_df = sp500_changes_transformations(engine)
+    digest = hashlib.sha256()
+    digest.update(companies_df.select("ticker").sort("ticker").write_csv().encode())
+    digest.update(
+        changes_df.select("effective_date", "added_ticker", "removed_ticker")
+        .sort(pl.all())
+        .write_csv()
+        .encode()
+    )
+    return companies_df, changes_df, digest.hexdigest()
+
+
+def build_constituent_index(engine: db.Engine) -> ConstituentIndex:
+    """Builds the constituent index from the sp500_companies and sp500_changes tables."""
+    companies_df, changes_df, fingerprint = _source_tables(engine)
+    sessions = load_sessions()
+    trading_days = pl.Series("date", sessions, dtype=pl.Date)
+    open_end = sessions[-1].astype(dt.date) + dt.timedelta(days=1)
+    timeline_df = creating_sp500_index_timeline(changes_df, companies_df, trading_days)
+    return ConstituentIndex.from_timeline(timeline_df, open_end, fingerprint)
+
+
+def load_constituent_index(
+    engine: db.Engine | None = None,
+    path: Path | None = None,
+) -> ConstituentIndex:
+    """
+    Loads the persisted constituent index, rebuilding it when needed.
+
+    Without an engine the file is trusted as is. With one, the index is
+    rebuilt and saved again when the source tables changed since it was built.
+    """
+    path = path or config.CONSTITUENT_INDEX_PATH
+    index = ConstituentIndex.load(path) if path.exists() else None
+    if engine is None:
+        if index is None:
+            raise FileNotFoundError(f"No constituent index found at {path}.")
+        return index
+    if index is not None:
+        _, _, fingerprint = _source_tables(engine)
+        if fingerprint == index.fingerprint:
+            return index
+    logging.info("Building the S&P 500 constituent index...")
+    index = build_constituent_index(engine)
+    index.save(path)
+    logging.info(
+        f"Constituent index saved with {len(index.tickers)} tickers and "
+        f"{len(index.boundaries)} segments."
+    )
+    return index
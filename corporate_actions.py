@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import pandas as pd
+import polars as pl
+import sqlalchemy as db
+from typing import Sequence
+from database import get_table, load_data_to_db
+
+
+ACTIONS_TABLE = "corporate_actions"
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+ACTION_COLUMNS = ["dividends", "stock_splits"]
+FACTORS_SCHEMA = {
+    "ticker": pl.String,
+    "ex_date": pl.Date,
+    "price_factor": pl.Float64,
+    "volume_factor": pl.Float64,
+}
+# Sessions between the last price a unit loaded and the next ex-date, at most.
+REFERENCE_CLOSE_LOOKAHEAD = dt.timedelta(days=7)
+
+
+def extract_corporate_actions(data: pd.DataFrame | pl.DataFrame) -> pl.DataFrame:
+    """
+    Picks the splits and dividends out of a provider response.
+
+    Returns:
+        One row per (ticker, ex_date) with the raw dividend per share and the
+        split ratio (new shares per old share, 1.0 without a split).
+    """
+    df = pl.from_pandas(data) if isinstance(data, pd.DataFrame) else data
+    if df.is_empty() or not set(ACTION_COLUMNS) <= set(df.columns):
+        return pl.DataFrame(
+            schema={
+                "ticker": pl.String,
+                "ex_date": pl.Date,
+                "dividend": pl.Float64,
+                "split_ratio": pl.Float64,
+            }
+        )
+    dividend = pl.col("dividends").fill_nan(0.0).fill_null(0.0)
+    split = pl.col("stock_splits").fill_nan(0.0).fill_null(0.0)
+    return (
+        df.filter((dividend != 0) | ((split != 0) & (split != 1)))
+        .select(
+            pl.col("ticker").cast(pl.String),
+            pl.col("date").cast(pl.Date).alias("ex_date"),
+            dividend.cast(pl.Float64).alias("dividend"),
+            pl.when(split == 0)
+            .then(1.0)
+            .otherwise(split)
+            .cast(pl.Float64)
+            .alias("split_ratio"),
+        )
+        .unique(subset=["ticker", "ex_date"], keep="last")
+    )
+
+
+def load_corporate_actions(
+    data: pd.DataFrame | pl.DataFrame, engine: db.Engine
+) -> pl.DataFrame:
+    """
+    Upserts the splits and dividends of a provider response into corporate_actions.
+
+    Returns:
+        The tickers whose actions were inserted or changed, with the date
+        from which their adjusted prices changed (the earliest stored one).
+    """
+    actions = extract_corporate_actions(data)
+    changed = pl.DataFrame(schema={"ticker": pl.String, "date": pl.Date})
+    if actions.is_empty():
+        return changed
+    counts = load_data_to_db(
+        actions.to_dicts(),
+        ACTIONS_TABLE,
+        engine,
+        mode="upsert",
+        conflict_columns=("ticker", "ex_date"),
+    )
+    if not counts["inserted"] and not counts["updated"]:
+        return changed
+    # An action rescales every price before its ex-date.
+    return actions.select(pl.col("ticker").unique(), pl.lit(dt.date.min).alias("date"))
+
+
+def update_adjustment_factors(
+    engine: db.Engine,
+    tickers: Sequence[str] | None = None,
+    start_date: dt.date | str | None = None,
+    end_date: dt.date | str | None = None,
+) -> int:
+    """
+    Recomputes the adjustment factor of the corporate actions whose reference
+    close may have changed after prices of tickers were loaded from
+    start_date to end_date (exclusive).
+
+    The factor of an action scales the prices before its ex-date:
+    (1 - dividend / reference_close) / split_ratio, where reference_close is
+    the raw close of the previous session. Every other action keeps its
+    factor, so a new split or dividend only writes its own row.
+
+    Returns:
+        Number of actions updated.
+    """
+    actions = get_table(engine, ACTIONS_TABLE)
+    prices = db.table(
+        "stock_prices",
+        db.column("ticker"),
+        db.column("date", db.Date),
+        db.column("close"),
+    )
+    conditions = []
+    if tickers is not None:
+        conditions.append(actions.c.ticker.in_(list(tickers)))
+    if start_date is not None:
+        conditions.append(actions.c.ex_date >= dt.date.fromisoformat(str(start_date)))
+    if end_date is not None:
+        conditions.append(
+            actions.c.ex_date
+            <= dt.date.fromisoformat(str(end_date)) + REFERENCE_CLOSE_LOOKAHEAD
+        )
+    reference_close = (
+        db.select(prices.c.close)
+        .where(prices.c.ticker == actions.c.ticker, prices.c.date < actions.c.ex_date)
+        .order_by(prices.c.date.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    factor = db.case(
+        (
+            actions.c.reference_close > actions.c.dividend,
+            (1.0 - actions.c.dividend / actions.c.reference_close)
+            / actions.c.split_ratio,
+        ),
+        else_=1.0 / actions.c.split_ratio,
+    )
+    with engine.begin() as connection:
+        updated = connection.execute(
+            actions.update().where(*conditions).values(reference_close=reference_close)
+        ).rowcount
+        connection.execute(
+            actions.update()
+            .where(*conditions)
+            .values(factor=factor, updated_at=db.func.now())
+        )
+    return updated
+
+
+def cumulative_factors(actions: pl.DataFrame) -> pl.DataFrame:
+    """
+    Turns per-action factors into the multipliers of the rows before each ex-date.
+
+    A row dated before an ex-date is scaled by the product of the factors of
+    that action and of every later one of its ticker, which is a reverse
+    cumulative product per ticker.
+
+    Args:
+        actions: ticker, ex_date, factor (null for a split-only factor) and
+            split_ratio.
+    """
+    if actions.is_empty():
+        return pl.DataFrame(schema=FACTORS_SCHEMA)
+    factor = pl.col("factor").fill_null(1.0 / pl.col("split_ratio"))
+    return (
+        actions.sort("ticker", "ex_date")
+        .select(
+            "ticker",
+            "ex_date",
+            factor.reverse().cum_prod().reverse().over("ticker").alias("price_factor"),
+            pl.col("split_ratio")
+            .reverse()
+            .cum_prod()
+            .reverse()
+            .over("ticker")
+            .alias("volume_factor"),
+        )
+        .cast(FACTORS_SCHEMA)
+    )
+
+
+def scan_adjustment_factors(
+    engine: db.Engine, tickers: list[str] | None = None
+) -> pl.DataFrame:
+    """Cumulative adjustment factors of the stored corporate actions of tickers."""
+    if not db.inspect(engine).has_table(ACTIONS_TABLE):
+        return pl.DataFrame(schema=FACTORS_SCHEMA)
+    actions = get_table(engine, ACTIONS_TABLE)
+    query = db.select(
+        actions.c.ticker, actions.c.ex_date, actions.c.factor, actions.c.split_ratio
+    )
+    if tickers is not None:
+        query = query.where(actions.c.ticker.in_(tickers))
+    df = pl.read_database(query, engine)
+    if df.is_empty():
+        return pl.DataFrame(schema=FACTORS_SCHEMA)
+    return cumulative_factors(
+        df.with_columns(
+            pl.col("ticker").str.strip_chars(),
+            pl.col("ex_date").cast(pl.Date),
+            pl.col("factor").cast(pl.Float64),
+            pl.col("split_ratio").cast(pl.Float64),
+        )
+    )
+
+
+def apply_factors(prices: pl.LazyFrame, factors: pl.DataFrame) -> pl.LazyFrame:
+    """
+    Scales raw price rows by the cumulative factors of the later ex-dates.
+
+    Prices are multiplied by price_factor and volumes by volume_factor, only
+    for the columns present in prices. Rows on or after the last ex-date of
+    their ticker are left as they are.
+    """
+    if factors.is_empty():
+        return prices
+    names = prices.collect_schema().names()
+    adjusted = [
+        (pl.col(name) * pl.col("price_factor").fill_null(1.0)).alias(name)
+        for name in PRICE_COLUMNS
+        if name in names
+    ]
+    if "volume" in names:
+        adjusted.append(
+            (pl.col("volume") * pl.col("volume_factor").fill_null(1.0))
+            .round()
+            .cast(pl.Int64)
+            .alias("volume")
+        )
+    # Both sides are sorted on the join keys, which polars can't verify with by.
+    return (
+        prices.sort("date")
+        .join_asof(
+            factors.lazy().sort("ex_date"),
+            left_on="date",
+            right_on="ex_date",
+            by="ticker",
+            strategy="forward",
+            allow_exact_matches=False,
+            check_sortedness=False,
+        )
+        .with_columns(adjusted)
+        .select(names)
+    )
+
+
+def unadjust_splits(data: pd.DataFrame, splits: pl.DataFrame) -> pd.DataFrame:
+    """
+    Reverts the split adjustment of provider prices.
+
+    Yahoo Finance scales the prices, volumes and dividends before a split by
+    the split ratio, even without auto_adjust. Dividing by the cumulative
+    split factor of the later splits gives back the prices as traded.
+
+    Args:
+        data: Provider response with ticker, date, prices, volume and dividends.
+        splits: ticker, ex_date and split_ratio of every split after the
+            first row of data.
+    """
+    if splits.is_empty() or data.empty:
+        return data
+    factors = cumulative_factors(
+        splits.select(
+            pl.col("ticker").cast(pl.String),
+            pl.col("ex_date").cast(pl.Date),
+            (1.0 / pl.col("split_ratio")).alias("factor"),
+            pl.col("split_ratio").cast(pl.Float64),
+        ).unique(subset=["ticker", "ex_date"])
+    )
+    df = pl.from_pandas(data).with_columns(pl.col("date").cast(pl.Date))
+    # Undoing a split multiplies prices by the ratio the adjustment divided by.
+    inverse = factors.with_columns(
+        (1.0 / pl.col("price_factor")).alias("price_factor"),
+        (1.0 / pl.col("volume_factor")).alias("volume_factor"),
+    )
+    raw = apply_factors(df.lazy(), inverse)
+    if "dividends" in df.columns:
+        raw = raw.join_asof(
+            inverse.lazy().select("ticker", "ex_date", "price_factor").sort("ex_date"),
+            left_on="date",
+            right_on="ex_date",
+            by="ticker",
+            strategy="forward",
+            allow_exact_matches=False,
+            check_sortedness=False,
+        ).with_columns(
+            (pl.col("dividends") * pl.col("price_factor").fill_null(1.0)).alias(
+                "dividends"
+            )
+        )
+    result = raw.select(df.columns).sort("ticker", "date").collect().to_pandas()
+    result["date"] = pd.to_datetime(result["date"])
+    return result
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+S&P 500 price ETL as an Airflow DAG.
+
+The steps of main.py run as separate tasks, and the fetch/load step is
+dynamically mapped over shards of the planned provider requests, so a
+backfill spreads across the Celery workers and a failed shard is retried on
+its own. Run it locally against the fake provider with:
+
+    PYTHONPATH=. python dags/investbot_etl.py
+"""
+
+import config
+import datetime as dt
+import logging
+import pendulum
+from airflow.sdk import Param, dag, get_current_context, task
+from database import get_engine
+from utils import date_range
+
+# The ETL modules are imported inside the tasks, so that parsing this file on
+# the scheduler stays cheap.
+
+
+def _fetch_function(provider: str):
+    """Price fetch function of the provider selected in the run parameters."""
+    if provider == "fake":
+        from fake_provider import FakePriceProvider
+
+        return FakePriceProvider(latency=(0.0, 0.01)).fetch
+    from data_sourcing import fetch_historical_data
+
+    return fetch_historical_data
+
+
+@dag(
+    dag_id="investbot_etl",
+    schedule="0 18 * * 1-5",
+    start_date=pendulum.datetime(2025, 1, 1, tz=config.MARKET_TIMEZONE),
+    catchup=False,
+    max_active_runs=1,
+    default_args={"retries": 1, "retry_delay": dt.timedelta(minutes=5)},
+    params={
+        "provider": Param("yahoo", enum=["yahoo", "fake"]),
+        "refresh_constituents": Param(True, type="boolean"),
+        "months": Param(config.SP500_STOCK_PRICE_RANGE, type="integer", minimum=1),
+    },
+    tags=["investbot"],
+)
+def investbot_etl():
+    @task
+    def setup_tables() -> None:
+        from database import (
+            create_corporate_actions_table,
+            create_feature_dirty_table,
+            create_price_table,
+            create_price_coverage_table,
+            create_price_quarantine_table,
+            create_sp500_companies_table,
+            create_sp500_changes_table,
+            create_unavailable_prices_table,
+            create_work_units_table,
+        )
+        from price_coverage import ensure_price_coverage
+
+        engine = get_engine(config.POSTGRES_URL)
+        create_price_table(engine)
+        create_price_coverage_table(engine)
+        ensure_price_coverage(engine)
+        create_corporate_actions_table(engine)
+        create_price_quarantine_table(engine)
+        create_feature_dirty_table(engine)
+        create_sp500_companies_table(engine)
+        create_sp500_changes_table(engine)
+        create_work_units_table(engine)
+        create_unavailable_prices_table(engine)
+
+    @task
+    def refresh_constituents() -> None:
+        from constituent_index import load_constituent_index
+        from data_sourcing import get_sp500_companies_data
+
+        engine = get_engine(config.POSTGRES_URL)
+        if get_current_context()["params"]["refresh_constituents"]:
+            get_sp500_companies_data(
+                config.SP_500_URL,
+                config.LAST_MODIFIED_SP500_DATE_FILE_PATH,
+                tables_ids=["constituents", "changes"],
+                engine=engine,
+            )
+        load_constituent_index(engine)
+
+    @task
+    def plan_shards() -> list[dict]:
+        from request_planner import (
+            format_request_plan,
+            plan_price_requests,
+            shard_requests,
+        )
+        from transformations import get_missing_price_ranges
+        from work_ledger import record_work_units
+
+        start_date, end_date = date_range(
+            months=get_current_context()["params"]["months"]
+        )
+        engine = get_engine(config.POSTGRES_URL)
+        missing_ranges = get_missing_price_ranges(start_date, end_date, engine)
+        plan = plan_price_requests(
+            missing_ranges,
+            request_overhead=config.PLANNER_REQUEST_OVERHEAD,
+            row_cost=config.PLANNER_ROW_COST,
+            max_tickers=config.FETCH_SUB_BATCH_SIZE,
+        )
+        if not plan:
+            logging.info("No missing data found.")
+            return []
+        logging.info(format_request_plan(plan))
+        record_work_units(engine, plan)
+        return [
+            {"shard": number, "requests": requests}
+            for number, requests in enumerate(
+                shard_requests(plan, config.DAG_FETCH_SHARDS)
+            )
+        ]
+
+    @task(
+        retries=3,
+        retry_delay=dt.timedelta(minutes=2),
+        retry_exponential_backoff=True,
+        max_active_tis_per_dagrun=config.DAG_MAX_ACTIVE_SHARDS,
+    )
+    def fetch_and_load(shard: dict) -> dict:
+        from fetch_scheduler import TokenBucket
+        from price_sync import load_price_requests
+
+        engine = get_engine(config.POSTGRES_URL)
+        # Shards run concurrently against the same provider, so each one gets
+        # its share of the overall request rate.
+        limiter = TokenBucket(
+            rate=config.FETCH_RATE_PER_SECOND / config.DAG_MAX_ACTIVE_SHARDS,
+            capacity=config.FETCH_BURST,
+        )
+        fetch = _fetch_function(get_current_context()["params"]["provider"])
+        # The price panel has a single writer, refresh_price_panel, and
+        # refresh_features marks every planned range once all shards are done.
+        stats = load_price_requests(
+            engine,
+            shard["requests"],
+            fetch,
+            limiter,
+            update_panel=False,
+            mark_features=False,
+        )
+        logging.info(f"Shard {shard['shard']} loaded: {stats}")
+        if stats["failed"]:
+            raise RuntimeError(
+                f"{stats['failed']} of {stats['requests']} requests of shard "
+                f"{shard['shard']} failed."
+            )
+        return stats
+
+    @task(trigger_rule="none_failed")
+    def validate() -> dict:
+        import polars as pl
+        from transformations import get_missing_price_ranges, scan_stock_prices
+
+        start_date, end_date = date_range(
+            months=get_current_context()["params"]["months"]
+        )
+        engine = get_engine(config.POSTGRES_URL)
+        remaining = get_missing_price_ranges(start_date, end_date, engine)
+        invalid_bars = (
+            scan_stock_prices(
+                engine, start_date=start_date, end_date=end_date, source="database"
+            )
+            .filter(
+                (pl.col("close") <= 0)
+                | (pl.col("high") < pl.col("low"))
+                | (pl.col("volume") < 0)
+            )
+            .select(pl.len())
+            .collect()
+            .item()
+        )
+        if remaining:
+            logging.warning(
+                f"{len(remaining)} missing price ranges remain after the load."
+            )
+        if invalid_bars:
+            raise ValueError(f"{invalid_bars} stored bars are invalid.")
+        return {"missing_ranges": len(remaining), "invalid_bars": invalid_bars}
+
+    @task
+    def refresh_features(shards: list[dict]) -> None:
+        import polars as pl
+        from corporate_actions import scan_adjustment_factors
+        from feature_store import mark_features_dirty, update_features
+
+        # The shards don't mark what they load: every planned range is marked
+        # here, in one upsert, before the incremental update.
+        planned = pl.DataFrame(
+            [
+                {"ticker": ticker, "date": dt.date.fromisoformat(request["start_date"])}
+                for shard in shards
+                for request in shard["requests"]
+                for ticker in request["tickers"]
+            ],
+            schema={"ticker": pl.String, "date": pl.Date},
+        )
+        engine = get_engine(config.POSTGRES_URL)
+        if not planned.is_empty():
+            # A corporate action in a loaded range rescales every earlier price.
+            adjusted = (
+                scan_adjustment_factors(engine, planned["ticker"].unique().to_list())
+                .join(planned, on="ticker")
+                .filter(pl.col("ex_date") >= pl.col("date"))
+                .select("ticker", pl.lit(dt.date.min).alias("date"))
+            )
+            mark_features_dirty(pl.concat([planned, adjusted]), engine)
+        update_features(engine)
+
+    @task
+    def refresh_price_panel(shards: list[dict]) -> None:
+        from price_panel import update_price_panel
+
+        engine = get_engine(config.POSTGRES_URL)
+        written = 0
+        for shard in shards:
+            for request in shard["requests"]:
+                written += update_price_panel(
+                    engine,
+                    request["tickers"],
+                    request["start_date"],
+                    request["end_date"],
+                )
+        logging.info(f"{written} price rows written to the price panel.")
+
+    shards = plan_shards()
+    loads = fetch_and_load.expand(shard=shards)
+    checks = validate()
+    setup_tables() >> refresh_constituents() >> shards
+    loads >> checks >> [refresh_features(shards), refresh_price_panel(shards)]
+
+
+etl_dag = investbot_etl()
+
+
+if __name__ == "__main__":
+    etl_dag.test(run_conf={"provider": "fake", "refresh_constituents": False})
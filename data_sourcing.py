@@ -1,24 +1,73 @@
 # *-* coding: utf-8 *-*
 
 import config
+import contextlib
+import datetime as dt
+import json
 import logging
+import metrics
+import multiprocessing
 import pandas as pd
+import polars as pl
 import requests
+import sqlalchemy as db
+import threading
+import time
 import yfinance as yf
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from corporate_actions import unadjust_splits
 from database import get_engine, load_data_to_db
-from pandas_market_calendars import get_calendar
-from utils import snake_case, parse_wikipedia_table, save_missing_data_to_json
+from negative_cache import (
+    NO_DATA,
+    classify_provider_error,
+    report_missing_sessions,
+    report_unavailable,
+)
+from trading_calendar import last_closed_session, sessions_between
+from utils import (
+    extract_wikipedia_tables,
+    snake_case,
+    table_content_hash,
+)
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Iterator
+
+if TYPE_CHECKING:
+    from fetch_scheduler import TokenBucket
+
+
+def _read_table_hashes(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read table hashes file: {e}")
+        return {}
+
+
+def _table_has_rows(engine: db.Engine, table_name: str) -> bool:
+    with engine.connect() as connection:
+        return (
+            connection.execute(db.text(f"SELECT 1 FROM {table_name} LIMIT 1")).first()
+            is not None
+        )
 
 
 def get_sp500_companies_data(
     sp500_source: str,
     last_change_date_file: Path,
     tables_ids: list[str] = ["constituents", "changes"],
-) -> pd.DataFrame:
-    """Fetches S&P 500 companies data from the given URL and returns it as a DataFrame."""
+    engine: db.Engine | None = None,
+    table_hashes_file: Path = config.SP500_TABLE_HASHES_FILE_PATH,
+) -> None:
+    """
+    Fetches the S&P 500 constituents and changes tables and loads them into the database.
+
+    The page is only downloaded when it changed since the stored Last-Modified
+    date, and each table is only rewritten when the hash of its parsed rows
+    differs from the one recorded at its last load.
+    """
     (last_change_date_file.parent.mkdir(parents=True, exist_ok=True))
     try:
         last_stored_date = last_change_date_file.read_text(encoding="utf-8").strip()
@@ -36,7 +85,6 @@ def get_sp500_companies_data(
     elif response.status_code != 200:
         logging.error(f"Failed to fetch S&P 500 data: HTTP {response.status_code}")
     else:
-        soup = BeautifulSoup(response.text, "lxml")
         last_modified = response.headers.get("Last-Modified", "")
         try:
             with last_change_date_file.open("w", encoding="utf-8") as file:
@@ -45,58 +93,280 @@ def get_sp500_companies_data(
             logging.error(
                 f"Could not write last modified date ({last_modified}) to file: {e}"
             )
-        for table_id in tables_ids:
-            table = soup.find("table", {"id": table_id})
-            data = parse_wikipedia_table(table)
-            db_engine = get_engine(config.POSTGRES_URL)
+        engine = engine or get_engine(config.POSTGRES_URL)
+        table_hashes = _read_table_hashes(table_hashes_file)
+        tables = extract_wikipedia_tables(response.content, tables_ids)
+        for table_id, data in tables.items():
             table_name = (
                 f"sp500_{'companies' if table_id == 'constituents' else 'changes'}"
             )
-            load_data_to_db(data, table_name, db_engine, mode="overwrite")
+            content_hash = table_content_hash(data)
+            if table_hashes.get(table_id) == content_hash and _table_has_rows(
+                engine, table_name
+            ):
+                logging.info(f"Table '{table_id}' is unchanged, skipping its load.")
+                continue
+            load_counts = load_data_to_db(data, table_name, engine, mode="replace")
+            if load_counts["inserted"] or not data:
+                table_hashes[table_id] = content_hash
+        table_hashes_file.parent.mkdir(parents=True, exist_ok=True)
+        table_hashes_file.write_text(
+            json.dumps(table_hashes, indent=2), encoding="utf-8"
+        )
+
+
+class ProviderRateLimitError(Exception):
+    """Raised when the price provider rejects a request for rate limiting."""
+
+
+class ProviderError(Exception):
+    """Raised when a price provider request fails, with the provider's message."""
+
+
+# yf.download keeps its results and errors in module-level state, so each call
+# runs in a process of this pool, where calls made concurrently by the fetch
+# scheduler's workers can't overwrite each other's state.
+_provider_pool: ProcessPoolExecutor | None = None
+_provider_pool_lock = threading.Lock()
+# Provider columns that are derived from the raw bars and not stored.
+_DERIVED_COLUMNS = ["Adj Close", "Capital Gains"]
+_SPLITS_SCHEMA = {"ticker": pl.String, "ex_date": pl.Date, "split_ratio": pl.Float64}
+# Splits fetched by _fetch_later_splits, per (ticker, after_date).
+_later_splits: dict[tuple[str, str], pl.DataFrame] = {}
+_later_splits_lock = threading.Lock()
+# Limiter of the fetch running in each thread, see limit_provider_requests.
+_request_limiter = threading.local()
+
+
+def _download_in_worker(
+    tickers: list[str], options: dict
+) -> tuple[pd.DataFrame | None, dict[str, str], str | None]:
+    """
+    Runs yf.download in a provider process.
+
+    Returns:
+        The data and the per-ticker errors, or the repr of the exception
+        the call raised.
+    """
+    try:
+        data = yf.download(tickers, **options)
+    except Exception as e:
+        return None, {}, repr(e)
+    return data, dict(yf.shared._ERRORS), None
+
+
+def _download(tickers: list[str], **options) -> tuple[pd.DataFrame | None, dict]:
+    """
+    Calls yf.download in the provider pool, recording it as a provider request.
+
+    Returns:
+        The data and the errors Yahoo Finance reported per ticker.
+
+    Raises:
+        ProviderRateLimitError: If Yahoo Finance rate limited the call or any
+            of its tickers.
+        ProviderError: If the call failed.
+    """
+    global _provider_pool
+    with _provider_pool_lock:
+        if _provider_pool is None:
+            _provider_pool = ProcessPoolExecutor(
+                max_workers=config.FETCH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    started = time.perf_counter()
+    try:
+        data, errors, failure = _provider_pool.submit(
+            _download_in_worker, tickers, options
+        ).result()
+    finally:
+        metrics.observe("provider_request_seconds", time.perf_counter() - started)
+        metrics.increment("provider_requests")
+    if failure is not None:
+        if "YFRateLimitError" in failure:
+            raise ProviderRateLimitError(failure)
+        raise ProviderError(failure)
+    rate_limited = [
+        ticker for ticker, error in errors.items() if "YFRateLimitError" in error
+    ]
+    if rate_limited:
+        raise ProviderRateLimitError(
+            f"Rate limited by Yahoo Finance for {len(rate_limited)} tickers."
+        )
+    return data, errors
+
+
+@contextlib.contextmanager
+def limit_provider_requests(limiter: "TokenBucket") -> Iterator[None]:
+    """
+    Makes the extra provider requests of a fetch take a token from limiter.
+
+    The fetch scheduler takes one token per unit; requests a fetch makes on
+    top of its main download, in the same thread, take theirs through this.
+    """
+    previous = getattr(_request_limiter, "limiter", None)
+    _request_limiter.limiter = limiter
+    try:
+        yield
+    finally:
+        _request_limiter.limiter = previous
+
+
+def _acquire_extra_request() -> None:
+    """Waits for a token of the current fetch's limiter, if it has one."""
+    limiter = getattr(_request_limiter, "limiter", None)
+    if limiter is not None:
+        limiter.acquire()
+
+
+def _splits_frame(data: pd.DataFrame) -> pl.DataFrame:
+    """Splits (ticker, ex_date, split_ratio) of a stacked provider response."""
+    return (
+        pl.from_pandas(data[["date", "ticker", "stock_splits"]])
+        .filter(pl.col("stock_splits").is_not_nan() & (pl.col("stock_splits") > 0))
+        .filter(pl.col("stock_splits") != 1)
+        .select(
+            pl.col("ticker").cast(pl.String),
+            pl.col("date").cast(pl.Date).alias("ex_date"),
+            pl.col("stock_splits").cast(pl.Float64).alias("split_ratio"),
+        )
+        .cast(_SPLITS_SCHEMA)
+    )
+
+
+def _fetch_later_splits(tickers: list[str], after_date: str) -> pl.DataFrame:
+    """
+    Fetches the splits of tickers from after_date to today.
+
+    Quarterly bars are requested, as only the split events are needed, and
+    the splits of each ticker are fetched once per run and after_date, as
+    the units of a run mostly share their end date. A quarterly bar is dated
+    by its first session, so ex-dates earlier than after_date are moved to
+    it, which is all the adjustment of the previous sessions needs. Nothing
+    is requested when no session on or after after_date has closed yet, as
+    in tail updates, and the request takes its own rate limiter token.
+    """
+    if not tickers or dt.date.fromisoformat(after_date) > last_closed_session():
+        return pl.DataFrame(schema=_SPLITS_SCHEMA)
+    with _later_splits_lock:
+        missing = [t for t in tickers if (t, after_date) not in _later_splits]
+    if missing:
+        _acquire_extra_request()
+        data, _ = _download(
+            missing,
+            start=after_date,
+            interval="3mo",
+            actions=True,
+            auto_adjust=False,
+            progress=False,
+            ignore_tz=True,
+        )
+        splits = pl.DataFrame(schema=_SPLITS_SCHEMA)
+        if data is not None and not data.empty and "Stock Splits" in data.columns:
+            splits = _splits_frame(
+                data["Stock Splits"]
+                .rename_axis(index="date", columns="ticker")
+                .stack(future_stack=True)
+                .rename("stock_splits")
+                .reset_index()
+            ).with_columns(
+                pl.max_horizontal(
+                    "ex_date", pl.lit(dt.date.fromisoformat(after_date))
+                ).alias("ex_date")
+            )
+        with _later_splits_lock:
+            for ticker in missing:
+                _later_splits[(ticker, after_date)] = splits.filter(
+                    pl.col("ticker") == ticker
+                )
+    with _later_splits_lock:
+        return pl.concat([_later_splits[(t, after_date)] for t in tickers])
 
 
 def fetch_historical_data(
     tickers: str | list[str], start_date: str, end_date: str
 ) -> pd.DataFrame | None:
-    "Fetches historical stock data from Yahoo Finance."
+    """
+    Fetches historical stock data from Yahoo Finance.
+
+    Bars are returned as traded: dividends and splits are not adjusted for,
+    and come back as the dividends and stock_splits columns (see
+    corporate_actions.py). Yahoo Finance adjusts prices for splits even
+    without auto_adjust, so that adjustment is reverted with the splits of
+    the response and of the sessions after end_date.
+
+    Tickers and sessions the provider has no data for, or reports an error
+    for, are queued in the negative cache of unavailable ranges.
+
+    Raises:
+        ProviderRateLimitError: If Yahoo Finance rate limited any of the tickers,
+            so the caller can retry the whole request later.
+    """
     if isinstance(tickers, list) and len(tickers) == 0:
         logging.warning("No tickers provided for data fetching.")
         return None
-    else:
-        try:
-            data = yf.download(
-                tickers, start=start_date, end=end_date, progress=False, ignore_tz=True
-            )
-        except yf.utils.YFRateLimitError:
-            logging.error("Rate limit exceeded when fetching data from Yahoo Finance.")
+    tickers = [tickers] if isinstance(tickers, str) else tickers
+    try:
+        data, errors = _download(
+            tickers,
+            start=start_date,
+            end=end_date,
+            actions=True,
+            auto_adjust=False,
+            progress=False,
+            ignore_tz=True,
+        )
+    except ProviderError as e:
+        message = str(e)
+        if "PricesMissing" not in message and "TzMissing" not in message:
+            logging.error(f"Error fetching data from Yahoo Finance: {message}")
             return None
-        except yf.utils.YFMissingDataError or yf.utils.YFTzMissingError:
-            logging.error("No data found for the given tickers and date range.")
-            save_missing_data_to_json(
-                start_date=start_date,
-                end_date=end_date,
-                tickers=tickers,
-                path=config.MISSING_DATA_LOG_FOLDER,
-            )
-        except Exception as e:
-            logging.error(f"Error fetching data from Yahoo Finance: {e}")
-        if data.empty:
-            logging.warning(
-                f"No data found for {', '.join(tickers)} in the given date range."
+        logging.error("No data found for the given tickers and date range.")
+        report_unavailable(
+            tickers, start_date, end_date, classify_provider_error(message), message
+        )
+        return None
+    for ticker, error in errors.items():
+        if ticker in tickers:
+            report_unavailable(
+                [ticker], start_date, end_date, classify_provider_error(error), error
             )
-            return None
-
-        logging.info(
-            f"Successfully fetched {len(data)} records for {', '.join(tickers)}."
+    if data is None or data.empty:
+        logging.warning(
+            f"No data found for {len(tickers)} tickers in the given date range."
         )
-        adj_data = (
-            data.stack(level=1, future_stack=True)
-            .rename_axis(index=["Date", "Ticker"])
-            .reset_index()
+        report_unavailable(
+            [ticker for ticker in tickers if ticker not in errors],
+            start_date,
+            end_date,
+            NO_DATA,
         )
-        adj_columns = [snake_case(col) for col in adj_data.columns]
-        adj_data.columns = adj_columns
-        return adj_data
+        return None
+
+    logging.info(
+        f"Successfully fetched {len(data)} records for {len(tickers)} tickers."
+    )
+    later_splits = _fetch_later_splits(
+        [ticker for ticker in tickers if ticker not in errors], end_date
+    )
+    data = data.drop(columns=_DERIVED_COLUMNS, level=0, errors="ignore")
+    adj_data = (
+        data.stack(level=1, future_stack=True)
+        .rename_axis(index=["Date", "Ticker"])
+        .reset_index()
+    )
+    adj_columns = [snake_case(col) for col in adj_data.columns]
+    adj_data.columns = adj_columns
+    adj_data = unadjust_splits(
+        adj_data, pl.concat([_splits_frame(adj_data), later_splits])
+    )
+    report_missing_sessions(
+        adj_data,
+        [ticker for ticker in tickers if ticker not in errors],
+        start_date,
+        end_date,
+    )
+    return adj_data
 
 
 def converting_list_of_dicts_to_dataframe(data: list[dict[str, Any]]) -> pd.DataFrame:
@@ -112,6 +382,5 @@ def converting_list_of_dicts_to_dataframe(data: list[dict[str, Any]]) -> pd.Data
 
 def get_market_working_days(start_date: str, end_date: str) -> pd.DatetimeIndex:
     """Returns a list of market working days between start_date and end_date."""
-    nyse_calendar = get_calendar("NYSE")
-    valid_dates = nyse_calendar.valid_days(start_date=start_date, end_date=end_date)
-    return valid_dates
+    valid_dates = sessions_between(start_date, end_date)
+    return pd.DatetimeIndex(valid_dates).tz_localize("UTC")
@@ -1,17 +1,110 @@
 # (*-coding: utf-8 -*)
 
+import config
+import csv
+import datetime as dt
+import io
+import re
+import threading
+import weakref
 import sqlalchemy as db
 import logging
+import polars as pl
+from sqlalchemy.dialects import postgresql, sqlite
 
 from pathlib import Path
+from typing import Callable
+from price_notifications import notify_price_load
+
+
+STAGING_SUFFIX = "_staging"
+_DDL_PATTERN = re.compile(
+    r"\s*(?:CREATE|ALTER|DROP)\b.*?\b(?:TABLE|VIEW)\s+"
+    r"(?:IF\s+(?:NOT\s+)?EXISTS\s+)?\"?(\w+)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_engines: dict[str, db.Engine] = {}
+_engines_lock = threading.Lock()
+_schema_cache: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_schema_lock = threading.Lock()
 
 
 def get_engine(db_url: Path) -> db.Engine:
-    """Creates a database engine instance."""
-    engine = db.create_engine(db_url)
+    """
+    Returns the process-wide engine for db_url, creating it on first use.
+
+    Engines keep a pool of connections checked with a ping before use and
+    recycled periodically, so every module shares the same connections.
+    """
+    db_url = str(db_url)
+    with _engines_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            options = {"pool_pre_ping": True}
+            if not db_url.startswith("sqlite"):
+                options.update(
+                    pool_size=config.DB_POOL_SIZE,
+                    max_overflow=config.DB_MAX_OVERFLOW,
+                    pool_timeout=config.DB_POOL_TIMEOUT,
+                    pool_recycle=config.DB_POOL_RECYCLE,
+                )
+            engine = db.create_engine(db_url, **options)
+            _engines[db_url] = engine
     return engine
 
 
+def dispose_engines() -> None:
+    """Closes the pooled connections of every registered engine."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def _engine_schema(engine: db.Engine) -> dict:
+    schema = _schema_cache.get(engine)
+    if schema is None:
+        schema = _schema_cache[engine] = {"tables": {}, "views": None}
+    return schema
+
+
+def get_table(engine: db.Engine, table_name: str) -> db.Table:
+    """Reflects table_name once per engine and serves it from the cache afterwards."""
+    with _schema_lock:
+        table = _engine_schema(engine)["tables"].get(table_name)
+    if table is None:
+        table = db.Table(table_name, db.MetaData(), autoload_with=engine)
+        with _schema_lock:
+            _engine_schema(engine)["tables"][table_name] = table
+    return table
+
+
+def get_view_names(engine: db.Engine) -> set[str]:
+    """Cached names of the views of the database."""
+    with _schema_lock:
+        views = _engine_schema(engine)["views"]
+    if views is None:
+        views = set(db.inspect(engine).get_view_names())
+        with _schema_lock:
+            _engine_schema(engine)["views"] = views
+    return views
+
+
+def invalidate_schema_cache(engine: db.Engine) -> None:
+    """Drops the cached reflections of an engine."""
+    with _schema_lock:
+        _schema_cache.pop(engine, None)
+
+
+@db.event.listens_for(db.Engine, "after_cursor_execute")
+def _invalidate_on_ddl(connection, cursor, statement, parameters, context, executemany):
+    """Invalidates the cached reflections whenever a table or view is changed."""
+    match = _DDL_PATTERN.match(statement)
+    if match and not match.group(1).endswith(STAGING_SUFFIX):
+        invalidate_schema_cache(connection.engine)
+
+
 def create_sp500_companies_table(engine):
     """Creates the sp500_companies table if it doesn't exist."""
     metadata = db.MetaData()
@@ -55,8 +148,127 @@ def create_sp500_changes_table(engine):
     logging.info("Table 'sp500_cohanges' is ready.")
 
 
-def create_price_table(engine: db.Engine) -> None:
-    """Creates the stock_prices table if it doesn't exist."""
+COMPACT_PRICE_VIEW_SQL = """
+CREATE OR REPLACE VIEW stock_prices AS
+SELECT t.ticker, b.date, b.open, b.high, b.low, b.close, b.volume
+FROM stock_price_bars AS b
+JOIN tickers AS t ON t.ticker_id = b.ticker_id
+"""
+
+
+def _compact_price_tables() -> tuple[db.MetaData, db.Table, db.Table]:
+    """Describes the tickers dimension and the partitioned stock_price_bars table."""
+    metadata = db.MetaData()
+    tickers = db.Table(
+        "tickers",
+        metadata,
+        db.Column("ticker_id", db.Integer, db.Identity(), primary_key=True),
+        db.Column("ticker", db.String(10), nullable=False, unique=True),
+    )
+    bars = db.Table(
+        "stock_price_bars",
+        metadata,
+        db.Column(
+            "ticker_id",
+            db.Integer,
+            db.ForeignKey("tickers.ticker_id"),
+            primary_key=True,
+        ),
+        db.Column("date", db.Date, primary_key=True),
+        db.Column("open", db.Float, nullable=True),
+        db.Column("high", db.Float, nullable=True),
+        db.Column("low", db.Float, nullable=True),
+        db.Column("close", db.Float, nullable=True),
+        db.Column("volume", db.BigInteger, nullable=True),
+        db.Index("ix_stock_price_bars_date_brin", "date", postgresql_using="brin"),
+        postgresql_partition_by="RANGE (date)",
+    )
+    return metadata, tickers, bars
+
+
+def ensure_price_partitions(
+    connection: db.Connection, first_year: int, last_year: int
+) -> None:
+    """Creates the yearly stock_price_bars partitions and a default one."""
+    for year in range(first_year, last_year + 1):
+        connection.execute(
+            db.text(
+                f"CREATE TABLE IF NOT EXISTS stock_price_bars_{year} "
+                "PARTITION OF stock_price_bars "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+        )
+    connection.execute(
+        db.text(
+            "CREATE TABLE IF NOT EXISTS stock_price_bars_default "
+            "PARTITION OF stock_price_bars DEFAULT"
+        )
+    )
+
+
+def _widen_ticker_ids(connection: db.Connection) -> None:
+    """Moves ticker keys created as SMALLINT, with at most 32767 ids, to INTEGER."""
+    narrow = connection.execute(
+        db.text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'tickers' AND column_name = 'ticker_id' "
+            "AND data_type = 'smallint' AND table_schema = current_schema()"
+        )
+    ).first()
+    if narrow is None:
+        return
+    # The view depends on both columns and is recreated by the caller.
+    connection.execute(db.text("DROP VIEW IF EXISTS stock_prices"))
+    connection.execute(
+        db.text("ALTER TABLE stock_price_bars ALTER COLUMN ticker_id TYPE INTEGER")
+    )
+    connection.execute(
+        db.text("ALTER TABLE tickers ALTER COLUMN ticker_id TYPE INTEGER")
+    )
+    logging.info("Widened the ticker_id keys of the compact price storage to INTEGER.")
+
+
+def create_compact_price_tables(
+    engine: db.Engine, first_year: int = 1990, last_year: int | None = None
+) -> None:
+    """
+    Creates the compact PostgreSQL price storage behind the stock_prices view.
+
+    Tickers are stored once in the tickers dimension and referenced by an
+    INTEGER key. Bars live in stock_price_bars, keyed by (ticker_id, date)
+    without a surrogate id, range partitioned by year and BRIN indexed on
+    date. The stock_prices view keeps the original column layout for readers.
+    """
+    last_year = last_year or dt.date.today().year + 1
+    metadata, _, _ = _compact_price_tables()
+    with engine.begin() as connection:
+        metadata.create_all(connection)
+        _widen_ticker_ids(connection)
+        ensure_price_partitions(connection, first_year, last_year)
+        connection.execute(db.text(COMPACT_PRICE_VIEW_SQL))
+    logging.info("Compact price storage and 'stock_prices' view are ready.")
+
+
+def create_price_table(
+    engine: db.Engine, first_year: int = 1990, last_year: int | None = None
+) -> None:
+    """
+    Creates the stock_prices table if it doesn't exist.
+
+    On PostgreSQL prices use the compact layout from create_compact_price_tables,
+    unless a legacy stock_prices table is still in place. Other databases get a
+    plain table.
+    """
+    if engine.dialect.name == "postgresql":
+        if "stock_prices" in db.inspect(engine).get_table_names():
+            logging.warning(
+                "Table 'stock_prices' uses the legacy layout, "
+                "run main.py --migrate-storage to convert it."
+            )
+            return
+        create_compact_price_tables(engine, first_year, last_year)
+        return
+
     metadata = db.MetaData()
 
     db.Table(
@@ -69,7 +281,7 @@ def create_price_table(engine: db.Engine) -> None:
         db.Column("high", db.Float, nullable=True),
         db.Column("low", db.Float, nullable=True),
         db.Column("close", db.Float, nullable=True),
-        db.Column("volume", db.Integer, nullable=True),
+        db.Column("volume", db.BigInteger, nullable=True),
         db.Column("created_at", db.TIMESTAMP, server_default=db.func.now()),
         db.UniqueConstraint("ticker", "date", name="uix_ticker_date"),
     )
@@ -78,33 +290,505 @@ def create_price_table(engine: db.Engine) -> None:
     logging.info("Table 'stock_prices' is ready.")
 
 
-def load_data_to_db(
-    data: list[dict], table_name: str, engine: db.Engine, mode: str = "append"
-) -> None:
-    """Loads data into the specified database table."""
+def migrate_price_storage(engine: db.Engine, drop_legacy: bool = False) -> None:
+    """
+    Moves a legacy stock_prices table into the compact PostgreSQL layout.
+
+    The legacy table is renamed to stock_prices_legacy, its rows are copied
+    into stock_price_bars and the stock_prices view takes its place, all in a
+    single transaction. The legacy table is dropped only if drop_legacy is set.
+    """
+    if engine.dialect.name != "postgresql":
+        logging.info("Compact price storage is only available on PostgreSQL.")
+        return
+    inspector = db.inspect(engine)
+    if "stock_prices" not in inspector.get_table_names():
+        logging.info("No legacy 'stock_prices' table to migrate.")
+        create_compact_price_tables(engine)
+        return
+
+    metadata, _, _ = _compact_price_tables()
+    with engine.begin() as connection:
+        first_year, last_year = connection.execute(
+            db.text(
+                "SELECT EXTRACT(YEAR FROM MIN(date))::int, "
+                "EXTRACT(YEAR FROM MAX(date))::int FROM stock_prices"
+            )
+        ).one()
+        connection.execute(
+            db.text("ALTER TABLE stock_prices RENAME TO stock_prices_legacy")
+        )
+        metadata.create_all(connection)
+        ensure_price_partitions(
+            connection,
+            min(first_year or 1990, 1990),
+            max(last_year or 0, dt.date.today().year + 1),
+        )
+        connection.execute(
+            db.text(
+                "INSERT INTO tickers (ticker) "
+                "SELECT DISTINCT TRIM(l.ticker) FROM stock_prices_legacy AS l "
+                "WHERE l.ticker IS NOT NULL AND NOT EXISTS "
+                "(SELECT 1 FROM tickers AS t WHERE t.ticker = TRIM(l.ticker)) "
+                "ON CONFLICT (ticker) DO NOTHING"
+            )
+        )
+        migrated = connection.execute(
+            db.text(
+                "INSERT INTO stock_price_bars "
+                "(ticker_id, date, open, high, low, close, volume) "
+                "SELECT t.ticker_id, l.date, l.open, l.high, l.low, l.close, l.volume "
+                "FROM stock_prices_legacy AS l "
+                "JOIN tickers AS t ON t.ticker = TRIM(l.ticker) "
+                "WHERE l.date IS NOT NULL "
+                "ON CONFLICT (ticker_id, date) DO NOTHING"
+            )
+        ).rowcount
+        connection.execute(db.text(COMPACT_PRICE_VIEW_SQL))
+        if drop_legacy:
+            connection.execute(db.text("DROP TABLE stock_prices_legacy"))
+    logging.info(f"Migrated {migrated} rows into the compact price storage.")
+
+
+def create_price_coverage_table(engine: db.Engine) -> None:
+    """Creates the stock_prices_coverage table if it doesn't exist."""
     metadata = db.MetaData()
-    table = db.Table(table_name, metadata, autoload_with=engine)
-    with engine.connect() as connection:
-        with connection.begin() as transaction:
+
+    db.Table(
+        "stock_prices_coverage",
+        metadata,
+        db.Column("ticker", db.String(10), primary_key=True),
+        db.Column("start_date", db.Date, primary_key=True),
+        db.Column("end_date", db.Date, nullable=False),
+        db.Column("updated_at", db.TIMESTAMP, server_default=db.func.now()),
+    )
+
+    metadata.create_all(engine)
+    logging.info("Table 'stock_prices_coverage' is ready.")
+
+
+def create_quotes_table(engine: db.Engine) -> None:
+    """
+    Creates the stock_quotes table of real-time ticks if it doesn't exist.
+
+    Ticks are append-only: several trades of a ticker can share a timestamp,
+    so (ticker, quoted_at) is indexed but not unique. A table created with
+    that pair as primary key is rebuilt without it.
+    """
+    metadata = db.MetaData()
+
+    db.Table(
+        "stock_quotes",
+        metadata,
+        db.Column("ticker", db.String(10), nullable=False),
+        db.Column("quoted_at", db.TIMESTAMP, nullable=False),
+        db.Column("price", db.Float, nullable=False),
+        db.Column("size", db.BigInteger),
+        db.Index("ix_stock_quotes_ticker_quoted_at", "ticker", "quoted_at"),
+    )
+
+    with engine.begin() as connection:
+        inspector = db.inspect(connection)
+        if inspector.has_table("stock_quotes") and inspector.get_pk_constraint(
+            "stock_quotes"
+        ).get("constrained_columns"):
+            connection.execute(
+                db.text("ALTER TABLE stock_quotes RENAME TO stock_quotes_keyed")
+            )
+            metadata.create_all(connection)
+            connection.execute(
+                db.text(
+                    "INSERT INTO stock_quotes (ticker, quoted_at, price, size) "
+                    "SELECT ticker, quoted_at, price, size FROM stock_quotes_keyed"
+                )
+            )
+            connection.execute(db.text("DROP TABLE stock_quotes_keyed"))
+            logging.info("Dropped the (ticker, quoted_at) key of 'stock_quotes'.")
+        else:
+            metadata.create_all(connection)
+    logging.info("Table 'stock_quotes' is ready.")
+
+
+def create_unavailable_prices_table(engine: db.Engine) -> None:
+    """Creates the stock_prices_unavailable negative cache if it doesn't exist."""
+    metadata = db.MetaData()
+
+    db.Table(
+        "stock_prices_unavailable",
+        metadata,
+        db.Column("ticker", db.String(10), primary_key=True),
+        db.Column("start_date", db.Date, primary_key=True),
+        db.Column("end_date", db.Date, primary_key=True),
+        db.Column("reason", db.String(20), nullable=False),
+        db.Column("detail", db.Text),
+        db.Column("recorded_at", db.TIMESTAMP, nullable=False),
+        db.Column("expires_at", db.TIMESTAMP, nullable=False, index=True),
+    )
+
+    metadata.create_all(engine)
+    logging.info("Table 'stock_prices_unavailable' is ready.")
+
+
+def create_price_quarantine_table(engine: db.Engine) -> None:
+    """Creates the stock_prices_quarantine table of rejected bars if it doesn't exist."""
+    metadata = db.MetaData()
+
+    db.Table(
+        "stock_prices_quarantine",
+        metadata,
+        db.Column("ticker", db.String(10), primary_key=True),
+        db.Column("date", db.Date, primary_key=True),
+        db.Column("open", db.Float, nullable=True),
+        db.Column("high", db.Float, nullable=True),
+        db.Column("low", db.Float, nullable=True),
+        db.Column("close", db.Float, nullable=True),
+        db.Column("volume", db.BigInteger, nullable=True),
+        db.Column("reasons", db.Text, nullable=False),
+        db.Column("quarantined_at", db.TIMESTAMP, nullable=False),
+    )
+
+    metadata.create_all(engine)
+    logging.info("Table 'stock_prices_quarantine' is ready.")
+
+
+def create_feature_dirty_table(engine: db.Engine) -> None:
+    """Creates the feature_dirty_tickers table of features to recompute if it doesn't exist."""
+    metadata = db.MetaData()
+
+    db.Table(
+        "feature_dirty_tickers",
+        metadata,
+        db.Column("ticker", db.String(10), primary_key=True),
+        db.Column("from_date", db.Date, nullable=False),
+        db.Column("version", db.Integer, nullable=False, server_default="1"),
+        db.Column("marked_at", db.TIMESTAMP, server_default=db.func.now()),
+    )
+
+    metadata.create_all(engine)
+    logging.info("Table 'feature_dirty_tickers' is ready.")
+
+
+def create_corporate_actions_table(engine: db.Engine) -> None:
+    """Creates the corporate_actions table of splits and dividends if it doesn't exist."""
+    metadata = db.MetaData()
+
+    db.Table(
+        "corporate_actions",
+        metadata,
+        db.Column("ticker", db.String(10), primary_key=True),
+        db.Column("ex_date", db.Date, primary_key=True),
+        db.Column("dividend", db.Float, nullable=False, server_default="0"),
+        db.Column("split_ratio", db.Float, nullable=False, server_default="1"),
+        db.Column("reference_close", db.Float, nullable=True),
+        db.Column("factor", db.Float, nullable=True),
+        db.Column("updated_at", db.TIMESTAMP, server_default=db.func.now()),
+    )
+
+    metadata.create_all(engine)
+    logging.info("Table 'corporate_actions' is ready.")
+
+
+def create_work_units_table(engine: db.Engine) -> None:
+    """Creates the etl_work_units ledger of planned fetch/load units if it doesn't exist."""
+    metadata = db.MetaData()
+
+    db.Table(
+        "etl_work_units",
+        metadata,
+        db.Column("unit_key", db.String(40), primary_key=True),
+        db.Column("tickers", db.Text, nullable=False),
+        db.Column("start_date", db.Date, nullable=False),
+        db.Column("end_date", db.Date, nullable=False),
+        db.Column("status", db.String(10), nullable=False, index=True),
+        db.Column("attempts", db.Integer, nullable=False, server_default="0"),
+        db.Column("rows_fetched", db.Integer),
+        db.Column("rows_inserted", db.Integer),
+        db.Column("rows_updated", db.Integer),
+        db.Column("rows_skipped", db.Integer),
+        db.Column("last_error", db.Text),
+        db.Column("planned_at", db.TIMESTAMP, server_default=db.func.now()),
+        db.Column("started_at", db.TIMESTAMP),
+        db.Column("finished_at", db.TIMESTAMP),
+    )
+
+    metadata.create_all(engine)
+    logging.info("Table 'etl_work_units' is ready.")
+
+
+def _load_counts(inserted: int = 0, updated: int = 0, skipped: int = 0) -> dict:
+    """Builds the row counts reported by the loaders."""
+    return {"inserted": inserted, "updated": updated, "skipped": skipped}
+
+
+def _prepare_rows(
+    data: list[dict], table: db.Table, columns: list[str], key_columns: list[str]
+) -> tuple[list[dict], int]:
+    """Normalizes NaN values, casts integer columns and drops duplicated keys."""
+    integer_columns = {
+        column for column in columns if isinstance(table.c[column].type, db.Integer)
+    }
+    rows = {}
+    for record in data:
+        row = {}
+        for column in columns:
+            value = record.get(column)
+            if value != value:  # NaN and NaT are the only values unequal to themselves
+                value = None
+            elif column in integer_columns and isinstance(value, float):
+                value = int(value)
+            row[column] = value
+        rows[tuple(row[key] for key in key_columns)] = row
+    return list(rows.values()), len(data) - len(rows)
+
+
+def _copy_rows_to_staging(
+    connection: db.Connection, staging: db.Table, columns: list[str], rows: list[dict]
+) -> None:
+    """Streams rows into a PostgreSQL staging table through COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([row[column] for column in columns] for row in rows)
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    column_list = ", ".join(preparer.quote(column) for column in columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {preparer.quote(staging.name)} ({column_list}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def copy_frame_to_db(frame: pl.DataFrame, table_name: str, engine: db.Engine) -> int:
+    """
+    Appends the rows of a DataFrame to a table and returns how many were written.
+
+    On PostgreSQL the columns are written as CSV straight into COPY, without
+    building a Python object per row. Other databases get a plain insert.
+    """
+    if frame.is_empty():
+        return 0
+    table = get_table(engine, table_name)
+    with engine.begin() as connection:
+        if connection.dialect.name != "postgresql":
+            connection.execute(table.insert(), frame.to_dicts())
+            return len(frame)
+        preparer = connection.dialect.identifier_preparer
+        column_list = ", ".join(preparer.quote(column) for column in frame.columns)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {preparer.quote(table.name)} ({column_list}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                io.StringIO(frame.write_csv(include_header=False)),
+            )
+        finally:
+            cursor.close()
+    return len(frame)
+
+
+def _is_compact_price_view(engine: db.Engine, table_name: str) -> bool:
+    """Whether table_name is the stock_prices view over the compact price storage."""
+    return (
+        engine.dialect.name == "postgresql"
+        and table_name == "stock_prices"
+        and table_name in get_view_names(engine)
+    )
+
+
+def bulk_upsert_to_db(
+    data: list[dict],
+    table_name: str,
+    engine: db.Engine,
+    conflict_columns: tuple[str, ...] = ("ticker", "date"),
+    on_conflict: str = "update",
+    before_commit: Callable[[db.Connection], None] | None = None,
+) -> dict:
+    """
+    Bulk merges rows into a table through a temporary staging table.
+
+    On PostgreSQL rows are streamed with COPY, on SQLite they are inserted with
+    executemany. Rows are then merged with INSERT ... ON CONFLICT, either
+    updating changed rows (on_conflict="update") or keeping the stored ones
+    (on_conflict="nothing"). Writes to the stock_prices view of the compact
+    PostgreSQL layout are merged into stock_price_bars, registering new
+    tickers first. Price batches that changed rows are announced to the
+    listeners of PRICE_NOTIFY_CHANNEL when the merge commits (see
+    price_notifications.py). before_commit, when given, is called with the
+    merge's connection right before it commits.
+
+    Returns:
+        Counts of inserted, updated and skipped rows.
+    """
+    if not data:
+        return _load_counts()
+    if engine.dialect.name == "postgresql":
+        dialect_insert = postgresql.insert
+    elif engine.dialect.name == "sqlite":
+        dialect_insert = sqlite.insert
+    else:
+        raise NotImplementedError(
+            f"Bulk upsert is not supported for '{engine.dialect.name}' databases."
+        )
+
+    table = get_table(engine, table_name)
+    key_columns = list(conflict_columns)
+    columns = [column.name for column in table.c if column.name in data[0]]
+    value_columns = [column for column in columns if column not in key_columns]
+    rows, duplicated = _prepare_rows(data, table, columns, key_columns)
+
+    staging = db.Table(
+        f"{table_name}{STAGING_SUFFIX}",
+        db.MetaData(),
+        *[db.Column(column, table.c[column].type) for column in columns],
+        prefixes=["TEMPORARY"],
+    )
+    keys_match = db.and_(*[staging.c[key] == table.c[key] for key in key_columns])
+    values_changed = db.or_(
+        *[
+            staging.c[column].is_distinct_from(table.c[column])
+            for column in value_columns
+        ]
+    )
+
+    with engine.begin() as connection:
+        staging.drop(connection, checkfirst=True)
+        staging.create(connection)
+        if engine.dialect.name == "postgresql":
+            _copy_rows_to_staging(connection, staging, columns, rows)
+        else:
+            connection.execute(staging.insert(), rows)
+
+        joined = staging.join(table, keys_match)
+        matched = connection.execute(
+            db.select(db.func.count()).select_from(joined)
+        ).scalar_one()
+        changed = 0
+        if on_conflict == "update" and value_columns:
+            changed = connection.execute(
+                db.select(db.func.count()).select_from(joined).where(values_changed)
+            ).scalar_one()
+
+        target, target_keys = table, key_columns
+        source_columns = columns
+        source = db.select(*[staging.c[column] for column in columns]).where(db.true())
+        if _is_compact_price_view(engine, table_name):
+            _, tickers, target = _compact_price_tables()
+            # Only the new tickers: every conflicting row would still consume
+            # an identity value. The conflict clause covers concurrent loads.
+            new_tickers = (
+                db.select(staging.c.ticker)
+                .distinct()
+                .where(~db.exists().where(tickers.c.ticker == staging.c.ticker))
+            )
+            connection.execute(
+                postgresql.insert(tickers)
+                .from_select(["ticker"], new_tickers)
+                .on_conflict_do_nothing(index_elements=["ticker"])
+            )
+            target_keys = ["ticker_id"] + [k for k in key_columns if k != "ticker"]
+            source_columns = ["ticker_id"] + [c for c in columns if c != "ticker"]
+            source = db.select(
+                tickers.c.ticker_id, *[staging.c[c] for c in columns if c != "ticker"]
+            ).select_from(staging.join(tickers, tickers.c.ticker == staging.c.ticker))
+
+        statement = dialect_insert(target).from_select(source_columns, source)
+        if on_conflict == "update" and value_columns:
+            statement = statement.on_conflict_do_update(
+                index_elements=target_keys,
+                set_={column: statement.excluded[column] for column in value_columns},
+                where=db.or_(
+                    *[
+                        target.c[column].is_distinct_from(statement.excluded[column])
+                        for column in value_columns
+                    ]
+                ),
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=target_keys)
+        connection.execute(statement)
+        staging.drop(connection, checkfirst=True)
+        if before_commit is not None:
+            before_commit(connection)
+        notify_price_load(connection, table_name, rows, len(rows) - matched, changed)
+
+    counts = _load_counts(
+        inserted=len(rows) - matched,
+        updated=changed,
+        skipped=duplicated + matched - changed,
+    )
+    logging.info(
+        f"Upserted {len(data)} records into '{table_name}' table: "
+        f"{counts['inserted']} inserted, {counts['updated']} updated, "
+        f"{counts['skipped']} skipped."
+    )
+    return counts
+
+
+def load_data_to_db(
+    data: list[dict],
+    table_name: str,
+    engine: db.Engine,
+    mode: str = "append",
+    conflict_columns: tuple[str, ...] = ("ticker", "date"),
+    on_conflict: str = "update",
+    before_commit: Callable[[db.Connection], None] | None = None,
+) -> dict:
+    """
+    Loads data into the specified database table.
+
+    Args:
+        data: Rows to load, as a list of dictionaries keyed by column name.
+        table_name: Name of the target table.
+        engine: Database engine.
+        mode: "append" inserts the rows, "replace" swaps the whole table
+            content for the rows in one transaction and "upsert" bulk merges
+            the rows on conflict_columns.
+        conflict_columns: Unique key used by the "upsert" mode.
+        on_conflict: "update" or "nothing", action taken by the "upsert" mode
+            for rows whose key already exists.
+        before_commit: Called with the load's connection before it commits,
+            for writes that must succeed or fail together with the load.
+
+    Returns:
+        Counts of inserted, updated and skipped rows, all zero when the rows
+        violate a constraint of the table.
+
+    Raises:
+        sqlalchemy.exc.SQLAlchemyError: On any other database error, after
+            the transaction was rolled back.
+    """
+    if mode == "upsert":
+        try:
+            return bulk_upsert_to_db(
+                data, table_name, engine, conflict_columns, on_conflict, before_commit
+            )
+        except db.exc.IntegrityError as e:
+            logging.error(
+                f"Integrity error while upserting data into '{table_name}': {e}"
+            )
+            return _load_counts()
+
+    if mode not in ("append", "replace"):
+        raise ValueError(f"Unknown load mode: {mode}")
+    table = get_table(engine, table_name)
+    try:
+        with engine.begin() as connection:
             if mode == "replace":
-                try:
-                    connection.execute(table.delete())
-                    logging.info(f"Cleared existing data from '{table_name}' table.")
-                except Exception as e:
-                    transaction.rollback()
-                    logging.error(f"Error while clearing data from '{table_name}': {e}")
-                    return
-            else:
-                try:
-                    connection.execute(table.insert(), data)
-                    logging.info(
-                        f"Inserted {len(data)} records into '{table_name}' table."
-                    )
-                except db.exc.IntegrityError as e:
-                    logging.error(
-                        f"Integrity error while inserting data into '{table_name}': {e}"
-                    )
-                except Exception as e:
-                    logging.error(
-                        f"Error while inserting data into '{table_name}': {e}"
-                    )
+                connection.execute(table.delete())
+            if data:
+                connection.execute(table.insert(), data)
+                if before_commit is not None:
+                    before_commit(connection)
+                notify_price_load(connection, table_name, data, len(data), 0)
+    except db.exc.IntegrityError as e:
+        logging.error(f"Integrity error while loading data into '{table_name}': {e}")
+        return _load_counts()
+    if mode == "replace":
+        logging.info(f"Replaced '{table_name}' table with {len(data)} records.")
+    else:
+        logging.info(f"Inserted {len(data)} records into '{table_name}' table.")
+    return _load_counts(inserted=len(data))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import metrics
+import random
+import threading
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from collections import deque
+from data_sourcing import ProviderRateLimitError
+from trading_calendar import sessions_between
+
+
+class FakePriceProvider:
+    """
+    Local stand-in for Yahoo Finance used to exercise the fetch path offline.
+
+    It returns deterministic random-walk OHLCV rows shaped like the output of
+    `fetch_historical_data`, sleeps for a random latency on every call and
+    answers with a rate-limit error (the equivalent of an HTTP 429) when more
+    than `max_requests_per_second` calls arrive within a second, or at random
+    with probability `rate_limit_probability`.
+    """
+
+    def __init__(
+        self,
+        latency: tuple[float, float] = (0.05, 0.2),
+        max_requests_per_second: float | None = None,
+        rate_limit_probability: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.max_requests_per_second = max_requests_per_second
+        self.rate_limit_probability = rate_limit_probability
+        self.calls = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._recent_calls: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _should_rate_limit(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            while self._recent_calls and now - self._recent_calls[0] > 1.0:
+                self._recent_calls.popleft()
+            over_rate = (
+                self.max_requests_per_second is not None
+                and len(self._recent_calls) >= self.max_requests_per_second
+            )
+            unlucky = self._rng.random() < self.rate_limit_probability
+            if over_rate or unlucky:
+                self.rate_limited += 1
+                return True
+            self._recent_calls.append(now)
+            return False
+
+    def fetch(
+        self, tickers: str | list[str], start_date: str, end_date: str
+    ) -> pd.DataFrame | None:
+        """Returns synthetic daily bars for tickers between start_date and end_date (exclusive)."""
+        tickers = [tickers] if isinstance(tickers, str) else tickers
+        with self._lock:
+            delay = self._rng.uniform(*self.latency)
+        time.sleep(delay)
+        metrics.observe("provider_request_seconds", delay)
+        metrics.increment("provider_requests")
+        if self._should_rate_limit():
+            raise ProviderRateLimitError("Too Many Requests (fake provider).")
+
+        dates = pd.DatetimeIndex(
+            sessions_between(start_date, pd.Timestamp(end_date) - pd.Timedelta(days=1))
+        )
+        if len(dates) == 0 or not tickers:
+            return None
+        frames = []
+        for ticker in tickers:
+            rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+            offset = max(0, (dates[0] - pd.Timestamp("1990-01-01")).days)
+            walk = rng.normal(0, 0.01, offset + len(dates)).cumsum()[offset:]
+            close = 100 * np.exp(walk)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "date": dates,
+                        "ticker": ticker,
+                        "close": close,
+                        "high": close * 1.01,
+                        "low": close * 0.99,
+                        "open": close,
+                        "volume": rng.integers(1e5, 1e7, len(dates)).astype(float),
+                    }
+                )
+            )
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import logging
+import math
+import os
+import numpy as np
+import pandas as pd
+import polars as pl
+import sqlalchemy as db
+from pathlib import Path
+from sqlalchemy.dialects import postgresql, sqlite
+from constituent_index import load_constituent_index
+from database import get_table
+from trading_calendar import load_sessions
+from transformations import scan_sp500_companies, scan_stock_prices
+
+
+TICKER_FEATURES_DIR_NAME = "ticker_features"
+AGGREGATES_FILE_NAME = "aggregates.parquet"
+FEATURE_DIRTY_TABLE = "feature_dirty_tickers"
+INDEX_UNIVERSE = "S&P 500"
+UNKNOWN_SECTOR = "Unknown"
+BASE_LEVEL = 100.0
+
+
+def _write_parquet(df: pl.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.tmp")
+    df.write_parquet(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def _read_dirty(engine: db.Engine) -> dict[str, tuple[dt.date, int]]:
+    """Earliest dirty date and mark version of each ticker."""
+    table = get_table(engine, FEATURE_DIRTY_TABLE)
+    with engine.connect() as connection:
+        rows = connection.execute(
+            db.select(table.c.ticker, table.c.from_date, table.c.version)
+        ).all()
+    return {ticker: (from_date, version) for ticker, from_date, version in rows}
+
+
+def _clear_dirty(engine: db.Engine, dirty: dict[str, tuple[dt.date, int]]) -> None:
+    """
+    Removes the marks of dirty that were processed.
+
+    A ticker marked again meanwhile has a newer version and stays dirty.
+    """
+    if not dirty:
+        return
+    table = get_table(engine, FEATURE_DIRTY_TABLE)
+    statement = table.delete().where(
+        table.c.ticker == db.bindparam("marked_ticker"),
+        table.c.version == db.bindparam("marked_version"),
+    )
+    with engine.begin() as connection:
+        connection.execute(
+            statement,
+            [
+                {"marked_ticker": ticker, "marked_version": version}
+                for ticker, (_, version) in dirty.items()
+            ],
+        )
+
+
+def mark_features_dirty(prices: pd.DataFrame | pl.DataFrame, engine: db.Engine) -> None:
+    """Records the earliest date of each ticker in a loaded price batch for recomputation."""
+    df = pl.from_pandas(prices) if isinstance(prices, pd.DataFrame) else prices
+    if df.is_empty():
+        return
+    earliest = (
+        df.group_by(pl.col("ticker").str.strip_chars())
+        .agg(pl.col("date").cast(pl.Date).min().alias("from_date"))
+        .drop_nulls()
+    )
+    if earliest.is_empty():
+        return
+    if engine.dialect.name == "postgresql":
+        dialect_insert = postgresql.insert
+    else:
+        dialect_insert = sqlite.insert
+    table = get_table(engine, FEATURE_DIRTY_TABLE)
+    statement = dialect_insert(table)
+    # Loaders mark concurrently: each mark is a single upsert that keeps the
+    # earliest date and bumps the version, so no mark is lost.
+    statement = statement.on_conflict_do_update(
+        index_elements=["ticker"],
+        set_={
+            "from_date": db.case(
+                (
+                    statement.excluded.from_date < table.c.from_date,
+                    statement.excluded.from_date,
+                ),
+                else_=table.c.from_date,
+            ),
+            "version": table.c.version + 1,
+            "marked_at": db.func.now(),
+        },
+    )
+    with engine.begin() as connection:
+        connection.execute(statement, earliest.sort("ticker").to_dicts())
+
+
+def compute_ticker_features(prices: pl.DataFrame) -> pl.DataFrame:
+    """
+    Computes per-ticker daily features from (ticker, date, close) rows.
+
+    Rolling windows run over each ticker's stored sessions in date order.
+    """
+    windows = config.FEATURE_MOVING_AVERAGE_WINDOWS
+    volatility_window = config.FEATURE_VOLATILITY_WINDOW
+    return (
+        prices.select("ticker", "date", "close")
+        .drop_nulls()
+        .sort("ticker", "date")
+        .with_columns(
+            (pl.col("close") / pl.col("close").shift(1).over("ticker") - 1).alias(
+                "return"
+            ),
+            (pl.col("close") / pl.col("close").shift(1).over("ticker"))
+            .log()
+            .alias("log_return"),
+        )
+        .with_columns(
+            (
+                pl.col("log_return").rolling_std(volatility_window).over("ticker")
+                * math.sqrt(config.TRADING_DAYS_PER_YEAR)
+            ).alias(f"volatility_{volatility_window}"),
+            *[
+                pl.col("close")
+                .rolling_mean(window)
+                .over("ticker")
+                .alias(f"sma_{window}")
+                for window in windows
+            ],
+        )
+    )
+
+
+def _lookback_start(date: dt.date) -> dt.date:
+    """Session far enough before date to fill every rolling window at date."""
+    lookback = max(
+        config.FEATURE_MOVING_AVERAGE_WINDOWS + (config.FEATURE_VOLATILITY_WINDOW + 1,)
+    )
+    sessions = load_sessions()
+    position = np.searchsorted(sessions, np.datetime64(date, "D"))
+    return sessions[max(0, position - lookback)].astype(dt.date)
+
+
+def _merge_into_partitions(features: pl.DataFrame, features_dir: Path) -> None:
+    """Replaces the stored rows of the given (ticker, date) keys, one year partition at a time."""
+    root = features_dir / TICKER_FEATURES_DIR_NAME
+    features = features.with_columns(pl.col("date").dt.year().alias("year"))
+    for (year,), partition in features.group_by("year"):
+        path = root / f"year={year}" / "data.parquet"
+        partition = partition.drop("year")
+        if path.exists():
+            stored = pl.read_parquet(path).join(
+                partition.select("ticker", "date"), on=["ticker", "date"], how="anti"
+            )
+            partition = pl.concat([stored, partition], how="diagonal_relaxed")
+        _write_parquet(partition.sort("ticker", "date"), path)
+
+
+def scan_ticker_features(
+    tickers: list[str] | None = None,
+    start_date: dt.date | str | None = None,
+    end_date: dt.date | str | None = None,
+    features_dir: Path | None = None,
+) -> pl.LazyFrame:
+    """Lazily reads the materialized per-ticker features with partition pruning."""
+    features_dir = features_dir or config.FEATURES_DIR
+    lf = pl.scan_parquet(
+        features_dir / TICKER_FEATURES_DIR_NAME / "year=*" / "*.parquet",
+        hive_partitioning=True,
+        hive_schema={"year": pl.Int32},
+    )
+    if tickers is not None:
+        lf = lf.filter(pl.col("ticker").is_in(tickers))
+    if start_date is not None:
+        start_date = dt.date.fromisoformat(str(start_date))
+        lf = lf.filter(
+            (pl.col("year") >= start_date.year) & (pl.col("date") >= start_date)
+        )
+    if end_date is not None:
+        end_date = dt.date.fromisoformat(str(end_date))
+        lf = lf.filter((pl.col("year") <= end_date.year) & (pl.col("date") <= end_date))
+    return lf.drop("year")
+
+
+def read_aggregates(features_dir: Path | None = None) -> pl.DataFrame:
+    """Reads the equal-weight index and sector aggregates."""
+    features_dir = features_dir or config.FEATURES_DIR
+    return pl.read_parquet(features_dir / AGGREGATES_FILE_NAME)
+
+
+def compute_aggregates(
+    returns: pl.DataFrame, previous_levels: dict[str, float]
+) -> pl.DataFrame:
+    """
+    Equal-weight daily returns and levels of the index and of each sector.
+
+    Args:
+        returns: Member rows with date, sector and return.
+        previous_levels: Level of each universe on the session before the
+            first date of returns, to chain the new levels onto.
+    """
+    by_universe = pl.concat(
+        [
+            returns.with_columns(pl.lit(INDEX_UNIVERSE).alias("universe")),
+            returns.with_columns(pl.col("sector").alias("universe")),
+        ]
+    )
+    aggregates = (
+        by_universe.drop_nulls("return")
+        .group_by("universe", "date")
+        .agg(
+            pl.len().alias("members"),
+            pl.col("return").mean().alias("return"),
+        )
+        .sort("universe", "date")
+    )
+    previous = pl.DataFrame(
+        {
+            "universe": list(previous_levels.keys()),
+            "previous_level": list(previous_levels.values()),
+        },
+        schema={"universe": pl.String, "previous_level": pl.Float64},
+    )
+    return (
+        aggregates.join(previous, on="universe", how="left")
+        .with_columns(
+            (
+                pl.col("previous_level").fill_null(BASE_LEVEL)
+                * (1 + pl.col("return")).cum_prod().over("universe")
+            ).alias("level")
+        )
+        .drop("previous_level")
+    )
+
+
+def _update_aggregates(
+    engine: db.Engine, start_date: dt.date, features_dir: Path
+) -> None:
+    """Recomputes the aggregates from start_date on and chains them to the stored levels."""
+    path = features_dir / AGGREGATES_FILE_NAME
+    stored = pl.read_parquet(path) if path.exists() else None
+    returns = (
+        scan_ticker_features(start_date=start_date, features_dir=features_dir)
+        .select("ticker", "date", "return")
+        .collect()
+    )
+    if returns.is_empty():
+        return
+    index = load_constituent_index(engine)
+    returns = returns.filter(
+        pl.Series(index.is_member(returns["ticker"].to_numpy(), returns["date"]))
+    )
+    sectors = scan_sp500_companies(engine, columns=["sector"]).select(
+        "ticker", "sector"
+    )
+    returns = returns.join(
+        sectors.collect().unique("ticker"), on="ticker", how="left"
+    ).with_columns(pl.col("sector").fill_null(UNKNOWN_SECTOR))
+
+    previous_levels = {}
+    if stored is not None:
+        kept = stored.filter(pl.col("date") < start_date)
+        previous_levels = dict(
+            kept.sort("date")
+            .group_by("universe")
+            .agg(pl.col("level").last())
+            .iter_rows()
+        )
+    else:
+        kept = None
+    aggregates = compute_aggregates(returns, previous_levels)
+    if kept is not None:
+        aggregates = pl.concat([kept, aggregates], how="diagonal_relaxed")
+    _write_parquet(aggregates.sort("universe", "date"), path)
+
+
+def update_features(engine: db.Engine, features_dir: Path | None = None) -> None:
+    """
+    Recomputes the features invalidated by the price loads since the last update.
+
+    Only the tickers marked dirty in feature_dirty_tickers are recomputed,
+    from their earliest loaded date on, reading just enough earlier sessions
+    to fill the rolling windows. The aggregates are then recomputed from the
+    earliest dirty date. When nothing was materialized yet, every stored
+    price is processed. Tickers marked again while the update runs stay dirty
+    for the next one.
+    """
+    features_dir = features_dir or config.FEATURES_DIR
+    dirty = _read_dirty(engine)
+    first_build = not any((features_dir / TICKER_FEATURES_DIR_NAME).glob("*/*.parquet"))
+    if first_build:
+        tickers, start_date = None, None
+    elif dirty:
+        tickers = list(dirty)
+        start_date = min(from_date for from_date, _ in dirty.values())
+    else:
+        logging.info("Features are up to date.")
+        return
+
+    prices = scan_stock_prices(
+        engine,
+        tickers=tickers,
+        start_date=_lookback_start(start_date) if start_date else None,
+        columns=["close"],
+        source="database",
+    ).collect()
+    if prices.is_empty():
+        logging.info("No prices to compute features from.")
+        _clear_dirty(engine, dirty)
+        return
+    features = compute_ticker_features(prices)
+    if not first_build:
+        starts = pl.DataFrame(
+            {
+                "ticker": list(dirty.keys()),
+                "from_date": [from_date for from_date, _ in dirty.values()],
+            },
+            schema={"ticker": pl.String, "from_date": pl.Date},
+        )
+        features = (
+            features.join(starts, on="ticker")
+            .filter(pl.col("date") >= pl.col("from_date"))
+            .drop("from_date")
+        )
+    _merge_into_partitions(features, features_dir)
+    _update_aggregates(engine, start_date or features["date"].min(), features_dir)
+    _clear_dirty(engine, dirty)
+    logging.info(
+        f"Features updated for {features['ticker'].n_unique()} tickers "
+        f"({len(features)} rows)."
+    )
+
+
+def rebuild_features(engine: db.Engine, features_dir: Path | None = None) -> None:
+    """Drops the materialized features and computes them again from every stored price."""
+    features_dir = features_dir or config.FEATURES_DIR
+    for path in features_dir.glob(f"{TICKER_FEATURES_DIR_NAME}/*/*.parquet"):
+        path.unlink()
+    (features_dir / AGGREGATES_FILE_NAME).unlink(missing_ok=True)
+    update_features(engine, features_dir)
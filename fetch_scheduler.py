@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import metrics
+import random
+import threading
+import time
+import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Iterator
+from data_sourcing import ProviderRateLimitError, limit_provider_requests
+
+
+@dataclass(frozen=True)
+class FetchUnit:
+    """A single provider request: a set of tickers over a date range."""
+
+    tickers: tuple[str, ...]
+    start_date: str
+    end_date: str
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket whose refill rate adapts to rate-limit responses.
+
+    The rate is cut multiplicatively and refilling is paused for a cooldown
+    whenever the provider rate limits us, and it recovers additively on every
+    successful request (AIMD), so the scheduler converges on the highest rate
+    the provider currently accepts.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        min_rate: float = 0.05,
+        max_rate: float | None = None,
+        decrease_factor: float = 0.5,
+        increase_step: float = 0.05,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - max(self._updated_at, self._paused_until))
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = max(now, self._updated_at)
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait_for)
+
+    def on_success(self) -> None:
+        """Additively raises the refill rate after a successful request."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_rate_limit(self, cooldown: float) -> None:
+        """Cuts the refill rate and drains the bucket after a rate-limit response."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + cooldown)
+
+
+def backoff_delay(
+    attempt: int, base: float, cap: float, rng: random.Random | None = None
+) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt."""
+    rng = rng or random
+    return rng.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class FetchScheduler:
+    """
+    Runs fetch units on a worker pool behind an adaptive token bucket.
+
+    Units that fail, rate-limited or otherwise, go to a retry queue and are
+    resubmitted after an exponential backoff with jitter. Units that still fail
+    after max_attempts are kept in `failed` instead of being silently dropped.
+    on_start, when given, is called with each unit once it got its token,
+    right before its fetch is sent.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+        limiter: TokenBucket,
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 120.0,
+        rng: random.Random | None = None,
+        on_start: Callable[[FetchUnit], None] | None = None,
+    ) -> None:
+        self.fetch = fetch
+        self.limiter = limiter
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rng = rng or random.Random()
+        self.on_start = on_start
+        self.failed: list[FetchUnit] = []
+
+    def _call(self, unit: FetchUnit) -> pd.DataFrame | None:
+        # Provider requests are timed by the providers themselves, as the
+        # fetch function may serve a unit from the price cache.
+        waiting_since = time.perf_counter()
+        self.limiter.acquire()
+        metrics.observe(
+            "rate_limiter_wait_seconds", time.perf_counter() - waiting_since
+        )
+        if self.on_start is not None:
+            self.on_start(unit)
+        with limit_provider_requests(self.limiter):
+            return self.fetch(list(unit.tickers), unit.start_date, unit.end_date)
+
+    def run(
+        self, units: list[FetchUnit]
+    ) -> Iterator[tuple[FetchUnit, pd.DataFrame | None]]:
+        """Fetches every unit and yields (unit, data) pairs as they complete."""
+        self.failed = []
+        sequence = 0
+        retry_queue: list[tuple[float, int, FetchUnit, int]] = []
+        for unit in units:
+            heapq.heappush(retry_queue, (0.0, sequence, unit, 1))
+            sequence += 1
+
+        in_flight: dict[Future, tuple[FetchUnit, int]] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while retry_queue or in_flight:
+                now = time.monotonic()
+                while (
+                    retry_queue
+                    and retry_queue[0][0] <= now
+                    and len(in_flight) < self.workers
+                ):
+                    _, _, unit, attempt = heapq.heappop(retry_queue)
+                    in_flight[executor.submit(self._call, unit)] = (unit, attempt)
+
+                timeout = None
+                if retry_queue and len(in_flight) < self.workers:
+                    timeout = max(0.0, retry_queue[0][0] - now)
+                if not in_flight:
+                    time.sleep(timeout or 0)
+                    continue
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    unit, attempt = in_flight.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        delay = backoff_delay(
+                            attempt, self.backoff_base, self.backoff_max, self.rng
+                        )
+                        if isinstance(e, ProviderRateLimitError):
+                            metrics.increment("provider_rate_limited")
+                            self.limiter.on_rate_limit(delay)
+                        else:
+                            metrics.increment("provider_errors")
+                        if attempt >= self.max_attempts:
+                            logging.error(
+                                f"Giving up on {len(unit.tickers)} tickers for "
+                                f"{unit.start_date} - {unit.end_date} after "
+                                f"{attempt} attempts: {e}"
+                            )
+                            self.failed.append(unit)
+                            metrics.increment("fetch_units_failed")
+                            continue
+                        metrics.increment("fetch_retries")
+                        logging.warning(
+                            f"Attempt {attempt} failed for {len(unit.tickers)} "
+                            f"tickers ({e}), retrying in {delay:.1f}s..."
+                        )
+                        heapq.heappush(
+                            retry_queue,
+                            (time.monotonic() + delay, sequence, unit, attempt + 1),
+                        )
+                        sequence += 1
+                    else:
+                        self.limiter.on_success()
+                        yield unit, data
@@ -1,23 +1,33 @@
 # *-* coding: utf-8 -*-
 
+import argparse
 import config
 import logging
-import pandas as pd
-from time import sleep
-from sqlalchemy.exc import IntegrityError
+import metrics
+from constituent_index import load_constituent_index
 from database import (
     get_engine,
+    create_corporate_actions_table,
+    create_feature_dirty_table,
+    create_price_quarantine_table,
     create_price_table,
+    create_price_coverage_table,
     create_sp500_companies_table,
     create_sp500_changes_table,
-    load_data_to_db,
+    create_unavailable_prices_table,
+    create_work_units_table,
+    migrate_price_storage,
 )
 from data_sourcing import (
     get_sp500_companies_data,
     fetch_historical_data,
 )
-from utils import date_range, group_tickers_by_dates_range
-from transformations import get_missing_price_ranges
+from feature_store import update_features
+from negative_cache import purge_expired_unavailable
+from price_cache import cached_fetch, evict_price_cache, load_price_cache_to_db
+from price_coverage import ensure_price_coverage
+from price_sync import sync_missing_prices, sync_tail_prices
+from utils import date_range
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,62 +37,93 @@ logging.basicConfig(
 )
 
 
+def parse_args() -> argparse.Namespace:
+    """Parses the ETL command line options."""
+    parser = argparse.ArgumentParser(description="S&P 500 price ETL.")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Log the planned provider requests and exit without fetching or "
+        "writing anything to the database.",
+    )
+    parser.add_argument(
+        "--migrate-storage",
+        action="store_true",
+        help="Move a legacy stock_prices table into the compact storage layout.",
+    )
+    parser.add_argument(
+        "--load-cache",
+        action="store_true",
+        help="Bulk load the local Parquet price cache before looking for gaps.",
+    )
+    parser.add_argument(
+        "--tail",
+        action="store_true",
+        help="Only fetch the sessions after each constituent's latest stored "
+        "price, through the last closed session, and exit.",
+    )
+    return parser.parse_args()
+
+
 # --- Main execution block ---
 if __name__ == "__main__":
+    args = parse_args()
     start_date, end_date = date_range(months=config.SP500_STOCK_PRICE_RANGE)
-    db_engine = get_engine(config.POSTGRES_URL)
-    create_price_table(db_engine)
-    create_sp500_companies_table(db_engine)
-    create_sp500_changes_table(db_engine)
-    get_sp500_companies_data(
-        config.SP_500_URL,
-        config.LAST_MODIFIED_SP500_DATE_FILE_PATH,
-        tables_ids=["constituents", "changes"],
-    )
-    while True:
-        index_composition_stored_data = get_missing_price_ranges(
-            start_date, end_date, db_engine
-        )
-        batches = group_tickers_by_dates_range(index_composition_stored_data)
-        if not batches:
-            logging.info("No missing data found. ETL process completed.")
-            break
-        for date_range, tickers in batches.items():
-            batch_start_date, batch_end_date = date_range
-            logging.info(f"Fetching data for {', '.join(tickers)} for {date_range}...")
-            sub_batches_size = 50
-            data = []
-            for i in range(0, len(tickers), sub_batches_size):
-                sub_batch = tickers[i : i + sub_batches_size]
-                logging.info(f"Fetching sub-batch of {len(sub_batch)} tickers...")
-                current_sub_batch_data = fetch_historical_data(
-                    sub_batch, batch_start_date, batch_end_date
-                )
-                if (
-                    current_sub_batch_data is not None
-                    and not current_sub_batch_data.empty
-                ):
-                    data.append(current_sub_batch_data)
-                    sleep(5)
-            try:
-                price_data_df = pd.concat(data)
-                price_dict = price_data_df.to_dict(orient="records")
-            except ValueError or AttributeError:
-                logging.warning(
-                    f"No data fetched for {', '.join(tickers)} for {date_range}. Skipping..."
-                )
-                continue
-            else:
-                try:
-                    load_data_to_db(
-                        price_dict, "stock_prices", db_engine, mode="append"
-                    )
-                except IntegrityError:
-                    logging.warning(
-                        f"Data for {', '.join(tickers)} for {date_range} already exists in the database. Skipping..."
+    if config.METRICS_ENABLED:
+        metrics.enable_metrics()
+    status = "failure"
+    try:
+        db_engine = get_engine(config.POSTGRES_URL)
+        # A dry run only reads: the tables, the constituents and the coverage
+        # index are used as they are.
+        if not args.dry_run:
+            # Cheap and idempotent, so tail updates of a database upgraded
+            # from an older layout find every table they read.
+            with metrics.stage("setup"):
+                if args.migrate_storage:
+                    migrate_price_storage(db_engine)
+                create_price_table(db_engine)
+                create_price_coverage_table(db_engine)
+                ensure_price_coverage(db_engine)
+                create_sp500_companies_table(db_engine)
+                create_sp500_changes_table(db_engine)
+                create_work_units_table(db_engine)
+                create_unavailable_prices_table(db_engine)
+                create_corporate_actions_table(db_engine)
+                create_price_quarantine_table(db_engine)
+                create_feature_dirty_table(db_engine)
+                purge_expired_unavailable(db_engine)
+        if args.tail:
+            sync_tail_prices(db_engine, fetch_historical_data, dry_run=args.dry_run)
+            if not args.dry_run:
+                with metrics.stage("features"):
+                    update_features(db_engine)
+        else:
+            if not args.dry_run:
+                with metrics.stage("constituents"):
+                    get_sp500_companies_data(
+                        config.SP_500_URL,
+                        config.LAST_MODIFIED_SP500_DATE_FILE_PATH,
+                        tables_ids=["constituents", "changes"],
+                        engine=db_engine,
                     )
-                    break
-        if len(index_composition_stored_data) == 0:
-            logging.info("No missing data found. ETL process completed.")
-            break
-        exit
+                with metrics.stage("constituent_index"):
+                    load_constituent_index(db_engine)
+                if args.load_cache:
+                    with metrics.stage("cache_load"):
+                        load_price_cache_to_db(db_engine)
+            sync_missing_prices(
+                db_engine,
+                start_date,
+                end_date,
+                fetch=cached_fetch(fetch_historical_data),
+                dry_run=args.dry_run,
+            )
+            if not args.dry_run:
+                with metrics.stage("features"):
+                    update_features(db_engine)
+                with metrics.stage("cache_eviction"):
+                    evict_price_cache()
+        status = "success"
+    finally:
+        metrics.write_run_summary(status)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import config
+import bisect
+import contextlib
+import datetime as dt
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import ContextManager, Iterable, Iterator
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PROMETHEUS_PREFIX = "investbot"
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as exported to Prometheus."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(
+                zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)
+            ),
+        }
+
+
+class RunMetrics:
+    """Stage timers, counters and histograms collected during one ETL run."""
+
+    def __init__(self) -> None:
+        self.started_at = dt.datetime.now(dt.timezone.utc)
+        self._started = time.perf_counter()
+        self.stages: dict[str, dict] = {}
+        self.counters: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                stage["seconds"] += elapsed
+                stage["calls"] += 1
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def summary(self, status: str) -> dict:
+        with self._lock:
+            return {
+                "status": status,
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "duration_seconds": time.perf_counter() - self._started,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: histogram.to_dict()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+
+_metrics: RunMetrics | None = None
+
+
+def enable_metrics() -> None:
+    """Starts collecting metrics for a new run."""
+    global _metrics
+    _metrics = RunMetrics()
+
+
+def disable_metrics() -> None:
+    """Stops collecting metrics; every recording call becomes a no-op."""
+    global _metrics
+    _metrics = None
+
+
+def stage(name: str) -> ContextManager:
+    """Context manager adding the time spent in its block to a stage timer."""
+    if _metrics is None:
+        return _NULL_STAGE
+    return _metrics.stage(name)
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterator:
+    """
+    Yields the items of iterable, adding the time spent waiting for each one
+    to a stage timer but not the time the caller spends processing it.
+    """
+    if _metrics is None:
+        return iter(iterable)
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name: str, iterator: Iterator) -> Iterator:
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Adds value to a counter."""
+    if _metrics is not None:
+        _metrics.increment(name, value)
+
+
+def observe(name: str, value: float) -> None:
+    """Records a value, in seconds, in a latency histogram."""
+    if _metrics is not None:
+        _metrics.observe(name, value)
+
+
+def _prometheus_lines(summary: dict) -> list[str]:
+    """Renders a run summary in the Prometheus text exposition format."""
+    prefix = PROMETHEUS_PREFIX
+    lines = [
+        f"# TYPE {prefix}_run_duration_seconds gauge",
+        f"{prefix}_run_duration_seconds {summary['duration_seconds']:.6f}",
+        f"# TYPE {prefix}_run_success gauge",
+        f"{prefix}_run_success {int(summary['status'] == 'success')}",
+        f"# TYPE {prefix}_run_timestamp_seconds gauge",
+        f"{prefix}_run_timestamp_seconds {time.time():.0f}",
+        f"# TYPE {prefix}_stage_duration_seconds gauge",
+    ]
+    for name, values in summary["stages"].items():
+        lines.append(
+            f'{prefix}_stage_duration_seconds{{stage="{name}"}} {values["seconds"]:.6f}'
+        )
+    lines.append(f"# TYPE {prefix}_stage_calls gauge")
+    for name, values in summary["stages"].items():
+        lines.append(f'{prefix}_stage_calls{{stage="{name}"}} {values["calls"]}')
+    for name, value in summary["counters"].items():
+        lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value:g}"]
+    for name, histogram in summary["histograms"].items():
+        metric = f"{prefix}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f"{metric}_sum {histogram['sum']:.6f}",
+            f"{metric}_count {histogram['count']}",
+        ]
+    return lines
+
+
+def _write_atomically(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.tmp")
+    temporary_path.write_text(text, encoding="utf-8")
+    os.replace(temporary_path, path)
+
+
+def write_run_summary(
+    status: str = "success",
+    json_path: Path | None = None,
+    prometheus_path: Path | None = None,
+) -> dict | None:
+    """
+    Writes the metrics of the current run as JSON and as a Prometheus textfile.
+
+    The textfile is replaced atomically, so the node exporter textfile
+    collector never reads a partial file.
+    """
+    json_path = json_path or config.METRICS_JSON_PATH
+    prometheus_path = prometheus_path or config.METRICS_PROMETHEUS_PATH
+    if _metrics is None:
+        return None
+    summary = _metrics.summary(status)
+    _write_atomically(json_path, json.dumps(summary, indent=2))
+    _write_atomically(prometheus_path, "\n".join(_prometheus_lines(summary)) + "\n")
+    stages = ", ".join(
+        f"{name} {values['seconds']:.1f}s" for name, values in summary["stages"].items()
+    )
+    logging.info(
+        f"Run finished ({status}) in {summary['duration_seconds']:.1f}s: {stages}."
+    )
+    return summary
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import logging
+import threading
+import pandas as pd
+import polars as pl
+import sqlalchemy as db
+from database import load_data_to_db
+from trading_calendar import sessions_between
+
+
+UNAVAILABLE_TABLE = "stock_prices_unavailable"
+DELISTED = "delisted"
+NO_DATA = "no_data"
+PROVIDER_ERROR = "provider_error"
+INVALID = "invalid"
+
+_pending: list[dict] = []
+_pending_lock = threading.Lock()
+
+
+def classify_provider_error(error: str) -> str:
+    """Reason recorded for a per-ticker provider error message."""
+    if "TzMissing" in error or "delisted" in error.lower():
+        return DELISTED
+    if "PricesMissing" in error or "no price data" in error.lower():
+        return NO_DATA
+    return PROVIDER_ERROR
+
+
+def _settled_end(end_date: dt.date) -> dt.date:
+    """Last date whose absence of data is considered final."""
+    settled = dt.date.today() - dt.timedelta(days=config.NEGATIVE_CACHE_SETTLE_DAYS)
+    return min(end_date, settled)
+
+
+def report_unavailable(
+    tickers: list[str],
+    start_date: str,
+    end_date: str,
+    reason: str,
+    detail: str | None = None,
+) -> None:
+    """
+    Queues the range [start_date, end_date) of tickers as unavailable.
+
+    Reports are kept in memory, since providers are called from worker
+    threads without a database connection, until flush_unavailable writes
+    them. The most recent NEGATIVE_CACHE_SETTLE_DAYS are never reported, as
+    their data may not be published yet.
+    """
+    first_date = dt.date.fromisoformat(str(start_date))
+    last_date = _settled_end(
+        dt.date.fromisoformat(str(end_date)) - dt.timedelta(days=1)
+    )
+    if last_date < first_date:
+        return
+    with _pending_lock:
+        _pending.extend(
+            {
+                "ticker": ticker,
+                "start_date": first_date,
+                "end_date": last_date,
+                "reason": reason,
+                "detail": detail,
+            }
+            for ticker in tickers
+        )
+
+
+def report_missing_sessions(
+    data: pd.DataFrame | pl.DataFrame,
+    tickers: list[str],
+    start_date: str,
+    end_date: str,
+    reason: str = NO_DATA,
+) -> None:
+    """
+    Queues the sessions of [start_date, end_date) for which a provider
+    response has no close price, as runs of consecutive sessions per ticker.
+
+    Args:
+        data: Provider response with ticker, date and close columns.
+        tickers: Tickers that were requested.
+    """
+    last_date = _settled_end(dt.date.fromisoformat(end_date) - dt.timedelta(days=1))
+    sessions = pl.Series(
+        "date", sessions_between(start_date, last_date), dtype=pl.Date
+    ).to_frame()
+    if sessions.is_empty() or not tickers:
+        return
+    df = pl.from_pandas(data) if isinstance(data, pd.DataFrame) else data
+    returned = df.select(
+        pl.col("ticker").cast(pl.String), pl.col("date").cast(pl.Date)
+    ).filter(df["close"].is_not_null() & df["close"].is_not_nan())
+    expected = pl.DataFrame({"ticker": tickers}).join(
+        sessions.with_row_index("session"), how="cross"
+    )
+    missing = (
+        expected.join(returned, on=["ticker", "date"], how="anti")
+        .sort("ticker", "session")
+        .with_columns(
+            (
+                pl.col("session") - pl.col("session").rank("ordinal").over("ticker")
+            ).alias("run")
+        )
+        .group_by("ticker", "run")
+        .agg(
+            pl.col("date").min().alias("start_date"),
+            pl.col("date").max().alias("end_date"),
+        )
+    )
+    if missing.is_empty():
+        return
+    with _pending_lock:
+        _pending.extend(
+            {**row, "reason": reason, "detail": None}
+            for row in missing.select("ticker", "start_date", "end_date").to_dicts()
+        )
+
+
+def report_invalid_sessions(rows: pl.DataFrame) -> None:
+    """
+    Queues the sessions of bars that failed validation.
+
+    They stay out of the gap scans for the TTL of the invalid reason, instead
+    of being fetched and rejected again on every pass.
+
+    Args:
+        rows: ticker, date and the reasons the bar was rejected for.
+    """
+    sessions = rows.select(
+        pl.col("ticker").cast(pl.String),
+        pl.col("date").cast(pl.Date),
+        pl.col("reasons"),
+    ).filter(pl.col("date") <= _settled_end(dt.date.max))
+    with _pending_lock:
+        _pending.extend(
+            {
+                "ticker": ticker,
+                "start_date": date,
+                "end_date": date,
+                "reason": INVALID,
+                "detail": reasons,
+            }
+            for ticker, date, reasons in sessions.iter_rows()
+        )
+
+
+def flush_unavailable(engine: db.Engine) -> int:
+    """Writes the queued reports to the stock_prices_unavailable table."""
+    with _pending_lock:
+        reports = _pending[:]
+        _pending.clear()
+    if not reports:
+        return 0
+    now = dt.datetime.now()
+    rows = [
+        {
+            **report,
+            "recorded_at": now,
+            "expires_at": now
+            + dt.timedelta(days=config.NEGATIVE_CACHE_TTL_DAYS[report["reason"]]),
+        }
+        for report in reports
+    ]
+    try:
+        load_data_to_db(
+            rows,
+            UNAVAILABLE_TABLE,
+            engine,
+            mode="upsert",
+            conflict_columns=("ticker", "start_date", "end_date"),
+        )
+    except Exception:
+        # Keep the reports for the next flush rather than losing them.
+        with _pending_lock:
+            _pending[:0] = reports
+        raise
+    logging.info(f"Recorded {len(rows)} unavailable price ranges.")
+    return len(rows)
+
+
+def scan_unavailable(
+    engine: db.Engine, as_of: dt.datetime | None = None
+) -> pl.DataFrame:
+    """Unexpired unavailable ranges (ticker, start_date, end_date inclusive) with their reason."""
+    df = pl.read_database(
+        f"SELECT ticker, start_date, end_date, reason FROM {UNAVAILABLE_TABLE} "
+        "WHERE expires_at > :as_of",
+        engine,
+        execute_options={"parameters": {"as_of": as_of or dt.datetime.now()}},
+    )
+    if df.is_empty():
+        return pl.DataFrame(
+            schema={
+                "ticker": pl.String,
+                "start_date": pl.Date,
+                "end_date": pl.Date,
+                "reason": pl.String,
+            }
+        )
+    return df.select(
+        pl.col("ticker").str.strip_chars(),
+        pl.col("start_date").cast(pl.Date),
+        pl.col("end_date").cast(pl.Date),
+        pl.col("reason"),
+    )
+
+
+def purge_expired_unavailable(engine: db.Engine) -> int:
+    """Deletes the expired unavailable ranges."""
+    with engine.begin() as connection:
+        return connection.execute(
+            db.text(
+                f"DELETE FROM {UNAVAILABLE_TABLE} WHERE expires_at <= :now"
+            ).bindparams(now=dt.datetime.now())
+        ).rowcount
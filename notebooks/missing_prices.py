@@ -10,21 +10,21 @@ def _():
     import polars as pl
     from database import get_engine
     from config import POSTGRES_URL
-    from transformations import stock_prices_transformations, catch_missing_prices, creating_sp500_index_timeline, sp500_changes_transformations, sp500_companies_transformations
+    from transformations import price_coverage_transformations, catch_missing_prices, creating_sp500_index_timeline, sp500_changes_transformations, sp500_companies_transformations
     from utils import date_range
-    from data_sourcing import get_market_working_days
+    from trading_calendar import sessions_series
     return (
         POSTGRES_URL,
         catch_missing_prices,
         creating_sp500_index_timeline,
         date_range,
         get_engine,
-        get_market_working_days,
         mo,
         pl,
         sp500_changes_transformations,
         sp500_companies_transformations,
-        stock_prices_transformations,
+        price_coverage_transformations,
+        sessions_series,
     )
 
 
@@ -33,16 +33,14 @@ def _(
     POSTGRES_URL,
     date_range,
     get_engine,
-    get_market_working_days,
-    pl,
-    stock_prices_transformations,
+    price_coverage_transformations,
+    sessions_series,
 ):
     start_date, end_date = date_range(60)
     engine = get_engine(POSTGRES_URL)
-    prices_df = stock_prices_transformations(engine=engine)
-    pd_target_dates = get_market_working_days(end_date=end_date, start_date=start_date)
-    target_dates_df = pl.from_pandas(pd_target_dates)
-    return engine, prices_df, target_dates_df
+    coverage_df = price_coverage_transformations(engine=engine)
+    target_dates_df = sessions_series(start_date, end_date)
+    return coverage_df, engine, target_dates_df
 
 
 @app.cell
@@ -54,9 +52,9 @@ def _(mo, target_dates_df):
 @app.cell
 def _(
     catch_missing_prices,
+    coverage_df,
     creating_sp500_index_timeline,
     engine,
-    prices_df,
     sp500_changes_transformations,
     sp500_companies_transformations,
     target_dates_df,
@@ -64,7 +62,7 @@ def _(
     companies_df = sp500_companies_transformations(engine=engine)
     changes_df = sp500_changes_transformations(engine=engine)
     timeline_df = creating_sp500_index_timeline(changes_df, companies_df, target_dates_df)
-    missing_ranges = catch_missing_prices(prices_df, timeline_df)
+    missing_ranges = catch_missing_prices(coverage_df, timeline_df, target_dates_df)
     return (missing_ranges,)
 
 
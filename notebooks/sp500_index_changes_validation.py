@@ -106,5 +106,23 @@ def _(mo, pl, tickers_for_analysis):
     return
 
 
+@app.cell
+def _(engine, mo, pl, tickers_for_analysis):
+    from constituent_index import load_constituent_index
+
+    constituent_index = load_constituent_index(engine)
+    mo.ui.table(
+        pl.DataFrame(
+            [
+                {"ticker": ticker, "added_date": added, "removed_date": removed}
+                for ticker in sorted(set(tickers_for_analysis["ticker"].to_list()))
+                for added, removed in constituent_index.membership_of(ticker)
+            ],
+            schema={"ticker": pl.String, "added_date": pl.Date, "removed_date": pl.Date},
+        )
+    )
+    return
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import threading
+import pandas as pd
+import polars as pl
+import sqlalchemy as db
+from pathlib import Path
+from typing import Callable
+from corporate_actions import load_corporate_actions, update_adjustment_factors
+from database import load_data_to_db
+from feature_store import mark_features_dirty
+from price_coverage import update_price_coverage
+from price_validation import filter_valid_prices
+
+
+PRICE_COLUMNS = ["date", "ticker", "open", "high", "low", "close", "volume"]
+ACTION_COLUMNS = ["dividends", "stock_splits"]
+VALUE_COLUMNS = ["open", "high", "low", "close"]
+HIVE_SCHEMA = {"ticker": pl.String, "year": pl.Int32}
+MANIFEST_DIR_NAME = "_manifest"
+# Entries of older formats hold split and dividend adjusted prices, so they
+# are not served anymore and age out through eviction.
+CACHE_FORMAT = 2
+
+_manifest_lock = threading.Lock()
+_manifest_index: dict[Path, tuple[float, list[dict]]] = {}
+
+
+def _request_key(tickers: list[str], start_date: str, end_date: str) -> str:
+    """Content address of a provider request."""
+    identity = f"{','.join(sorted(tickers))}|{start_date}|{end_date}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:20]
+
+
+def _manifest_entries(cache_dir: Path) -> list[dict]:
+    """Returns the cached manifest entries, reloading them when the directory changed."""
+    manifest_dir = cache_dir / MANIFEST_DIR_NAME
+    if not manifest_dir.exists():
+        return []
+    with _manifest_lock:
+        modified_at = manifest_dir.stat().st_mtime
+        cached = _manifest_index.get(manifest_dir)
+        if cached is None or cached[0] != modified_at:
+            entries = []
+            for path in manifest_dir.glob("*.json"):
+                try:
+                    entries.append(json.loads(path.read_text(encoding="utf-8")))
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Skipping unreadable cache manifest {path}: {e}")
+            _manifest_index[manifest_dir] = (modified_at, entries)
+            cached = _manifest_index[manifest_dir]
+        return cached[1]
+
+
+def _is_fresh(entry: dict, ttl: dt.timedelta | None, now: dt.datetime) -> bool:
+    if ttl is None:
+        return True
+    return now - dt.datetime.fromisoformat(entry["fetched_at"]) <= ttl
+
+
+def write_cached_prices(
+    data: pd.DataFrame | None,
+    tickers: list[str],
+    start_date: str,
+    end_date: str,
+    cache_dir: Path | None = None,
+) -> None:
+    """
+    Stores the normalized provider response for a request in the Parquet cache.
+
+    Rows are written as content-addressed files under
+    ticker=<ticker>/year=<year>/, and a manifest entry records which tickers
+    and dates the request covered. Rows without any price are not cached, so
+    a ticker whose rows are all NaN is not recorded as covered.
+    """
+    cache_dir = cache_dir or config.PRICE_CACHE_DIR
+    fetched_at = dt.datetime.now()
+    files, priced = [], set()
+    if data is not None and not data.empty:
+        df = (
+            pl.from_pandas(data[[c for c in PRICE_COLUMNS if c in data.columns]])
+            .with_columns(
+                pl.col("date").cast(pl.Date),
+                *[
+                    pl.Series(column, data[column], dtype=pl.Float64)
+                    if column in data.columns
+                    else pl.lit(0.0).alias(column)
+                    for column in ACTION_COLUMNS
+                ],
+                pl.lit(fetched_at).alias("fetched_at"),
+            )
+            .with_columns(pl.col("date").dt.year().alias("year"))
+        )
+        values = [column for column in VALUE_COLUMNS if column in df.columns]
+        df = df.filter(pl.any_horizontal(pl.col(values).fill_nan(None).is_not_null()))
+        priced = set(df["ticker"].unique())
+        for (ticker, year), partition in df.group_by(["ticker", "year"]):
+            partition = partition.drop("ticker", "year").sort("date")
+            digest = hashlib.sha256(
+                partition.drop("fetched_at").write_csv().encode()
+            ).hexdigest()[:20]
+            relative_path = (
+                Path(f"ticker={ticker}") / f"year={year}" / f"{digest}.parquet"
+            )
+            path = cache_dir / relative_path
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                partition.write_parquet(path)
+            files.append(relative_path.as_posix())
+
+    key = _request_key(tickers, start_date, end_date)
+    manifest_dir = cache_dir / MANIFEST_DIR_NAME
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+    entry = {
+        "key": key,
+        "tickers": sorted(set(tickers) & priced),
+        "start_date": start_date,
+        "end_date": end_date,
+        "fetched_at": fetched_at.isoformat(),
+        "format": CACHE_FORMAT,
+        "files": files,
+    }
+    temporary_path = manifest_dir / f".{key}.{threading.get_ident()}.tmp"
+    temporary_path.write_text(json.dumps(entry), encoding="utf-8")
+    os.replace(temporary_path, manifest_dir / f"{key}.json")
+
+
+def read_cached_prices(
+    tickers: list[str],
+    start_date: str,
+    end_date: str,
+    cache_dir: Path | None = None,
+    ttl: dt.timedelta | None = dt.timedelta(days=config.PRICE_CACHE_TTL_DAYS),
+) -> tuple[pd.DataFrame | None, list[str]]:
+    """
+    Serves a request from the Parquet cache.
+
+    Returns:
+        The cached rows of the tickers fully covered by fresh cache entries
+        (None if there are none), and the tickers that still have to be
+        fetched from the provider.
+    """
+    cache_dir = cache_dir or config.PRICE_CACHE_DIR
+    now = dt.datetime.now()
+    covered, files = set(), set()
+    for entry in _manifest_entries(cache_dir):
+        if (
+            entry.get("format") == CACHE_FORMAT
+            and entry["start_date"] <= start_date
+            and entry["end_date"] >= end_date
+            and _is_fresh(entry, ttl, now)
+        ):
+            entry_tickers = set(entry["tickers"]) & set(tickers)
+            covered |= entry_tickers
+            files |= {
+                file
+                for file in entry["files"]
+                if file.split("/", 1)[0].removeprefix("ticker=") in entry_tickers
+            }
+    missing = [ticker for ticker in tickers if ticker not in covered]
+    existing_files = [cache_dir / file for file in files if (cache_dir / file).exists()]
+    if not existing_files:
+        return None, missing
+
+    df = (
+        pl.scan_parquet(existing_files, hive_partitioning=True, hive_schema=HIVE_SCHEMA)
+        .filter(
+            pl.col("ticker").is_in(list(covered))
+            & (pl.col("date") >= dt.date.fromisoformat(start_date))
+            & (pl.col("date") < dt.date.fromisoformat(end_date))
+        )
+        .sort("fetched_at")
+        .unique(subset=["ticker", "date"], keep="last")
+        .sort(["ticker", "date"])
+        .collect()
+    )
+    if df.is_empty():
+        return None, missing
+    data = df.select(PRICE_COLUMNS + ACTION_COLUMNS).to_pandas()
+    data["date"] = pd.to_datetime(data["date"])
+    return data, missing
+
+
+def cached_fetch(
+    fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+    cache_dir: Path | None = None,
+    ttl: dt.timedelta | None = dt.timedelta(days=config.PRICE_CACHE_TTL_DAYS),
+) -> Callable[[list[str], str, str], pd.DataFrame | None]:
+    """Wraps a provider fetch function so it consults the Parquet cache first."""
+    cache_dir = cache_dir or config.PRICE_CACHE_DIR
+
+    def fetch_with_cache(
+        tickers: list[str], start_date: str, end_date: str
+    ) -> pd.DataFrame | None:
+        cached, missing = read_cached_prices(
+            tickers, start_date, end_date, cache_dir, ttl
+        )
+        if not missing:
+            logging.info(f"Served {len(tickers)} tickers from the price cache.")
+            return cached
+        data = fetch(missing, start_date, end_date)
+        if data is not None and not data.empty:
+            write_cached_prices(
+                data, sorted(data["ticker"].unique()), start_date, end_date, cache_dir
+            )
+        frames = [frame for frame in (cached, data) if frame is not None]
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True)
+
+    return fetch_with_cache
+
+
+def evict_price_cache(
+    cache_dir: Path | None = None,
+    max_bytes: int = config.PRICE_CACHE_MAX_BYTES,
+    ttl: dt.timedelta | None = dt.timedelta(days=config.PRICE_CACHE_TTL_DAYS),
+) -> None:
+    """Drops expired manifest entries, then the oldest ones until under max_bytes."""
+    cache_dir = cache_dir or config.PRICE_CACHE_DIR
+    manifest_dir = cache_dir / MANIFEST_DIR_NAME
+    if not manifest_dir.exists():
+        return
+    now = dt.datetime.now()
+    entries = sorted(_manifest_entries(cache_dir), key=lambda e: e["fetched_at"])
+    kept = [entry for entry in entries if _is_fresh(entry, ttl, now)]
+    sizes = {
+        path.relative_to(cache_dir).as_posix(): path.stat().st_size
+        for path in cache_dir.glob("ticker=*/year=*/*.parquet")
+    }
+
+    def referenced_bytes(entries: list[dict]) -> int:
+        return sum(
+            sizes.get(file, 0) for file in {f for e in entries for f in e["files"]}
+        )
+
+    while kept and referenced_bytes(kept) > max_bytes:
+        kept.pop(0)
+
+    kept_keys = {entry["key"] for entry in kept}
+    for entry in entries:
+        if entry["key"] not in kept_keys:
+            (manifest_dir / f"{entry['key']}.json").unlink(missing_ok=True)
+    referenced = {file for entry in kept for file in entry["files"]}
+    for file in sizes.keys() - referenced:
+        (cache_dir / file).unlink(missing_ok=True)
+    logging.info(
+        f"Price cache holds {len(kept)} requests "
+        f"({referenced_bytes(kept) / 2**20:.1f} MiB) after eviction."
+    )
+
+
+def load_price_cache_to_db(
+    engine: db.Engine,
+    cache_dir: Path | None = None,
+    chunk_size: int = 250_000,
+) -> None:
+    """
+    Bulk loads every cached price row into stock_prices without calling the provider.
+
+    Rows go through the same validation as fetched ones. The corporate
+    actions of the cached responses are loaded as well, and the adjustment
+    factors of the loaded tickers are recomputed at the end.
+    """
+    cache_dir = cache_dir or config.PRICE_CACHE_DIR
+    files = {
+        file
+        for entry in _manifest_entries(cache_dir)
+        if entry.get("format") == CACHE_FORMAT
+        for file in entry["files"]
+    }
+    existing_files = [cache_dir / file for file in files if (cache_dir / file).exists()]
+    if not existing_files:
+        logging.warning(f"No cached prices found in {cache_dir}.")
+        return
+    df = (
+        pl.scan_parquet(
+            existing_files,
+            hive_partitioning=True,
+            hive_schema=HIVE_SCHEMA,
+        )
+        .sort("fetched_at")
+        .unique(subset=["ticker", "date"], keep="last")
+        .select(PRICE_COLUMNS + ACTION_COLUMNS)
+        .sort(["ticker", "date"])
+        .collect()
+    )
+    for chunk in df.iter_slices(chunk_size):
+        mark_features_dirty(load_corporate_actions(chunk, engine), engine)
+        chunk = filter_valid_prices(chunk, engine)
+        load_data_to_db(
+            chunk.to_dicts(),
+            "stock_prices",
+            engine,
+            mode="upsert",
+            on_conflict=config.PRICE_UPSERT_ON_CONFLICT,
+            before_commit=lambda connection: update_price_coverage(chunk, connection),
+        )
+        mark_features_dirty(chunk, engine)
+    update_adjustment_factors(engine, df["ticker"].unique().to_list())
+    logging.info(f"Loaded {len(df)} cached price rows into 'stock_prices'.")
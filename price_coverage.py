@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import pandas as pd
+import polars as pl
+import sqlalchemy as db
+from database import get_table
+from trading_calendar import sessions_series
+from transformations import (
+    dates_to_intervals,
+    intervals_to_sessions,
+    merge_intervals,
+    price_coverage_transformations,
+    sessions_index,
+    sessions_to_intervals,
+)
+
+
+COVERAGE_TABLE = "stock_prices_coverage"
+
+
+def _loaded_price_dates(prices: pd.DataFrame | pl.DataFrame) -> pl.DataFrame:
+    """Returns the (ticker, date) pairs of a price batch that hold actual prices."""
+    df = pl.from_pandas(prices) if isinstance(prices, pd.DataFrame) else prices
+    return (
+        df.filter(pl.col("open").is_not_null() & pl.col("open").is_not_nan())
+        .select(
+            pl.col("ticker").str.strip_chars().alias("ticker"),
+            pl.col("date").cast(pl.Date).alias("date"),
+        )
+        .drop_nulls()
+    )
+
+
+def _write_coverage(
+    intervals_df: pl.DataFrame, tickers: list[str], connection: db.Connection
+) -> None:
+    """Replaces the coverage intervals of the given tickers on connection."""
+    table = get_table(connection.engine, COVERAGE_TABLE)
+    rows = intervals_df.select("ticker", "start_date", "end_date").to_dicts()
+    connection.execute(table.delete().where(table.c.ticker.in_(tickers)))
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def update_price_coverage(
+    prices: pd.DataFrame | pl.DataFrame, connection: db.Connection
+) -> None:
+    """
+    Merges the dates of a freshly loaded price batch into the coverage index.
+
+    Meant to run on the connection that loaded the batch, as the
+    before_commit hook of load_data_to_db, so the loaded rows and their
+    coverage are committed together. Only the intervals of the batch's
+    tickers are read.
+    """
+    loaded = _loaded_price_dates(prices)
+    if loaded.is_empty():
+        return
+    tickers = loaded["ticker"].unique().to_list()
+    stored = price_coverage_transformations(connection, tickers)
+    first_date = min(
+        [loaded["date"].min()] + ([stored["start_date"].min()] if len(stored) else [])
+    )
+    last_date = max(
+        [loaded["date"].max()] + ([stored["end_date"].max()] if len(stored) else [])
+    )
+    sessions = sessions_index(sessions_series(first_date, last_date))
+    new_intervals = dates_to_intervals(loaded, sessions)
+    if not stored.is_empty():
+        new_intervals = pl.concat(
+            [new_intervals, intervals_to_sessions(stored, sessions)]
+        )
+    merged = sessions_to_intervals(merge_intervals(new_intervals), sessions)
+    _write_coverage(merged, tickers, connection)
+    logging.info(
+        f"Coverage index updated for {len(tickers)} tickers ({len(merged)} intervals)."
+    )
+
+
+def rebuild_price_coverage(engine: db.Engine) -> None:
+    """Rebuilds the whole coverage index from the stock_prices table."""
+    loaded = _loaded_price_dates(
+        pl.read_database(
+            "SELECT ticker, date, open FROM stock_prices WHERE open IS NOT NULL",
+            engine,
+        )
+    )
+    table = get_table(engine, COVERAGE_TABLE)
+    if loaded.is_empty():
+        with engine.begin() as connection:
+            connection.execute(table.delete())
+        logging.info("stock_prices table is empty, coverage index cleared.")
+        return
+    sessions = sessions_index(
+        sessions_series(loaded["date"].min(), loaded["date"].max())
+    )
+    intervals = sessions_to_intervals(dates_to_intervals(loaded, sessions), sessions)
+    with engine.begin() as connection:
+        connection.execute(table.delete())
+        _write_coverage(intervals, loaded["ticker"].unique().to_list(), connection)
+    logging.info(f"Coverage index rebuilt with {len(intervals)} intervals.")
+
+
+def ensure_price_coverage(engine: db.Engine) -> None:
+    """Seeds the coverage index from stock_prices when it has never been built."""
+    with engine.connect() as connection:
+        has_coverage = connection.execute(
+            db.text(f"SELECT 1 FROM {COVERAGE_TABLE} LIMIT 1")
+        ).first()
+        has_prices = connection.execute(
+            db.text("SELECT 1 FROM stock_prices LIMIT 1")
+        ).first()
+    if has_prices and not has_coverage:
+        logging.info("Coverage index is empty, rebuilding it from stock_prices...")
+        rebuild_price_coverage(engine)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import config
+import json
+import logging
+import sqlalchemy as db
+from typing import AsyncIterator, Iterable
+
+
+NOTIFY_TABLES = {"stock_prices"}
+# PostgreSQL rejects notification payloads of 8000 bytes or more.
+MAX_PAYLOAD_BYTES = 7900
+
+
+def price_load_payload(
+    table_name: str, rows: list[dict], inserted: int, updated: int
+) -> str:
+    """
+    Compact JSON description of a loaded price batch.
+
+    Carries the table, the sorted ticker set, the first and last dates and the
+    inserted and updated row counts. When the ticker list doesn't fit in a
+    notification it's sent as null, and ticker_count tells how many there were.
+    """
+    tickers = sorted({str(row["ticker"]).strip() for row in rows})
+    dates = [str(row["date"])[:10] for row in rows if row.get("date") is not None]
+    payload = {
+        "table": table_name,
+        "tickers": tickers,
+        "ticker_count": len(tickers),
+        "start_date": min(dates, default=None),
+        "end_date": max(dates, default=None),
+        "rows": inserted + updated,
+        "inserted": inserted,
+        "updated": updated,
+    }
+    message = json.dumps(payload, separators=(",", ":"))
+    if len(message.encode()) > MAX_PAYLOAD_BYTES:
+        message = json.dumps({**payload, "tickers": None}, separators=(",", ":"))
+    return message
+
+
+def notify_price_load(
+    connection: db.Connection,
+    table_name: str,
+    rows: list[dict],
+    inserted: int,
+    updated: int,
+) -> None:
+    """
+    Queues a notification of a loaded price batch on the open transaction.
+
+    PostgreSQL only delivers it to the listeners once the transaction
+    commits, and drops it on rollback. Nothing is sent for other tables,
+    batches that changed no row, or on SQLite.
+    """
+    if (
+        connection.dialect.name != "postgresql"
+        or table_name not in NOTIFY_TABLES
+        or not inserted + updated
+    ):
+        return
+    connection.execute(
+        db.select(
+            db.func.pg_notify(
+                config.PRICE_NOTIFY_CHANNEL,
+                price_load_payload(table_name, rows, inserted, updated),
+            )
+        )
+    )
+
+
+class PriceSubscriber:
+    """
+    Listens for price load notifications on a dedicated PostgreSQL connection.
+
+    The connection's socket is watched by the event loop, so waiting costs no
+    query and a notification is handed over as soon as the loading
+    transaction commits. Use it as an async context manager, then await get
+    or iterate over it:
+
+        async with PriceSubscriber() as subscriber:
+            async for batch in subscriber:
+                ...
+
+    Batches committed before the subscriber entered its context are not seen.
+    """
+
+    def __init__(
+        self,
+        db_url: str = config.POSTGRES_URL,
+        channel: str = config.PRICE_NOTIFY_CHANNEL,
+    ) -> None:
+        if db.make_url(db_url).get_backend_name() != "postgresql":
+            raise NotImplementedError(
+                "Price notifications are only published by PostgreSQL databases."
+            )
+        self.db_url = db_url
+        self.channel = channel
+        self._engine: db.Engine | None = None
+        self._connection = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def __aenter__(self) -> "PriceSubscriber":
+        # A connection of its own, outside every pool, as it's held for as
+        # long as the subscriber listens.
+        self._engine = db.create_engine(self.db_url, poolclass=db.pool.NullPool)
+        self._connection = self._engine.raw_connection()
+        listener = self._connection.driver_connection
+        listener.autocommit = True
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        asyncio.get_running_loop().add_reader(listener.fileno(), self._read)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops listening and closes the connection."""
+        if self._connection is None:
+            return
+        listener = self._connection.driver_connection
+        asyncio.get_running_loop().remove_reader(listener.fileno())
+        self._connection.close()
+        self._engine.dispose()
+        self._connection, self._engine = None, None
+
+    def _read(self) -> None:
+        """Moves the notifications received on the socket into the queue."""
+        listener = self._connection.driver_connection
+        try:
+            listener.poll()
+        except Exception as e:
+            asyncio.get_running_loop().remove_reader(listener.fileno())
+            self._queue.put_nowait(e)
+            return
+        while listener.notifies:
+            notification = listener.notifies.pop(0)
+            try:
+                self._queue.put_nowait(json.loads(notification.payload))
+            except ValueError:
+                logging.warning(
+                    f"Ignoring malformed price notification: {notification.payload}"
+                )
+
+    async def get(self, timeout: float | None = None) -> dict:
+        """
+        Waits for the next loaded batch.
+
+        Raises:
+            TimeoutError: If no batch was loaded within timeout seconds.
+        """
+        async with asyncio.timeout(timeout):
+            batch = await self._queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        while True:
+            yield await self.get()
+
+
+def touches(batch: dict, tickers: Iterable[str]) -> bool:
+    """Whether a notified batch may contain prices of any of tickers."""
+    return batch["tickers"] is None or not set(tickers).isdisjoint(batch["tickers"])
+
+
+async def wait_for_prices(
+    tickers: Iterable[str] | None = None,
+    timeout: float | None = None,
+    db_url: str = config.POSTGRES_URL,
+) -> dict:
+    """
+    Waits for the next loaded batch, of any of tickers when given.
+
+    Raises:
+        TimeoutError: If no matching batch was loaded within timeout seconds.
+    """
+    tickers = None if tickers is None else set(tickers)
+    async with asyncio.timeout(timeout), PriceSubscriber(db_url) as subscriber:
+        async for batch in subscriber:
+            if tickers is None or touches(batch, tickers):
+                return batch
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses the price notification listener options."""
+    parser = argparse.ArgumentParser(
+        description="Print the price batches loaded into the database as they commit."
+    )
+    parser.add_argument("--db-url", default=config.POSTGRES_URL)
+    parser.add_argument("--channel", default=config.PRICE_NOTIFY_CHANNEL)
+    return parser.parse_args()
+
+
+async def _print_notifications(db_url: str, channel: str) -> None:
+    async with PriceSubscriber(db_url, channel) as subscriber:
+        logging.info(f"Listening on '{channel}'...")
+        async for batch in subscriber:
+            print(json.dumps(batch), flush=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args()
+    try:
+        asyncio.run(_print_notifications(args.db_url, args.channel))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import config
+import datetime as dt
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import polars as pl
+import sqlalchemy as db
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Sequence
+from corporate_actions import REFERENCE_CLOSE_LOOKAHEAD, scan_adjustment_factors
+from database import get_engine
+from trading_calendar import load_sessions
+from transformations import iter_stock_prices, scan_stock_prices
+
+
+PANEL_FORMAT = 1
+PANEL_FIELDS = ["open", "high", "low", "close", "volume"]
+HEADER_FILE = "header.json"
+SESSIONS_FILE = "sessions.npy"
+# Ticker rows are allocated in blocks, and grown by half the capacity at least,
+# so most new tickers don't resize the files.
+TICKER_BLOCK = 64
+
+
+@dataclass(frozen=True)
+class MappedPricePanel:
+    """
+    Read-only view of the persisted price panel.
+
+    Every field is a tickers x sessions array memory mapped from its file, so
+    processes opening the same panel share its pages instead of copying them.
+    Tickers and sessions are located through dictionaries, so a cell lookup
+    takes constant time. Cells without a stored price are NaN.
+    """
+
+    tickers: np.ndarray
+    sessions: np.ndarray
+    fields: dict[str, np.ndarray]
+    ticker_rows: dict[str, int] = field(repr=False)
+    session_columns: dict[dt.date, int] = field(repr=False)
+
+    def row(self, field_name: str, ticker: str) -> np.ndarray:
+        """Every session of field for ticker, as a view of the mapped file."""
+        return self.fields[field_name][self.ticker_rows[ticker]]
+
+    def get(self, field_name: str, ticker: str, date: dt.date | str) -> float:
+        """Value of field for ticker on date, NaN when it isn't stored."""
+        if isinstance(date, str):
+            date = dt.date.fromisoformat(date)
+        row = self.ticker_rows.get(ticker)
+        column = self.session_columns.get(date)
+        if row is None or column is None:
+            return float("nan")
+        return float(self.fields[field_name][row, column])
+
+    def columns(
+        self,
+        start_date: dt.date | str | None = None,
+        end_date: dt.date | str | None = None,
+    ) -> slice:
+        """Slice of the sessions from start_date to end_date (inclusive)."""
+        start = np.searchsorted(
+            self.sessions, np.datetime64(start_date or self.sessions[0], "D")
+        )
+        end = np.searchsorted(
+            self.sessions, np.datetime64(end_date or self.sessions[-1], "D"), "right"
+        )
+        return slice(int(start), int(end))
+
+
+def _read_header(panel_dir: Path) -> dict | None:
+    try:
+        header = json.loads((panel_dir / HEADER_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    if header.get("format") != PANEL_FORMAT:
+        logging.warning(f"Ignoring price panel of unknown format in {panel_dir}.")
+        return None
+    return header
+
+
+def _write_header(panel_dir: Path, header: dict) -> None:
+    """Writes the header atomically, which publishes the arrays to new readers."""
+    header["updated_at"] = dt.datetime.now().isoformat(timespec="seconds")
+    temporary_path = panel_dir / f".{HEADER_FILE}.tmp"
+    temporary_path.write_text(json.dumps(header, indent=2), encoding="utf-8")
+    os.replace(temporary_path, panel_dir / HEADER_FILE)
+
+
+def _ticker_capacity(count: int) -> int:
+    return max(TICKER_BLOCK, -(-count // TICKER_BLOCK) * TICKER_BLOCK)
+
+
+def _resize(
+    panel_dir: Path, header: dict, ticker_capacity: int, sessions: np.ndarray
+) -> dict:
+    """
+    Rewrites every field file with a new shape, keeping the stored values.
+
+    The new files replace the old ones atomically, so readers keep the
+    mapping they opened and see the new shape when they open the panel again.
+    """
+    old_sessions = np.load(panel_dir / SESSIONS_FILE) if header["tickers"] else None
+    for name in header["fields"]:
+        path = panel_dir / f"{name}.npy"
+        temporary_path = panel_dir / f".{name}.tmp.npy"
+        array = np.lib.format.open_memmap(
+            temporary_path,
+            mode="w+",
+            dtype=header["dtype"],
+            shape=(ticker_capacity, len(sessions)),
+        )
+        array[:] = np.nan
+        if old_sessions is not None:
+            old = np.load(path, mmap_mode="r")
+            offset = int(np.searchsorted(sessions, old_sessions[0]))
+            width = min(len(old_sessions), len(sessions) - offset)
+            rows = min(len(header["tickers"]), ticker_capacity)
+            array[:rows, offset : offset + width] = old[:rows, :width]
+            del old
+        array.flush()
+        del array
+        os.replace(temporary_path, path)
+    temporary_path = panel_dir / f".{SESSIONS_FILE}.tmp.npy"
+    np.save(temporary_path, sessions)
+    os.replace(temporary_path, panel_dir / SESSIONS_FILE)
+    return {
+        **header,
+        "ticker_capacity": ticker_capacity,
+        "first_session": str(sessions[0]),
+        "session_count": len(sessions),
+    }
+
+
+def _write_prices(
+    panel_dir: Path,
+    header: dict,
+    prices: pl.DataFrame,
+    clear_tickers: Sequence[str] = (),
+) -> tuple[dict, int]:
+    """
+    Writes price rows into their cells, growing the panel for new tickers
+    and sessions. The rows of clear_tickers are emptied first.
+
+    Returns:
+        The updated header, which the caller must write, and the number of
+        rows written.
+    """
+    tickers = header["tickers"]
+    known = set(tickers)
+    new_tickers = sorted(
+        (set(prices["ticker"].unique().to_list()) | set(clear_tickers)) - known
+    )
+    tickers.extend(new_tickers)
+    sessions = np.load(panel_dir / SESSIONS_FILE)
+    if not prices.is_empty() and prices["date"].max() > sessions[-1].astype(dt.date):
+        sessions = load_sessions()
+    if (
+        len(tickers) > header["ticker_capacity"]
+        or len(sessions) != header["session_count"]
+    ):
+        header = _resize(
+            panel_dir,
+            {**header, "tickers": tickers[: len(known)]},
+            _ticker_capacity(max(len(tickers), header["ticker_capacity"] * 3 // 2)),
+            sessions,
+        )
+        header["tickers"] = tickers
+
+    dates = prices["date"].to_numpy().astype("datetime64[D]")
+    columns = np.minimum(np.searchsorted(sessions, dates), len(sessions) - 1)
+    on_session = sessions[columns] == dates
+    if not on_session.all():
+        logging.warning(
+            f"Skipping {int((~on_session).sum())} price rows dated outside the "
+            "trading calendar."
+        )
+    ticker_rows = {ticker: row for row, ticker in enumerate(tickers)}
+    rows = prices["ticker"].replace_strict(ticker_rows, return_dtype=pl.Int64)
+    rows, columns = rows.to_numpy()[on_session], columns[on_session]
+    cleared = [ticker_rows[ticker] for ticker in clear_tickers]
+    for name in header["fields"]:
+        array = np.lib.format.open_memmap(panel_dir / f"{name}.npy", mode="r+")
+        if cleared:
+            array[cleared] = np.nan
+        if name in prices.columns:
+            values = prices[name].cast(pl.Float64).to_numpy()[on_session]
+            array[rows, columns] = values
+        array.flush()
+        del array
+    if len(rows):
+        last_date = str(sessions[columns.max()])
+        header["last_date"] = max(header.get("last_date") or last_date, last_date)
+    return header, len(rows)
+
+
+def build_price_panel(
+    engine: db.Engine,
+    panel_dir: Path | None = None,
+    dtype: str = config.PRICE_PANEL_DTYPE,
+) -> int:
+    """
+    Builds the price panel from every stored price, adjusted for corporate actions.
+
+    The panel is written to a temporary directory and its files moved into
+    panel_dir once complete, header last, so readers of an earlier panel are
+    never shown a partial one.
+
+    Returns:
+        Number of price rows written.
+    """
+    panel_dir = panel_dir or config.PRICE_PANEL_DIR
+    temporary_dir = panel_dir.with_name(f".{panel_dir.name}.tmp")
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    temporary_dir.mkdir(parents=True)
+    header = _resize(
+        temporary_dir,
+        {
+            "format": PANEL_FORMAT,
+            "dtype": np.dtype(dtype).name,
+            "fields": PANEL_FIELDS,
+            "tickers": [],
+            "last_date": None,
+        },
+        TICKER_BLOCK,
+        load_sessions(),
+    )
+    written = 0
+    for chunk in iter_stock_prices(engine, columns=PANEL_FIELDS, source="database"):
+        header, count = _write_prices(temporary_dir, header, chunk)
+        written += count
+    if header["ticker_capacity"] > _ticker_capacity(len(header["tickers"])):
+        header = _resize(
+            temporary_dir,
+            header,
+            _ticker_capacity(len(header["tickers"])),
+            np.load(temporary_dir / SESSIONS_FILE),
+        )
+    panel_dir.mkdir(parents=True, exist_ok=True)
+    for path in temporary_dir.iterdir():
+        if path.name != HEADER_FILE:
+            os.replace(path, panel_dir / path.name)
+    _write_header(panel_dir, header)
+    shutil.rmtree(temporary_dir)
+    logging.info(
+        f"Price panel built with {len(header['tickers'])} tickers over "
+        f"{header['session_count']} sessions ({written} rows)."
+    )
+    return written
+
+
+def update_price_panel(
+    engine: db.Engine,
+    tickers: Sequence[str],
+    start_date: dt.date | str,
+    end_date: dt.date | str,
+    panel_dir: Path | None = None,
+) -> int:
+    """
+    Appends the prices of tickers loaded from start_date to end_date (exclusive).
+
+    Only the loaded cells are written, except for the tickers with a
+    corporate action whose factor the load may have changed (see
+    update_adjustment_factors): their earlier adjusted prices changed too,
+    so their whole rows are rewritten. Nothing is done until the panel was
+    built with build_price_panel.
+
+    The panel has a single writer: loads running in parallel processes must
+    leave the update to one step after them.
+
+    Returns:
+        Number of price rows written.
+    """
+    panel_dir = panel_dir or config.PRICE_PANEL_DIR
+    header = _read_header(panel_dir)
+    if header is None or not tickers:
+        return 0
+    start_date = dt.date.fromisoformat(str(start_date))
+    end_date = dt.date.fromisoformat(str(end_date))
+    factors = scan_adjustment_factors(engine, list(tickers))
+    rewritten = (
+        factors.filter(
+            pl.col("ex_date").is_between(
+                start_date, end_date + REFERENCE_CLOSE_LOOKAHEAD
+            )
+        )["ticker"]
+        .unique()
+        .sort()
+        .to_list()
+    )
+    appended = sorted(set(tickers) - set(rewritten))
+    frames = []
+    if appended:
+        frames.append(
+            scan_stock_prices(
+                engine,
+                tickers=appended,
+                start_date=start_date,
+                end_date=end_date - dt.timedelta(days=1),
+                columns=PANEL_FIELDS,
+                source="database",
+            )
+        )
+    if rewritten:
+        frames.append(
+            scan_stock_prices(
+                engine, tickers=rewritten, columns=PANEL_FIELDS, source="database"
+            )
+        )
+    prices = pl.concat(pl.collect_all(frames))
+    header, written = _write_prices(panel_dir, header, prices, rewritten)
+    _write_header(panel_dir, header)
+    return written
+
+
+def open_price_panel(panel_dir: Path | None = None) -> MappedPricePanel:
+    """
+    Maps the persisted price panel read-only.
+
+    The view is a snapshot of the header: tickers and sessions added by later
+    updates show up after opening the panel again.
+    """
+    panel_dir = panel_dir or config.PRICE_PANEL_DIR
+    header = _read_header(panel_dir)
+    if header is None:
+        raise FileNotFoundError(f"No price panel found in {panel_dir}.")
+    ticker_count = len(header["tickers"])
+    session_count = header["session_count"]
+    sessions = np.load(panel_dir / SESSIONS_FILE)[:session_count]
+    return MappedPricePanel(
+        tickers=np.array(header["tickers"], dtype=str),
+        sessions=sessions,
+        fields={
+            name: np.load(panel_dir / f"{name}.npy", mmap_mode="r")[
+                :ticker_count, :session_count
+            ]
+            for name in header["fields"]
+        },
+        ticker_rows={ticker: row for row, ticker in enumerate(header["tickers"])},
+        session_columns={
+            session: column for column, session in enumerate(sessions.astype(dt.date))
+        },
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses the price panel command line options."""
+    parser = argparse.ArgumentParser(
+        description="Build the memory-mapped price panel from stock_prices."
+    )
+    parser.add_argument("--panel-dir", type=Path, default=config.PRICE_PANEL_DIR)
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float64"],
+        default=config.PRICE_PANEL_DTYPE,
+        help="Precision of the stored values.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args()
+    build_price_panel(get_engine(config.POSTGRES_URL), args.panel_dir, args.dtype)
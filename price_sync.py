@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import logging
+import metrics
+import pandas as pd
+import sqlalchemy as db
+from typing import Callable
+from corporate_actions import load_corporate_actions, update_adjustment_factors
+from database import load_data_to_db
+from feature_store import mark_features_dirty
+from fetch_scheduler import FetchScheduler, FetchUnit, TokenBucket
+from negative_cache import flush_unavailable
+from price_coverage import update_price_coverage
+from price_panel import update_price_panel
+from price_validation import filter_valid_prices
+from request_planner import format_request_plan, plan_price_requests
+from trading_calendar import last_closed_session
+from transformations import get_missing_price_ranges, get_tail_price_ranges
+from work_ledger import (
+    fail_work_units,
+    finish_work_unit,
+    record_work_units,
+    resume_work_units,
+    start_work_units,
+    unit_key,
+)
+
+
+def _new_stats() -> dict:
+    return {
+        "passes": 0,
+        "requests": 0,
+        "inserted": 0,
+        "updated": 0,
+        "skipped": 0,
+        "failed": 0,
+    }
+
+
+def _fetch_and_load(
+    engine: db.Engine,
+    plan: list[dict],
+    fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+    limiter: TokenBucket | None,
+    stats: dict,
+    update_panel: bool = True,
+    mark_features: bool = True,
+) -> None:
+    """
+    Runs the planned requests on the fetch scheduler and upserts every result.
+
+    Every request is a work unit of the ledger: it is marked running when the
+    scheduler sends its fetch, then done once its rows are loaded, or failed.
+    Units still queued behind the rate limiter stay pending. Fetched rows
+    are validated first, and the rejected ones quarantined. The ranges the
+    provider reported as unavailable are recorded before a unit is done, so
+    the next gap scan skips them. Splits and dividends in a response go to
+    corporate_actions, and the factors of the actions next to the loaded
+    sessions are refreshed. With mark_features, the loaded tickers are marked
+    for the next feature update, and with update_panel, the loaded sessions
+    are written to the price panel, when it was built.
+    """
+    stats["passes"] += 1
+    stats["requests"] += len(plan)
+    metrics.increment("requests_planned", len(plan))
+    units = [
+        FetchUnit(tuple(request["tickers"]), request["start_date"], request["end_date"])
+        for request in plan
+    ]
+    started = set()
+
+    def start_unit(unit: FetchUnit) -> None:
+        request = {
+            "tickers": list(unit.tickers),
+            "start_date": unit.start_date,
+            "end_date": unit.end_date,
+        }
+        start_work_units(engine, [request])
+        started.add(unit_key(unit.tickers, unit.start_date, unit.end_date))
+
+    scheduler = FetchScheduler(
+        fetch,
+        limiter=limiter
+        or TokenBucket(rate=config.FETCH_RATE_PER_SECOND, capacity=config.FETCH_BURST),
+        workers=config.FETCH_WORKERS,
+        max_attempts=config.FETCH_MAX_ATTEMPTS,
+        backoff_base=config.FETCH_BACKOFF_BASE,
+        backoff_max=config.FETCH_BACKOFF_MAX,
+        on_start=start_unit,
+    )
+    results = scheduler.run(units)
+    try:
+        for unit, price_data_df in metrics.timed_iter("fetch", results):
+            work_unit = unit_key(unit.tickers, unit.start_date, unit.end_date)
+            metrics.increment("ranges_unavailable", flush_unavailable(engine))
+            if price_data_df is None or price_data_df.empty:
+                logging.warning(
+                    f"No data fetched for {len(unit.tickers)} tickers for "
+                    f"{unit.start_date} - {unit.end_date}. Skipping..."
+                )
+                finish_work_unit(engine, work_unit)
+                continue
+            metrics.increment("rows_fetched", len(price_data_df))
+            with metrics.stage("validation"):
+                valid_df = filter_valid_prices(price_data_df, engine)
+            with metrics.stage("corporate_actions"):
+                adjusted = load_corporate_actions(price_data_df, engine)
+            if valid_df.empty:
+                logging.warning(
+                    f"No valid rows fetched for {len(unit.tickers)} tickers for "
+                    f"{unit.start_date} - {unit.end_date}."
+                )
+                finish_work_unit(engine, work_unit, len(price_data_df))
+                continue
+
+            def update_coverage(connection: db.Connection) -> None:
+                with metrics.stage("coverage_update"):
+                    update_price_coverage(valid_df, connection)
+
+            with metrics.stage("load"):
+                price_dict = valid_df.to_dict(orient="records")
+                try:
+                    load_counts = load_data_to_db(
+                        price_dict,
+                        "stock_prices",
+                        engine,
+                        mode="upsert",
+                        on_conflict=config.PRICE_UPSERT_ON_CONFLICT,
+                        # In the load's transaction: a crash right after the
+                        # load can't leave rows the index doesn't show.
+                        before_commit=update_coverage,
+                    )
+                except Exception as e:
+                    fail_work_units(engine, [work_unit], f"Load failed: {e}")
+                    raise
+            for key, value in load_counts.items():
+                stats[key] += value
+                metrics.increment(f"rows_{key}", value)
+            if not sum(load_counts.values()):
+                fail_work_units(
+                    engine, [work_unit], "The fetched rows could not be loaded."
+                )
+                continue
+            with metrics.stage("corporate_actions"):
+                update_adjustment_factors(
+                    engine, unit.tickers, unit.start_date, unit.end_date
+                )
+            if mark_features and not adjusted.is_empty():
+                mark_features_dirty(adjusted, engine)
+            if mark_features and (load_counts["inserted"] or load_counts["updated"]):
+                mark_features_dirty(valid_df, engine)
+            if update_panel:
+                with metrics.stage("panel_update"):
+                    metrics.increment(
+                        "panel_rows",
+                        update_price_panel(
+                            engine, unit.tickers, unit.start_date, unit.end_date
+                        ),
+                    )
+            finish_work_unit(engine, work_unit, len(price_data_df), load_counts)
+    except Exception as e:
+        # Waits for the fetches in flight, then fails every unit they started.
+        results.close()
+        fail_work_units(engine, started, f"Interrupted by an error: {e}")
+        raise
+    if scheduler.failed:
+        stats["failed"] += len(scheduler.failed)
+        fail_work_units(
+            engine,
+            [unit_key(u.tickers, u.start_date, u.end_date) for u in scheduler.failed],
+            f"Fetch failed after {config.FETCH_MAX_ATTEMPTS} attempts.",
+        )
+        logging.warning(
+            f"{len(scheduler.failed)} sub-batches failed and will be retried "
+            "on the next pass."
+        )
+
+
+def _resume_unfinished(
+    engine: db.Engine,
+    fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+    limiter: TokenBucket | None,
+    stats: dict,
+    dry_run: bool,
+) -> None:
+    """Runs the work units a previous run left pending or in flight, without re-planning."""
+    plan = resume_work_units(engine, reclaim=not dry_run)
+    if not plan:
+        return
+    if dry_run:
+        logging.info(f"{len(plan)} unfinished work units would be resumed.")
+        return
+    logging.info(f"Resuming {len(plan)} unfinished work units from the ledger.")
+    metrics.increment("work_units_resumed", len(plan))
+    _fetch_and_load(engine, plan, fetch, limiter, stats)
+
+
+def load_price_requests(
+    engine: db.Engine,
+    plan: list[dict],
+    fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+    limiter: TokenBucket | None = None,
+    update_panel: bool = True,
+    mark_features: bool = True,
+) -> dict:
+    """
+    Fetches and upserts one set of planned requests, without re-planning.
+
+    Loads running in parallel processes must pass update_panel=False and
+    update the price panel once they are done. With mark_features=False the
+    caller marks the planned ranges for the feature update itself.
+
+    Returns:
+        The same counts as sync_missing_prices, for a single pass.
+    """
+    stats = _new_stats()
+    _fetch_and_load(engine, plan, fetch, limiter, stats, update_panel, mark_features)
+    return stats
+
+
+def sync_missing_prices(
+    engine: db.Engine,
+    start_date: str,
+    end_date: str,
+    fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+    limiter: TokenBucket | None = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Fetches and loads every missing price range until no gaps are left.
+
+    Work units left unfinished by a previous run are resumed first, from the
+    etl_work_units ledger. Then each pass computes the missing ranges, plans
+    the provider requests, records them in the ledger, runs them on the fetch
+    scheduler and upserts the results. Units that failed are planned again on
+    the next pass. The passes stop once a pass loads no new rows, plans the
+    same requests as the one before, or SYNC_MAX_PASSES is reached.
+
+    Returns:
+        Dictionary with the number of passes, requests, rows loaded (as
+        inserted/updated/skipped counts) and failed requests.
+    """
+    stats = _new_stats()
+    _resume_unfinished(engine, fetch, limiter, stats, dry_run)
+    previous_units = None
+    for _ in range(config.SYNC_MAX_PASSES):
+        with metrics.stage("gap_detection"):
+            missing_ranges = get_missing_price_ranges(start_date, end_date, engine)
+        with metrics.stage("planning"):
+            plan = plan_price_requests(
+                missing_ranges,
+                request_overhead=config.PLANNER_REQUEST_OVERHEAD,
+                row_cost=config.PLANNER_ROW_COST,
+                max_tickers=config.FETCH_SUB_BATCH_SIZE,
+            )
+        if not plan:
+            logging.info("No missing data found. ETL process completed.")
+            break
+        report = format_request_plan(plan)
+        if dry_run:
+            logging.info(report)
+            break
+        # Gaps the provider can't fill yet (recent sessions, failed fetches)
+        # are planned again unchanged: stop rather than fetch them forever.
+        units = {unit_key(r["tickers"], r["start_date"], r["end_date"]) for r in plan}
+        if units == previous_units:
+            logging.warning(
+                f"The same {len(plan)} requests were planned again; leaving "
+                "the remaining gaps to the next run."
+            )
+            break
+        previous_units = units
+        logging.info(report.splitlines()[0])
+        metrics.increment("missing_ranges", len(missing_ranges))
+        record_work_units(engine, plan)
+        inserted = stats["inserted"]
+        _fetch_and_load(engine, plan, fetch, limiter, stats)
+        if stats["inserted"] == inserted:
+            logging.warning(
+                "The last pass loaded no new rows; leaving the remaining gaps "
+                "to the next run."
+            )
+            break
+    else:
+        logging.warning(
+            f"Gaps remain after {config.SYNC_MAX_PASSES} passes; leaving them "
+            "to the next run."
+        )
+    return stats
+
+
+def sync_tail_prices(
+    engine: db.Engine,
+    fetch: Callable[[list[str], str, str], pd.DataFrame | None],
+    through_date: dt.date | str | None = None,
+    limiter: TokenBucket | None = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Brings every current constituent up to the last closed session in one pass.
+
+    Only the sessions after each ticker's latest stored price are fetched, in
+    as few multi-ticker requests as TAIL_SUB_BATCH_SIZE allows. Tickers
+    without any stored price are left to the full backfill, and so are the
+    unfinished work units of earlier runs, to keep the update short.
+
+    Returns:
+        The same counts as sync_missing_prices.
+    """
+    stats = _new_stats()
+    through_date = through_date or last_closed_session()
+    with metrics.stage("gap_detection"):
+        missing_ranges, unseen = get_tail_price_ranges(through_date, engine)
+    if unseen:
+        logging.warning(
+            f"{len(unseen)} constituents have no stored prices and need a full "
+            "run to be backfilled."
+        )
+    with metrics.stage("planning"):
+        plan = plan_price_requests(
+            missing_ranges,
+            request_overhead=config.PLANNER_REQUEST_OVERHEAD,
+            row_cost=config.PLANNER_ROW_COST,
+            max_tickers=config.TAIL_SUB_BATCH_SIZE,
+        )
+    if not plan:
+        logging.info(f"Prices are up to date through {through_date}.")
+        return stats
+    report = format_request_plan(plan)
+    if dry_run:
+        logging.info(report)
+        return stats
+    logging.info(report.splitlines()[0])
+    metrics.increment("missing_ranges", len(missing_ranges))
+    record_work_units(engine, plan)
+    _fetch_and_load(engine, plan, fetch, limiter, stats)
+    logging.info(
+        f"Tail update through {through_date} finished: {stats['inserted']} "
+        f"inserted, {stats['updated']} updated, {stats['failed']} failed requests."
+    )
+    return stats
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import logging
+import metrics
+import pandas as pd
+import polars as pl
+import sqlalchemy as db
+from database import load_data_to_db
+from negative_cache import flush_unavailable, report_invalid_sessions
+
+
+QUARANTINE_TABLE = "stock_prices_quarantine"
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+BAR_COLUMNS = PRICE_COLUMNS + ["volume"]
+
+
+def _split_ratio(column: str = "stock_splits") -> pl.Expr:
+    """Split ratio of a row, 1.0 when the batch has no split information."""
+    return pl.when(pl.col(column) > 0).then(pl.col(column)).otherwise(1.0)
+
+
+def _price_spike() -> pl.Expr:
+    """
+    Close that jumps by more than VALIDATION_MAX_PRICE_JUMP from both the
+    previous and the next session and back, i.e. a one-session bad tick.
+
+    Moves are split adjusted, and rows at the edges of a ticker's batch are
+    not checked.
+    """
+    limit = pl.lit(config.VALIDATION_MAX_PRICE_JUMP).log()
+    jump_in = (
+        pl.col("close") * pl.col("_split") / pl.col("close").shift(1).over("ticker")
+    ).log()
+    jump_out = (
+        pl.col("close").shift(-1).over("ticker")
+        * pl.col("_split").shift(-1).over("ticker")
+        / pl.col("close")
+    ).log()
+    return (jump_in.abs() > limit) & (jump_out.abs() > limit) & (jump_in * jump_out < 0)
+
+
+def price_rules() -> dict[str, pl.Expr]:
+    """Validation rules of a price batch, each true for the rows it rejects."""
+    tolerance = config.VALIDATION_RANGE_TOLERANCE
+    return {
+        "incomplete_bar": pl.any_horizontal(pl.col(c).is_null() for c in BAR_COLUMNS),
+        "non_positive_price": pl.any_horizontal(pl.col(c) <= 0 for c in PRICE_COLUMNS),
+        "high_below_low": pl.col("high") < pl.col("low"),
+        "price_outside_range": pl.any_horizontal(
+            (pl.col(c) > pl.col("high") * (1 + tolerance))
+            | (pl.col(c) < pl.col("low") * (1 - tolerance))
+            for c in ["open", "close"]
+        ),
+        "negative_volume": pl.col("volume") < 0,
+        "zero_volume": pl.col("volume") == 0,
+        "price_spike": _price_spike(),
+    }
+
+
+def validate_prices(
+    prices: pd.DataFrame | pl.DataFrame,
+) -> tuple[pl.DataFrame, pl.DataFrame, int]:
+    """
+    Runs every price rule over a fetched batch in a single columnar pass.
+
+    Rows without any value (sessions the reshape of a multi-ticker response
+    adds for tickers that didn't trade) are dropped before the rules run.
+
+    Returns:
+        The valid rows, the rejected rows with a reasons column (comma
+        separated rule names) and the number of empty rows dropped.
+    """
+    df = pl.from_pandas(prices) if isinstance(prices, pd.DataFrame) else prices
+    if "stock_splits" in df.columns:
+        split = _split_ratio()
+    else:
+        split = pl.lit(1.0)
+    rules = price_rules()
+    checked = (
+        df.lazy()
+        .with_columns(pl.col(c).cast(pl.Float64).fill_nan(None) for c in BAR_COLUMNS)
+        .filter(~pl.all_horizontal(pl.col(c).is_null() for c in BAR_COLUMNS))
+        .sort("ticker", "date")
+        .with_columns(split.alias("_split"))
+        .with_columns(
+            rule.fill_null(False).alias(f"_{name}") for name, rule in rules.items()
+        )
+        .drop("_split")
+        .collect()
+    )
+    flags = [f"_{name}" for name in rules]
+    failed = pl.any_horizontal(flags)
+    valid = checked.filter(~failed).drop(flags)
+    rejected = checked.filter(failed)
+    counts = rejected.select(pl.col(flags).sum()).row(0)
+    for name, count in zip(rules, counts):
+        if count:
+            metrics.increment(f"quality_{name}", count)
+    rejected = rejected.with_columns(
+        pl.concat_str(
+            [pl.when(pl.col(f"_{name}")).then(pl.lit(name)) for name in rules],
+            separator=",",
+            ignore_nulls=True,
+        ).alias("reasons")
+    ).drop(flags)
+    return valid, rejected, len(df) - len(checked)
+
+
+def quarantine_prices(rejected: pl.DataFrame, engine: db.Engine) -> int:
+    """
+    Stores rejected bars in the stock_prices_quarantine table with their reasons.
+
+    Their sessions are also reported to the negative cache, so the gap scans
+    don't fetch them again until the invalid TTL expires.
+    """
+    if rejected.is_empty():
+        return 0
+    rows = rejected.select(
+        pl.col("ticker").cast(pl.String),
+        pl.col("date").cast(pl.Date),
+        *BAR_COLUMNS,
+        "reasons",
+        pl.lit(dt.datetime.now()).alias("quarantined_at"),
+    )
+    load_data_to_db(
+        rows.to_dicts(),
+        QUARANTINE_TABLE,
+        engine,
+        mode="upsert",
+    )
+    report_invalid_sessions(rows)
+    flush_unavailable(engine)
+    logging.warning(f"Quarantined {len(rows)} invalid price rows.")
+    return len(rows)
+
+
+def filter_valid_prices(
+    prices: pd.DataFrame | pl.DataFrame, engine: db.Engine
+) -> pd.DataFrame | pl.DataFrame:
+    """
+    Validates a fetched batch before it's loaded, quarantining the rejected rows.
+
+    Returns:
+        The valid rows, as a DataFrame of the same kind as prices.
+    """
+    valid, rejected, empty = validate_prices(prices)
+    quarantine_prices(rejected, engine)
+    metrics.increment("rows_validated", len(valid) + len(rejected))
+    metrics.increment("rows_quarantined", len(rejected))
+    metrics.increment("rows_empty", empty)
+    if isinstance(prices, pd.DataFrame):
+        return valid.to_pandas()
+    return valid
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import config
+import logging
+import metrics
+import time
+import numpy as np
+import polars as pl
+import sqlalchemy as db
+from pathlib import Path
+from typing import AsyncIterator, NamedTuple, Protocol
+from database import copy_frame_to_db, create_quotes_table, get_engine
+from transformations import scan_sp500_companies
+
+
+QUOTES_TABLE = "stock_quotes"
+
+
+class TickBatch(NamedTuple):
+    """Column arrays of a batch of ticks; timestamps are UTC epoch seconds."""
+
+    tickers: np.ndarray
+    timestamps: np.ndarray
+    prices: np.ndarray
+    sizes: np.ndarray
+
+
+class QuoteSource(Protocol):
+    """Anything that streams tick batches for a set of tickers."""
+
+    def ticks(self, tickers: list[str]) -> AsyncIterator[TickBatch]: ...
+
+
+class FakeQuoteSource:
+    """Random-walk ticks at a steady rate, spread uniformly across the tickers."""
+
+    def __init__(
+        self, rate: float = 2000.0, batch_interval: float = 0.01, seed: int = 0
+    ) -> None:
+        self.rate = rate
+        self.batch_interval = batch_interval
+        self._rng = np.random.default_rng(seed)
+
+    async def ticks(self, tickers: list[str]) -> AsyncIterator[TickBatch]:
+        symbols = np.asarray(tickers, dtype=str)
+        prices = np.full(len(symbols), 100.0)
+        carry, started = 0.0, time.monotonic()
+        emitted = 0.0
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            due = (time.monotonic() - started) * self.rate - emitted + carry
+            count, carry = int(due), due - int(due)
+            emitted += count
+            if count == 0:
+                continue
+            ids = self._rng.integers(0, len(symbols), count)
+            steps = self._rng.normal(0, 0.0005, count)
+            np.multiply.at(prices, ids, np.exp(steps))
+            yield TickBatch(
+                symbols[ids],
+                np.full(count, time.time()) + np.arange(count) * 1e-6,
+                prices[ids],
+                self._rng.integers(1, 500, count),
+            )
+
+
+class ReplayQuoteSource:
+    """
+    Replays recorded ticks from a Parquet or CSV file with ticker, quoted_at,
+    price and size columns, keeping their original spacing divided by speed
+    (speed=0 replays as fast as possible).
+    """
+
+    def __init__(
+        self, path: Path, speed: float = 1.0, batch_interval: float = 0.01
+    ) -> None:
+        self.path = Path(path)
+        self.speed = speed
+        self.batch_interval = batch_interval
+
+    async def ticks(self, tickers: list[str]) -> AsyncIterator[TickBatch]:
+        reader = pl.read_parquet if self.path.suffix == ".parquet" else pl.read_csv
+        df = (
+            reader(self.path)
+            .filter(pl.col("ticker").is_in(tickers))
+            .with_columns(
+                (
+                    pl.col("quoted_at").cast(pl.Datetime("us")).dt.epoch("us") / 1e6
+                ).alias("timestamp")
+            )
+            .sort("timestamp")
+        )
+        if df.is_empty():
+            return
+        timestamps = df["timestamp"].to_numpy()
+        offsets = timestamps - timestamps[0]
+        started, position = time.monotonic(), 0
+        while position < len(df):
+            if self.speed:
+                elapsed = (time.monotonic() - started) * self.speed
+                end = int(np.searchsorted(offsets, elapsed, side="right"))
+            else:
+                end = min(len(df), position + 10_000)
+            if end > position:
+                batch = df.slice(position, end - position)
+                yield TickBatch(
+                    batch["ticker"].to_numpy().astype(str),
+                    batch["timestamp"].to_numpy(),
+                    batch["price"].to_numpy().astype(float),
+                    batch["size"].to_numpy().astype(np.int64),
+                )
+                position = end
+            await asyncio.sleep(self.batch_interval if self.speed else 0)
+
+
+class YahooQuoteSource:
+    """Live quotes from the Yahoo Finance streamer through yfinance's AsyncWebSocket."""
+
+    def __init__(self, max_batch: int = 10_000) -> None:
+        self.max_batch = max_batch
+
+    async def ticks(self, tickers: list[str]) -> AsyncIterator[TickBatch]:
+        import yfinance as yf
+
+        queue: asyncio.Queue = asyncio.Queue()
+        socket = yf.AsyncWebSocket(verbose=False)
+        await socket.subscribe(tickers)
+        listener = asyncio.create_task(socket.listen(queue.put_nowait))
+        try:
+            while True:
+                messages = [await queue.get()]
+                while not queue.empty() and len(messages) < self.max_batch:
+                    messages.append(queue.get_nowait())
+                messages = [m for m in messages if "id" in m and "price" in m]
+                if not messages:
+                    continue
+                yield TickBatch(
+                    np.asarray([m["id"] for m in messages], dtype=str),
+                    np.asarray([int(m.get("time", 0)) / 1000 for m in messages]),
+                    np.asarray([float(m["price"]) for m in messages]),
+                    np.asarray(
+                        [int(m.get("last_size") or 0) for m in messages],
+                        dtype=np.int64,
+                    ),
+                )
+        finally:
+            listener.cancel()
+            await socket.close()
+
+
+class TickRingBuffers:
+    """
+    Latest ticks of every ticker in fixed-size, array-backed ring buffers.
+
+    All buffers share one (tickers x capacity) array per field, so memory is
+    allocated once and batches are written with vectorized scatters.
+    """
+
+    def __init__(self, tickers: list[str], capacity: int) -> None:
+        self.tickers = np.sort(np.asarray(tickers, dtype=str))
+        self.capacity = capacity
+        shape = (len(self.tickers), capacity)
+        self.timestamps = np.zeros(shape)
+        self.prices = np.full(shape, np.nan)
+        self.sizes = np.zeros(shape, dtype=np.int64)
+        self.written = np.zeros(len(self.tickers), dtype=np.int64)
+
+    def ids(self, tickers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Buffer index of each ticker and whether it is tracked."""
+        ids = np.searchsorted(self.tickers, tickers)
+        clipped = np.minimum(ids, len(self.tickers) - 1)
+        return clipped, self.tickers[clipped] == tickers
+
+    def extend(self, ids: np.ndarray, batch: TickBatch) -> None:
+        """Appends a batch of ticks, overwriting the oldest ones of full buffers."""
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        first = np.searchsorted(sorted_ids, sorted_ids, side="left")
+        rank = np.arange(len(sorted_ids)) - first
+        slots = (self.written[sorted_ids] + rank) % self.capacity
+        self.timestamps[sorted_ids, slots] = batch.timestamps[order]
+        self.prices[sorted_ids, slots] = batch.prices[order]
+        self.sizes[sorted_ids, slots] = batch.sizes[order]
+        np.add.at(self.written, sorted_ids, 1)
+
+    def latest(self, ticker: str, count: int | None = None) -> pl.DataFrame:
+        """Up to count of the latest ticks of ticker, oldest first."""
+        ids, known = self.ids(np.asarray([ticker], dtype=str))
+        if not known[0]:
+            raise KeyError(ticker)
+        row = ids[0]
+        available = int(min(self.written[row], self.capacity))
+        count = available if count is None else min(count, available)
+        slots = (self.written[row] - count + np.arange(count)) % self.capacity
+        return pl.DataFrame(
+            {
+                "quoted_at": self.timestamps[row, slots],
+                "price": self.prices[row, slots],
+                "size": self.sizes[row, slots],
+            }
+        ).with_columns(pl.from_epoch(pl.col("quoted_at") * 1e6, time_unit="us"))
+
+    def last_prices(self) -> dict[str, float]:
+        """Latest price of every ticker that received at least one tick."""
+        seen = self.written > 0
+        last = (self.written[seen] - 1) % self.capacity
+        return dict(zip(self.tickers[seen].tolist(), self.prices[seen, last].tolist()))
+
+
+class QuoteIngestionService:
+    """
+    Streams quotes from a source into ring buffers and persists them in micro-batches.
+
+    Ticks are flushed to stock_quotes when flush_rows are pending or every
+    flush_interval seconds, whichever comes first, with at most one flush in
+    flight. If the database falls behind, the oldest pending ticks beyond
+    max_pending_rows are dropped (and counted) so memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        source: QuoteSource,
+        engine: db.Engine,
+        tickers: list[str],
+        capacity: int = config.QUOTE_RING_CAPACITY,
+        flush_interval: float = config.QUOTE_FLUSH_INTERVAL,
+        flush_rows: int = config.QUOTE_FLUSH_ROWS,
+        max_pending_rows: int = config.QUOTE_MAX_PENDING_ROWS,
+    ) -> None:
+        self.source = source
+        self.engine = engine
+        self.buffers = TickRingBuffers(tickers, capacity)
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_pending_rows = max_pending_rows
+        self.received = 0
+        self.persisted = 0
+        self.dropped = 0
+        self._pending: list[TickBatch] = []
+        self._pending_rows = 0
+        self._flush_requested = asyncio.Event()
+
+    def _ingest(self, batch: TickBatch) -> None:
+        ids, known = self.buffers.ids(batch.tickers)
+        if not known.all():
+            ids, batch = ids[known], TickBatch(*(field[known] for field in batch))
+        if len(ids) == 0:
+            return
+        self.buffers.extend(ids, batch)
+        self.received += len(ids)
+        metrics.increment("quotes_received", len(ids))
+        self._pending.append(batch)
+        self._pending_rows += len(ids)
+        while self._pending_rows > self.max_pending_rows and len(self._pending) > 1:
+            oldest = self._pending.pop(0)
+            self._pending_rows -= len(oldest.tickers)
+            self.dropped += len(oldest.tickers)
+            metrics.increment("quotes_dropped", len(oldest.tickers))
+        if self._pending_rows >= self.flush_rows:
+            self._flush_requested.set()
+
+    def _write(self, batches: list[TickBatch]) -> int:
+        frame = pl.DataFrame(
+            {
+                "ticker": np.concatenate([b.tickers for b in batches]),
+                "quoted_at": np.concatenate([b.timestamps for b in batches]),
+                "price": np.concatenate([b.prices for b in batches]),
+                "size": np.concatenate([b.sizes for b in batches]),
+            }
+        ).with_columns(pl.from_epoch(pl.col("quoted_at") * 1e6, time_unit="us"))
+        return copy_frame_to_db(frame, QUOTES_TABLE, self.engine)
+
+    async def flush(self) -> None:
+        """Persists every pending tick; a failed write counts its ticks as dropped."""
+        if not self._pending:
+            return
+        batches, self._pending, self._pending_rows = self._pending, [], 0
+        started = time.perf_counter()
+        try:
+            inserted = await asyncio.to_thread(self._write, batches)
+        except Exception as e:
+            lost = sum(len(batch.tickers) for batch in batches)
+            logging.error(f"Failed to persist {lost} quotes: {e}")
+            self.dropped += lost
+            metrics.increment("quotes_dropped", lost)
+            return
+        metrics.observe("quote_flush_seconds", time.perf_counter() - started)
+        metrics.increment("quotes_persisted", inserted)
+        self.persisted += inserted
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def run(self, duration: float | None = None) -> None:
+        """Ingests quotes until the source ends or duration seconds have passed."""
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            async with asyncio.timeout(duration):
+                async for batch in self.source.ticks(self.buffers.tickers.tolist()):
+                    self._ingest(batch)
+        except TimeoutError:
+            pass
+        finally:
+            flusher.cancel()
+            try:
+                await flusher
+            except asyncio.CancelledError:
+                pass
+            await self.flush()
+        logging.info(
+            f"Quote ingestion stopped: {self.received} received, "
+            f"{self.persisted} persisted, {self.dropped} dropped."
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses the quote ingestion command line options."""
+    parser = argparse.ArgumentParser(description="Real-time S&P 500 quote ingestion.")
+    parser.add_argument(
+        "--source", choices=["yahoo", "fake", "replay"], default="yahoo"
+    )
+    parser.add_argument("--replay-file", type=Path, help="Ticks to replay.")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Replay speed, 0 for unthrottled."
+    )
+    parser.add_argument(
+        "--rate", type=float, default=2000.0, help="Ticks per second (fake)."
+    )
+    parser.add_argument("--duration", type=float, default=None, help="Seconds.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    args = parse_args()
+    engine = get_engine(config.POSTGRES_URL)
+    create_quotes_table(engine)
+    tickers = (
+        scan_sp500_companies(engine, columns=["ticker"])
+        .select("ticker")
+        .unique()
+        .collect()["ticker"]
+        .to_list()
+    )
+    if args.source == "fake":
+        source = FakeQuoteSource(rate=args.rate)
+    elif args.source == "replay":
+        source = ReplayQuoteSource(args.replay_file, speed=args.speed)
+    else:
+        source = YahooQuoteSource()
+    asyncio.run(QuoteIngestionService(source, engine, tickers).run(args.duration))
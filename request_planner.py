@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+from trading_calendar import count_sessions
+
+
+def _count_sessions(start_date: dt.date, end_date: dt.date) -> int:
+    """Counts trading sessions in [start_date, end_date)."""
+    return int(count_sessions(start_date, end_date - dt.timedelta(days=1)))
+
+
+def _request_cost(
+    tickers: set[str],
+    start_date: dt.date,
+    end_date: dt.date,
+    request_overhead: float,
+    row_cost: float,
+) -> float:
+    """Cost of one request: a fixed overhead plus every row it fetches."""
+    return request_overhead + row_cost * len(tickers) * _count_sessions(
+        start_date, end_date
+    )
+
+
+def plan_price_requests(
+    missing_ranges: list[dict],
+    request_overhead: float = 2500.0,
+    row_cost: float = 1.0,
+    max_tickers: int = 50,
+) -> list[dict]:
+    """
+    Merges missing price ranges into a near-minimal set of provider requests.
+
+    Ranges are visited by start date and each one joins the planned request
+    whose cost grows the least by absorbing it, as long as that is cheaper
+    than issuing it on its own. A request fetches every ticker it holds over
+    its whole span, so merging trades over-fetched rows (row_cost each)
+    against saved requests (request_overhead each).
+
+    Args:
+        missing_ranges: Dictionaries with ticker, first_missing_date and
+            last_missing_date (inclusive, "YYYY-MM-DD").
+        request_overhead: Cost of one provider request, in fetched-row units.
+        row_cost: Cost of fetching one (ticker, session) row.
+        max_tickers: Maximum number of tickers per request.
+
+    Returns:
+        Planned requests as dictionaries with tickers, start_date and
+        end_date (exclusive, as expected by the provider), plus the rows
+        needed, the rows fetched and the number of ranges merged.
+    """
+    ranges = sorted(
+        (
+            dt.date.fromisoformat(item["first_missing_date"]),
+            dt.date.fromisoformat(item["last_missing_date"]) + dt.timedelta(days=1),
+            item["ticker"],
+        )
+        for item in missing_ranges
+    )
+
+    requests = []
+    for start_date, end_date, ticker in ranges:
+        alone_cost = _request_cost(
+            {ticker}, start_date, end_date, request_overhead, row_cost
+        )
+        best_request, best_delta = None, 0.0
+        for request in requests:
+            tickers = request["tickers"] | {ticker}
+            if len(tickers) > max_tickers:
+                continue
+            merged_cost = _request_cost(
+                tickers,
+                min(request["start_date"], start_date),
+                max(request["end_date"], end_date),
+                request_overhead,
+                row_cost,
+            )
+            delta = merged_cost - request["cost"] - alone_cost
+            if delta <= best_delta:
+                best_request, best_delta = request, delta
+
+        needed = _count_sessions(start_date, end_date)
+        if best_request is None:
+            requests.append(
+                {
+                    "tickers": {ticker},
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "cost": alone_cost,
+                    "rows_needed": needed,
+                    "ranges": 1,
+                }
+            )
+        else:
+            best_request["tickers"].add(ticker)
+            best_request["start_date"] = min(best_request["start_date"], start_date)
+            best_request["end_date"] = max(best_request["end_date"], end_date)
+            best_request["cost"] += best_delta + alone_cost
+            best_request["rows_needed"] += needed
+            best_request["ranges"] += 1
+
+    return [
+        {
+            "tickers": sorted(request["tickers"]),
+            "start_date": request["start_date"].isoformat(),
+            "end_date": request["end_date"].isoformat(),
+            "rows_needed": request["rows_needed"],
+            "rows_fetched": len(request["tickers"])
+            * _count_sessions(request["start_date"], request["end_date"]),
+            "ranges": request["ranges"],
+        }
+        for request in sorted(requests, key=lambda r: (r["start_date"], r["end_date"]))
+    ]
+
+
+def format_request_plan(plan: list[dict]) -> str:
+    """Renders a planned set of requests as a human readable dry-run report."""
+    rows_needed = sum(request["rows_needed"] for request in plan)
+    rows_fetched = sum(request["rows_fetched"] for request in plan)
+    ranges = sum(request["ranges"] for request in plan)
+    over_fetch = (rows_fetched - rows_needed) / rows_needed if rows_needed else 0.0
+    lines = [
+        f"Planned {len(plan)} requests for {ranges} missing ranges: "
+        f"{rows_fetched} rows fetched for {rows_needed} needed "
+        f"({over_fetch:.1%} over-fetch).",
+        f"{'start':<10}  {'end':<10}  {'tickers':>7}  {'ranges':>6}  "
+        f"{'needed':>8}  {'fetched':>8}  sample",
+    ]
+    for request in plan:
+        sample = ", ".join(request["tickers"][:5])
+        if len(request["tickers"]) > 5:
+            sample += ", ..."
+        lines.append(
+            f"{request['start_date']:<10}  {request['end_date']:<10}  "
+            f"{len(request['tickers']):>7}  {request['ranges']:>6}  "
+            f"{request['rows_needed']:>8}  {request['rows_fetched']:>8}  {sample}"
+        )
+    return "\n".join(lines)
+
+
+def shard_requests(plan: list[dict], shards: int) -> list[list[dict]]:
+    """
+    Splits planned requests into at most shards groups of similar size.
+
+    Requests are dealt largest first to the group with the fewest rows to
+    fetch so far, so parallel workers finish at about the same time.
+    """
+    groups: list[list[dict]] = [[] for _ in range(max(1, min(shards, len(plan))))]
+    loads = [0] * len(groups)
+    for request in sorted(plan, key=lambda r: r["rows_fetched"], reverse=True):
+        smallest = loads.index(min(loads))
+        groups[smallest].append(request)
+        loads[smallest] += request["rows_fetched"]
+    return [group for group in groups if group]
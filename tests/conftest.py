@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# The ETL modules live at the repository root.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from database import get_engine  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """Engine of an empty SQLite database in a temporary directory."""
+    return get_engine(f"sqlite:///{tmp_path / 'test.db'}")
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from backtest import PricePanel, moving_average_policy, run_backtest
+
+
+def _panel(*columns):
+    close = np.array(columns, dtype=float).T
+    dates = np.arange("2024-01-02", len(close), dtype="datetime64[D]")
+    tickers = np.array([f"T{i}" for i in range(close.shape[1])])
+    return PricePanel(dates=dates, tickers=tickers, close=close)
+
+
+def test_returns_span_missing_sessions_from_the_last_stored_close():
+    panel = _panel([np.nan, 100.0, np.nan, np.nan, 200.0, 220.0])
+
+    returns = panel.returns()[:, 0]
+
+    assert np.isnan(returns[:4]).all()
+    assert returns[4:] == pytest.approx([1.0, 0.1])
+
+
+def test_backtest_keeps_price_moves_across_missing_sessions():
+    panel = _panel([100.0, np.nan, 200.0], [50.0, 50.0, 50.0])
+    signal = np.array([[1.0, 0.0]] * 3)
+
+    result = run_backtest(panel, signal, rebalance_every=21, cost_bps=0.0)
+
+    assert result.daily["return"].to_list() == pytest.approx([0.0, 0.0, 1.0])
+    assert result.stats["total_return"] == pytest.approx(1.0)
+
+
+def test_moving_average_policy_only_signals_members():
+    rising = [float(price) for price in range(100, 106)]
+    panel = _panel(rising, rising)
+    members = np.array([[True, False]] * 3 + [[False, True]] * 3)
+
+    signal = moving_average_policy(panel, members, fast=2, slow=3)
+
+    # The slow average needs three sessions, and each name counts only while a member.
+    expected = [[0, 0], [0, 0], [1, 0], [0, 1], [0, 1], [0, 1]]
+    np.testing.assert_array_equal(signal, expected)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import pytest
+import sqlalchemy as db
+
+from benchmark import reset_database
+from database import create_price_table, load_data_to_db
+
+
+def _tables(engine):
+    return set(db.inspect(engine).get_table_names())
+
+
+def test_reset_refuses_to_drop_tables_holding_rows(sqlite_engine):
+    create_price_table(sqlite_engine)
+    load_data_to_db(
+        [{"ticker": "AAA", "date": dt.date(2024, 1, 2), "close": 10.0}],
+        "stock_prices",
+        sqlite_engine,
+    )
+
+    with pytest.raises(RuntimeError, match="--drop-existing"):
+        reset_database(sqlite_engine)
+    assert "stock_prices" in _tables(sqlite_engine)
+
+    reset_database(sqlite_engine, drop_existing=True)
+    assert "stock_prices" not in _tables(sqlite_engine)
+
+
+def test_reset_drops_empty_tables(sqlite_engine):
+    create_price_table(sqlite_engine)
+
+    reset_database(sqlite_engine)
+
+    assert "stock_prices" not in _tables(sqlite_engine)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import polars as pl
+import pytest
+
+from constituent_index import ConstituentIndex
+
+
+def _day(day):
+    return dt.date(2024, 1, day)
+
+
+@pytest.fixture
+def index():
+    window_end = dt.date(2024, 2, 1)
+    timeline = pl.DataFrame(
+        {
+            "ticker": ["AAA", "AAA", "BBB", "CCC", "CCC"],
+            "added_date": [_day(10), _day(20), _day(2), _day(2), _day(12)],
+            "removed_date": [_day(15), window_end, _day(5), _day(12), window_end],
+        }
+    )
+    return ConstituentIndex.from_timeline(timeline, open_end=window_end)
+
+
+def test_is_member_treats_the_removal_date_as_exclusive(index):
+    tickers = ["AAA", "AAA", "AAA", "AAA", "BBB", "BBB", "CCC", "ZZZ"]
+    dates = [
+        _day(9),
+        _day(14),
+        _day(15),
+        _day(20),
+        _day(4),
+        _day(5),
+        _day(12),
+        _day(12),
+    ]
+
+    result = index.is_member(tickers, dates)
+
+    assert result.tolist() == [False, True, False, True, True, False, True, False]
+
+
+def test_is_member_before_the_history_and_after_the_last_change(index):
+    assert not index.is_member(["BBB"], [dt.date(2023, 12, 29)])[0]
+    assert index.is_member(["AAA"], [dt.date(2030, 1, 2)])[0]
+    assert index.members_on(dt.date(2030, 1, 2)) == ["AAA", "CCC"]
+
+
+def test_membership_of_lists_spells_and_merges_back_to_back_ones(index):
+    assert index.membership_of("AAA") == [(_day(10), _day(15)), (_day(20), None)]
+    assert index.membership_of("BBB") == [(_day(2), _day(5))]
+    assert index.membership_of("CCC") == [(_day(2), None)]
+    assert index.membership_of("ZZZ") == []
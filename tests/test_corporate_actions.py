@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import pandas as pd
+import polars as pl
+import pytest
+
+from corporate_actions import apply_factors, cumulative_factors, unadjust_splits
+
+ACTIONS = pl.DataFrame(
+    {
+        "ticker": ["AAA", "AAA", "BBB"],
+        "ex_date": [dt.date(2024, 1, 10), dt.date(2024, 2, 12), dt.date(2024, 1, 16)],
+        "factor": [0.5, 0.98, None],
+        "split_ratio": [2.0, 1.0, 4.0],
+    }
+)
+
+
+def test_cumulative_factors_multiply_every_later_action_of_the_ticker():
+    factors = cumulative_factors(ACTIONS).sort("ticker", "ex_date")
+
+    assert factors["price_factor"].to_list() == pytest.approx([0.49, 0.98, 0.25])
+    assert factors["volume_factor"].to_list() == [2.0, 1.0, 4.0]
+
+
+def test_apply_factors_scales_only_the_rows_before_each_ex_date():
+    prices = pl.DataFrame(
+        {
+            "ticker": ["AAA", "AAA", "AAA", "BBB", "BBB"],
+            "date": [
+                dt.date(2024, 1, 9),
+                dt.date(2024, 1, 10),
+                dt.date(2024, 2, 12),
+                dt.date(2024, 1, 12),
+                dt.date(2024, 1, 16),
+            ],
+            "close": [100.0] * 5,
+            "volume": [10] * 5,
+        }
+    )
+
+    adjusted = (
+        apply_factors(prices.lazy(), cumulative_factors(ACTIONS))
+        .collect()
+        .sort("ticker", "date")
+    )
+
+    assert adjusted["close"].to_list() == pytest.approx(
+        [49.0, 98.0, 100.0, 25.0, 100.0]
+    )
+    assert adjusted["volume"].to_list() == [20, 10, 10, 40, 10]
+
+
+def test_unadjust_splits_restores_prices_volumes_and_dividends_as_traded():
+    data = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2024-01-09", "2024-01-10", "2024-01-09"]),
+            "ticker": ["AAA", "AAA", "BBB"],
+            "close": [50.0, 52.0, 30.0],
+            "volume": [200, 90, 10],
+            "dividends": [0.5, 0.0, 0.0],
+        }
+    )
+    splits = pl.DataFrame(
+        {"ticker": ["AAA"], "ex_date": [dt.date(2024, 1, 10)], "split_ratio": [2.0]}
+    )
+
+    raw = unadjust_splits(data, splits)
+
+    assert raw["close"].tolist() == pytest.approx([100.0, 52.0, 30.0])
+    assert raw["volume"].tolist() == [100, 90, 10]
+    assert raw["dividends"].tolist() == pytest.approx([1.0, 0.0, 0.0])
+    assert pd.api.types.is_datetime64_any_dtype(raw["date"])
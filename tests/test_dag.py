@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("airflow.sdk")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "dags"))
+
+import config  # noqa: E402
+import investbot_etl  # noqa: E402
+import price_sync  # noqa: E402
+from benchmark import generate_index_data  # noqa: E402
+from database import get_engine, load_data_to_db  # noqa: E402
+from feature_store import _read_dirty, scan_ticker_features  # noqa: E402
+
+PARAMS = {"provider": "fake", "refresh_constituents": False, "months": 2}
+
+
+@pytest.fixture
+def etl_tasks(tmp_path, monkeypatch):
+    """Callables of the DAG tasks, run against a temporary SQLite database."""
+    base_dir = config.BASE_DIR / "data"
+    for name, value in list(vars(config).items()):
+        if isinstance(value, Path) and value.is_relative_to(base_dir):
+            monkeypatch.setattr(config, name, tmp_path / value.relative_to(base_dir))
+    monkeypatch.setattr(config, "POSTGRES_URL", f"sqlite:///{tmp_path / 'etl.db'}")
+    monkeypatch.setattr(config, "FETCH_RATE_PER_SECOND", 1000.0)
+    monkeypatch.setattr(config, "FETCH_SUB_BATCH_SIZE", 5)
+    monkeypatch.setattr(config, "DAG_FETCH_SHARDS", 3)
+    monkeypatch.setattr(
+        investbot_etl, "get_current_context", lambda: {"params": PARAMS}
+    )
+    return {task.task_id: task.python_callable for task in investbot_etl.etl_dag.tasks}
+
+
+def test_dag_runs_the_feature_update_after_validation():
+    dag = investbot_etl.etl_dag
+
+    assert dag.get_task("fetch_and_load").downstream_task_ids == {"validate"}
+    assert dag.get_task("validate").downstream_task_ids == {
+        "refresh_features",
+        "refresh_price_panel",
+    }
+
+
+def test_dag_tasks_load_prices_and_update_features_once(etl_tasks, monkeypatch):
+    marks = []
+    monkeypatch.setattr(
+        price_sync, "mark_features_dirty", lambda *args: marks.append(args)
+    )
+    engine = get_engine(config.POSTGRES_URL)
+    etl_tasks["setup_tables"]()
+    end_date = dt.date.today()
+    companies, changes = generate_index_data(
+        20, end_date - dt.timedelta(days=120), end_date, 0.05, np.random.default_rng(0)
+    )
+    load_data_to_db(companies, "sp500_companies", engine)
+    load_data_to_db(changes, "sp500_changes", engine)
+    etl_tasks["refresh_constituents"]()
+
+    shards = etl_tasks["plan_shards"]()
+    loads = [etl_tasks["fetch_and_load"](shard) for shard in shards]
+
+    assert len(shards) > 1
+    assert sum(load["inserted"] for load in loads) > 0
+    # Only refresh_features marks the loaded ranges.
+    assert marks == []
+
+    assert etl_tasks["validate"]()["invalid_bars"] == 0
+    etl_tasks["refresh_features"](shards)
+
+    planned = {
+        ticker
+        for shard in shards
+        for request in shard["requests"]
+        for ticker in request["tickers"]
+    }
+    features = scan_ticker_features().collect()
+    assert set(features["ticker"]) <= planned
+    assert features["ticker"].n_unique() > 0
+    assert _read_dirty(engine) == {}
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+from types import SimpleNamespace
+
+import pytest
+
+import data_sourcing
+from database import create_sp500_changes_table, create_sp500_companies_table
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.tokens = 0
+
+    def acquire(self):
+        self.tokens += 1
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    calls = []
+
+    def download(tickers, **options):
+        calls.append((tuple(tickers), options["start"]))
+        return None, {}
+
+    monkeypatch.setattr(data_sourcing, "_download", download)
+    monkeypatch.setattr(data_sourcing, "_later_splits", {})
+    monkeypatch.setattr(
+        data_sourcing, "last_closed_session", lambda: dt.date(2024, 6, 14)
+    )
+    return calls
+
+
+def test_later_splits_take_a_token_of_the_fetch_limiter(downloads):
+    limiter = CountingLimiter()
+
+    with data_sourcing.limit_provider_requests(limiter):
+        data_sourcing._fetch_later_splits(["AAA", "BBB"], "2024-03-01")
+        data_sourcing._fetch_later_splits(["AAA"], "2024-03-01")
+
+    assert downloads == [(("AAA", "BBB"), "2024-03-01")]
+    assert limiter.tokens == 1
+
+
+@pytest.mark.parametrize("after_date", ["2024-06-15", "2024-06-17"])
+def test_later_splits_are_not_requested_past_the_last_closed_session(
+    downloads, after_date
+):
+    splits = data_sourcing._fetch_later_splits(["AAA"], after_date)
+
+    assert splits.is_empty()
+    assert downloads == []
+
+
+def _page(symbols):
+    rows = "".join(
+        f"<tr><td>{symbol}</td><td>{symbol} Inc.</td></tr>" for symbol in symbols
+    )
+    changes = (
+        "<tr><th>Effective Date</th><th>Added Ticker</th><th>Removed Ticker</th></tr>"
+        "<tr><td>June 24, 2024</td><td>AAA</td><td>ZZZ</td></tr>"
+    )
+    return (
+        f'<table id="constituents"><tr><th>Symbol</th><th>Security</th></tr>{rows}</table>'
+        f'<table id="changes">{changes}</table>'
+    ).encode("utf-8")
+
+
+def test_unchanged_tables_are_not_reloaded(monkeypatch, sqlite_engine, tmp_path):
+    create_sp500_companies_table(sqlite_engine)
+    create_sp500_changes_table(sqlite_engine)
+    pages = iter([_page(["AAA", "BBB"]), _page(["AAA", "BBB"]), _page(["AAA", "CCC"])])
+    monkeypatch.setattr(
+        data_sourcing.requests,
+        "get",
+        lambda url, headers: SimpleNamespace(
+            status_code=200, content=next(pages), headers={}
+        ),
+    )
+    loads = []
+    load_data_to_db = data_sourcing.load_data_to_db
+
+    def counting_load(data, table_name, engine, **options):
+        loads.append(table_name)
+        return load_data_to_db(data, table_name, engine, **options)
+
+    monkeypatch.setattr(data_sourcing, "load_data_to_db", counting_load)
+
+    def fetch():
+        data_sourcing.get_sp500_companies_data(
+            "https://example.org/sp500",
+            tmp_path / "last_modified.txt",
+            engine=sqlite_engine,
+            table_hashes_file=tmp_path / "table_hashes.json",
+        )
+
+    fetch()
+    assert loads == ["sp500_companies", "sp500_changes"]
+
+    fetch()
+    assert loads == ["sp500_companies", "sp500_changes"]
+
+    fetch()
+    assert loads == ["sp500_companies", "sp500_changes", "sp500_companies"]
+    with sqlite_engine.connect() as connection:
+        symbols = connection.exec_driver_sql("SELECT symbol FROM sp500_companies")
+        assert sorted(row[0] for row in symbols) == ["AAA", "CCC"]
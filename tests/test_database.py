@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import pytest
+import sqlalchemy as db
+
+from database import (
+    create_price_quarantine_table,
+    create_price_table,
+    load_data_to_db,
+)
+
+
+def _price(ticker, date, close):
+    return {
+        "ticker": ticker,
+        "date": date,
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "volume": 100,
+    }
+
+
+def test_upsert_counts_inserted_updated_and_skipped_rows(sqlite_engine):
+    create_price_table(sqlite_engine)
+    day = dt.date(2024, 1, 2)
+    rows = [_price("AAA", day, 10.0), _price("BBB", day, 20.0)]
+    assert load_data_to_db(rows, "stock_prices", sqlite_engine, mode="upsert") == {
+        "inserted": 2,
+        "updated": 0,
+        "skipped": 0,
+    }
+
+    rows = [
+        _price("AAA", day, 11.0),
+        _price("BBB", day, 20.0),
+        _price("BBB", day, 20.0),
+    ]
+    assert load_data_to_db(rows, "stock_prices", sqlite_engine, mode="upsert") == {
+        "inserted": 0,
+        "updated": 1,
+        "skipped": 2,
+    }
+    with sqlite_engine.connect() as connection:
+        closes = connection.execute(
+            db.text("SELECT ticker, close FROM stock_prices ORDER BY ticker")
+        ).all()
+    assert closes == [("AAA", 11.0), ("BBB", 20.0)]
+
+
+def test_upsert_with_nothing_on_conflict_keeps_stored_rows(sqlite_engine):
+    create_price_table(sqlite_engine)
+    day = dt.date(2024, 1, 2)
+    load_data_to_db([_price("AAA", day, 10.0)], "stock_prices", sqlite_engine, "upsert")
+    counts = load_data_to_db(
+        [_price("AAA", day, 12.0)],
+        "stock_prices",
+        sqlite_engine,
+        mode="upsert",
+        on_conflict="nothing",
+    )
+    assert counts == {"inserted": 0, "updated": 0, "skipped": 1}
+    with sqlite_engine.connect() as connection:
+        close = connection.execute(db.text("SELECT close FROM stock_prices")).scalar()
+    assert close == 10.0
+
+
+def test_upsert_reports_integrity_errors_as_nothing_loaded(sqlite_engine):
+    create_price_quarantine_table(sqlite_engine)
+    rows = [
+        {
+            **_price("AAA", dt.date(2024, 1, 2), 10.0),
+            "reasons": None,
+            "quarantined_at": dt.datetime(2024, 1, 2, 18),
+        }
+    ]
+    counts = load_data_to_db(rows, "stock_prices_quarantine", sqlite_engine, "upsert")
+    assert counts == {"inserted": 0, "updated": 0, "skipped": 0}
+
+
+def test_upsert_raises_other_database_errors(sqlite_engine):
+    with pytest.raises(db.exc.SQLAlchemyError):
+        load_data_to_db(
+            [_price("AAA", dt.date(2024, 1, 2), 10.0)],
+            "stock_prices",
+            sqlite_engine,
+            mode="upsert",
+        )
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import polars as pl
+
+from database import create_feature_dirty_table
+from feature_store import _clear_dirty, _read_dirty, mark_features_dirty
+
+
+def _prices(*rows):
+    return pl.DataFrame(
+        [{"ticker": ticker, "date": date} for ticker, date in rows],
+        schema={"ticker": pl.String, "date": pl.Date},
+    )
+
+
+def test_marks_keep_the_earliest_date_of_each_ticker(sqlite_engine):
+    create_feature_dirty_table(sqlite_engine)
+    mark_features_dirty(
+        _prices(("AAA", dt.date(2024, 3, 1)), ("BBB ", dt.date(2024, 2, 1))),
+        sqlite_engine,
+    )
+    mark_features_dirty(
+        _prices(("AAA", dt.date(2024, 1, 2)), ("BBB", dt.date(2024, 5, 1))),
+        sqlite_engine,
+    )
+
+    dirty = _read_dirty(sqlite_engine)
+
+    assert {ticker: date for ticker, (date, _) in dirty.items()} == {
+        "AAA": dt.date(2024, 1, 2),
+        "BBB": dt.date(2024, 2, 1),
+    }
+
+
+def test_clearing_keeps_tickers_marked_again_meanwhile(sqlite_engine):
+    create_feature_dirty_table(sqlite_engine)
+    mark_features_dirty(
+        _prices(("AAA", dt.date(2024, 1, 2)), ("BBB", dt.date(2024, 1, 2))),
+        sqlite_engine,
+    )
+    processed = _read_dirty(sqlite_engine)
+    mark_features_dirty(_prices(("BBB", dt.date(2024, 6, 3))), sqlite_engine)
+
+    _clear_dirty(sqlite_engine, processed)
+
+    assert list(_read_dirty(sqlite_engine)) == ["BBB"]
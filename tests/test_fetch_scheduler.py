@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+import metrics
+from data_sourcing import ProviderRateLimitError
+from fake_provider import FakePriceProvider
+from fetch_scheduler import FetchScheduler, FetchUnit, TokenBucket, backoff_delay
+
+
+def _units(count):
+    return [FetchUnit((f"T{i:03d}",), "2024-01-01", "2024-02-01") for i in range(count)]
+
+
+def _scheduler(fetch, limiter=None, **options):
+    options = {"workers": 4, "backoff_base": 0.001, "backoff_max": 0.01, **options}
+    return FetchScheduler(
+        fetch,
+        limiter=limiter or TokenBucket(rate=1000.0, capacity=100.0),
+        rng=random.Random(0),
+        **options,
+    )
+
+
+def test_every_unit_is_fetched_once():
+    provider = FakePriceProvider(latency=(0, 0.001))
+    scheduler = _scheduler(provider.fetch)
+    results = list(scheduler.run(_units(20)))
+    assert sorted(unit.tickers for unit, _ in results) == [
+        unit.tickers for unit in _units(20)
+    ]
+    assert all(len(data) == 21 for _, data in results)
+    assert scheduler.failed == []
+    assert provider.calls == 20
+
+
+def test_rate_limited_units_are_retried_until_they_succeed():
+    provider = FakePriceProvider(latency=(0, 0.001), rate_limit_probability=0.3)
+    limiter = TokenBucket(rate=1000.0, capacity=100.0, min_rate=1.0)
+    scheduler = _scheduler(provider.fetch, limiter, max_attempts=20)
+    results = list(scheduler.run(_units(30)))
+    assert len(results) == 30
+    assert scheduler.failed == []
+    assert provider.rate_limited > 0
+    assert provider.calls == 30 + provider.rate_limited
+    assert limiter.rate < 1000.0
+
+
+def test_units_failing_every_attempt_are_kept_as_failed():
+    attempts = []
+
+    def fetch(tickers, start_date, end_date):
+        attempts.append(tuple(tickers))
+        if tickers == ["T001"]:
+            raise ProviderRateLimitError("Too Many Requests")
+        return None
+
+    scheduler = _scheduler(fetch, max_attempts=3)
+    results = list(scheduler.run(_units(3)))
+    assert sorted(unit.tickers for unit, _ in results) == [("T000",), ("T002",)]
+    assert scheduler.failed == [_units(3)[1]]
+    assert attempts.count(("T001",)) == 3
+
+
+def test_other_errors_are_retried_without_slowing_the_limiter():
+    failures = {"T000": 2}
+
+    def fetch(tickers, start_date, end_date):
+        if failures.get(tickers[0], 0):
+            failures[tickers[0]] -= 1
+            raise ConnectionError("reset by peer")
+        return None
+
+    limiter = TokenBucket(rate=1000.0, capacity=100.0)
+    scheduler = _scheduler(fetch, limiter)
+    assert len(list(scheduler.run(_units(2)))) == 2
+    assert failures["T000"] == 0
+    assert limiter.rate == 1000.0
+
+
+def test_backoff_delay_grows_exponentially_up_to_the_cap():
+    rng = random.Random(0)
+    for attempt in range(1, 10):
+        bound = min(30.0, 2.0 * 2 ** (attempt - 1))
+        delays = [backoff_delay(attempt, 2.0, 30.0, rng) for _ in range(200)]
+        assert all(0 <= delay <= bound for delay in delays)
+        assert max(delays) > bound / 2
+
+
+def test_token_bucket_cuts_the_rate_on_rate_limits_and_recovers_additively():
+    limiter = TokenBucket(rate=4.0, capacity=4.0, min_rate=1.0, increase_step=0.5)
+    limiter.on_rate_limit(cooldown=0.0)
+    assert limiter.rate == 2.0
+    limiter.on_rate_limit(cooldown=0.0)
+    limiter.on_rate_limit(cooldown=0.0)
+    assert limiter.rate == 1.0
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.rate == pytest.approx(4.0)
+
+
+def test_only_real_provider_calls_are_counted_as_provider_requests(tmp_path):
+    from price_cache import cached_fetch
+
+    metrics.enable_metrics()
+    try:
+        provider = FakePriceProvider(latency=(0, 0.001))
+        fetch = cached_fetch(provider.fetch, cache_dir=tmp_path)
+        scheduler = _scheduler(fetch)
+        list(scheduler.run(_units(3)))
+        list(scheduler.run(_units(3)))
+        counters = metrics._metrics.counters
+        assert provider.calls == 3
+        assert counters["provider_requests"] == 3
+        assert metrics._metrics.histograms["provider_request_seconds"].count == 3
+    finally:
+        metrics.disable_metrics()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from price_cache import read_cached_prices, write_cached_prices
+
+
+def _response(ticker, close):
+    return pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2024-01-02", "2024-01-03"]),
+            "ticker": ticker,
+            "open": close,
+            "high": close,
+            "low": close,
+            "close": close,
+            "volume": 100,
+        }
+    )
+
+
+def test_tickers_without_any_price_are_not_cached_as_covered(tmp_path):
+    data = pd.concat([_response("AAA", 10.0), _response("BBB", np.nan)])
+    write_cached_prices(data, ["AAA", "BBB"], "2024-01-02", "2024-01-04", tmp_path)
+
+    cached, missing = read_cached_prices(
+        ["AAA", "BBB"], "2024-01-02", "2024-01-04", tmp_path
+    )
+
+    assert missing == ["BBB"]
+    assert cached["ticker"].unique().tolist() == ["AAA"]
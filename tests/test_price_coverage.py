@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+from database import create_price_coverage_table, create_price_table, load_data_to_db
+from price_coverage import update_price_coverage
+from transformations import price_coverage_transformations
+
+
+def _prices(ticker, dates):
+    return pd.DataFrame(
+        {
+            "ticker": ticker,
+            "date": dates,
+            "open": 10.0,
+            "high": 11.0,
+            "low": 9.0,
+            "close": 10.0,
+            "volume": 100,
+        }
+    )
+
+
+def _load(prices, engine, after_coverage=None):
+    def update_coverage(connection):
+        update_price_coverage(prices, connection)
+        if after_coverage is not None:
+            after_coverage()
+
+    load_data_to_db(
+        prices.to_dict("records"),
+        "stock_prices",
+        engine,
+        mode="upsert",
+        before_commit=update_coverage,
+    )
+
+
+@pytest.fixture
+def coverage_engine(sqlite_engine):
+    create_price_table(sqlite_engine)
+    create_price_coverage_table(sqlite_engine)
+    return sqlite_engine
+
+
+def test_coverage_merges_only_the_loaded_tickers(coverage_engine):
+    _load(_prices("AAA", [dt.date(2024, 1, 2), dt.date(2024, 1, 3)]), coverage_engine)
+    _load(_prices("BBB", [dt.date(2024, 1, 2)]), coverage_engine)
+
+    # 2024-01-04 follows 2024-01-03 and the weekend and MLK day are no sessions.
+    _load(_prices("AAA", [dt.date(2024, 1, 4), dt.date(2024, 1, 16)]), coverage_engine)
+
+    coverage = price_coverage_transformations(coverage_engine).sort(
+        "ticker", "start_date"
+    )
+    assert coverage.rows() == [
+        ("AAA", dt.date(2024, 1, 2), dt.date(2024, 1, 4)),
+        ("AAA", dt.date(2024, 1, 16), dt.date(2024, 1, 16)),
+        ("BBB", dt.date(2024, 1, 2), dt.date(2024, 1, 2)),
+    ]
+    assert price_coverage_transformations(coverage_engine, ["BBB"]).rows() == [
+        ("BBB", dt.date(2024, 1, 2), dt.date(2024, 1, 2))
+    ]
+
+
+def test_a_failed_load_leaves_neither_prices_nor_coverage(coverage_engine):
+    def crash():
+        raise RuntimeError("crash before commit")
+
+    with pytest.raises(RuntimeError):
+        _load(_prices("AAA", [dt.date(2024, 1, 2)]), coverage_engine, crash)
+
+    assert price_coverage_transformations(coverage_engine).is_empty()
+    stored = pd.read_sql("SELECT * FROM stock_prices", coverage_engine)
+    assert stored.empty
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import datetime as dt
+import os
+
+import pytest
+import sqlalchemy as db
+
+from database import create_price_table, get_engine, load_data_to_db
+from price_notifications import PriceSubscriber
+
+# A scratch PostgreSQL database; the test writes a NTFY row to its stock_prices.
+POSTGRES_TEST_URL = os.environ.get("INVESTBOT_TEST_POSTGRES_URL")
+
+
+@pytest.fixture
+def postgres_engine():
+    if not POSTGRES_TEST_URL:
+        pytest.skip("INVESTBOT_TEST_POSTGRES_URL is not set")
+    engine = get_engine(POSTGRES_TEST_URL)
+    try:
+        with engine.connect():
+            pass
+    except db.exc.OperationalError:
+        pytest.skip("PostgreSQL is not available")
+    create_price_table(engine)
+    return engine
+
+
+def test_subscriber_receives_committed_price_loads(postgres_engine):
+    close = dt.datetime.now().timestamp()
+    row = {
+        "ticker": "NTFY",
+        "date": dt.date(2024, 1, 2),
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "volume": 1,
+    }
+
+    async def round_trip():
+        async with PriceSubscriber(POSTGRES_TEST_URL) as subscriber:
+            await asyncio.to_thread(
+                load_data_to_db, [row], "stock_prices", postgres_engine, "upsert"
+            )
+            return await subscriber.get(timeout=5)
+
+    batch = asyncio.run(round_trip())
+
+    assert batch["tickers"] == ["NTFY"]
+    assert (batch["start_date"], batch["end_date"]) == ("2024-01-02", "2024-01-02")
+    assert batch["rows"] == 1
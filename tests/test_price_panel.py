@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import numpy as np
+import pytest
+
+import price_panel
+from database import create_corporate_actions_table, create_price_table, load_data_to_db
+from price_panel import build_price_panel, open_price_panel, update_price_panel
+
+
+def _day(day):
+    return dt.date(2024, 1, day)
+
+
+def _bar(ticker, day, close):
+    return {
+        "ticker": ticker,
+        "date": _day(day),
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "volume": 100,
+    }
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    sessions = {"days": [2, 3, 4, 5]}
+    monkeypatch.setattr(
+        price_panel,
+        "load_sessions",
+        lambda: np.array([_day(day) for day in sessions["days"]], "datetime64[D]"),
+    )
+    # Two tickers per block, so a third one resizes the files.
+    monkeypatch.setattr(price_panel, "TICKER_BLOCK", 2)
+    return sessions
+
+
+def test_update_grows_the_panel_and_rewrites_adjusted_rows(
+    sqlite_engine, tmp_path, calendar
+):
+    create_price_table(sqlite_engine)
+    create_corporate_actions_table(sqlite_engine)
+    load_data_to_db(
+        [
+            _bar(ticker, day, 10.0 * day)
+            for ticker in ("AAA", "BBB")
+            for day in (2, 3, 4)
+        ],
+        "stock_prices",
+        sqlite_engine,
+        mode="upsert",
+    )
+    panel_dir = tmp_path / "panel"
+    assert build_price_panel(sqlite_engine, panel_dir) == 6
+    before = open_price_panel(panel_dir)
+
+    # A new ticker, a new session and a split of AAA whose earlier rows change.
+    calendar["days"] = [2, 3, 4, 5, 8]
+    load_data_to_db(
+        [_bar("CCC", 3, 3.0), _bar("CCC", 4, 4.0), _bar("CCC", 8, 8.0)]
+        + [_bar("AAA", 8, 40.0)],
+        "stock_prices",
+        sqlite_engine,
+        mode="upsert",
+    )
+    load_data_to_db(
+        [{"ticker": "AAA", "ex_date": _day(8), "split_ratio": 2.0, "factor": 0.5}],
+        "corporate_actions",
+        sqlite_engine,
+    )
+    with sqlite_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "DELETE FROM stock_prices WHERE ticker = 'AAA' AND date = '2024-01-02'"
+        )
+    written = update_price_panel(
+        sqlite_engine, ["AAA", "CCC"], _day(3), _day(9), panel_dir
+    )
+
+    panel = open_price_panel(panel_dir)
+    assert written == 6
+    assert panel.tickers.tolist() == ["AAA", "BBB", "CCC"]
+    assert panel.sessions.astype(dt.date).tolist() == [_day(d) for d in (2, 3, 4, 5, 8)]
+    close = panel.fields["close"]
+    nan = np.nan
+    np.testing.assert_array_equal(
+        close[panel.ticker_rows["AAA"]], [nan, 15, 20, nan, 40]
+    )
+    np.testing.assert_array_equal(
+        close[panel.ticker_rows["BBB"]], [20, 30, 40, nan, nan]
+    )
+    np.testing.assert_array_equal(close[panel.ticker_rows["CCC"]], [nan, 3, 4, nan, 8])
+    assert panel.get("volume", "AAA", "2024-01-03") == 200
+    assert np.isnan(panel.get("close", "DDD", "2024-01-03"))
+    # A view opened earlier keeps the shape and values it was opened with.
+    assert before.fields["close"].shape == (2, 4)
+    np.testing.assert_array_equal(before.row("close", "AAA"), [20, 30, 40, nan])
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import polars as pl
+import pytest
+import sqlalchemy as db
+
+import price_sync
+from database import create_work_units_table, get_table
+from fetch_scheduler import TokenBucket
+from work_ledger import WORK_UNITS_TABLE, record_work_units, work_unit_summary
+
+MISSING = [
+    {
+        "ticker": "AAA",
+        "first_missing_date": "2024-01-02",
+        "last_missing_date": "2024-01-31",
+    }
+]
+
+
+def test_sync_stops_when_a_pass_fills_no_gap(sqlite_engine, monkeypatch):
+    scans = []
+
+    def missing_ranges(start_date, end_date, engine):
+        scans.append((start_date, end_date))
+        return MISSING
+
+    monkeypatch.setattr(price_sync, "get_missing_price_ranges", missing_ranges)
+    create_work_units_table(sqlite_engine)
+
+    stats = price_sync.sync_missing_prices(
+        sqlite_engine,
+        "2024-01-02",
+        "2024-02-01",
+        fetch=lambda tickers, start, end: None,
+        limiter=TokenBucket(rate=1000.0, capacity=10),
+    )
+
+    assert len(scans) == 1
+    assert stats["passes"] == 1
+    assert work_unit_summary(sqlite_engine) == {"done": 1}
+
+
+def test_sync_stops_after_the_maximum_number_of_passes(sqlite_engine, monkeypatch):
+    passes = iter(range(100))
+
+    def missing_ranges(start_date, end_date, engine):
+        # A different gap on every scan, as if each pass only moved it.
+        return [{**MISSING[0], "ticker": f"T{next(passes)}"}]
+
+    def fetch_and_load(engine, plan, fetch, limiter, stats, update_panel=True):
+        stats["passes"] += 1
+        stats["inserted"] += 1
+
+    monkeypatch.setattr(price_sync, "get_missing_price_ranges", missing_ranges)
+    monkeypatch.setattr(price_sync, "_fetch_and_load", fetch_and_load)
+    monkeypatch.setattr(price_sync.config, "SYNC_MAX_PASSES", 3)
+    create_work_units_table(sqlite_engine)
+
+    stats = price_sync.sync_missing_prices(
+        sqlite_engine, "2024-01-02", "2024-02-01", fetch=lambda *args: None
+    )
+
+    assert stats["passes"] == 3
+
+
+def _statuses(engine):
+    table = get_table(engine, WORK_UNITS_TABLE)
+    with engine.connect() as connection:
+        return dict(
+            connection.execute(db.select(table.c.tickers, table.c.status)).all()
+        )
+
+
+def test_units_queued_behind_the_limiter_stay_pending(sqlite_engine, monkeypatch):
+    plan = [
+        {"tickers": [ticker], "start_date": "2024-01-02", "end_date": "2024-02-01"}
+        for ticker in ("AAA", "BBB", "CCC")
+    ]
+    seen = {}
+
+    def fetch(tickers, start_date, end_date):
+        seen[tickers[0]] = _statuses(sqlite_engine)
+        return None
+
+    monkeypatch.setattr(price_sync.config, "FETCH_WORKERS", 1)
+    create_work_units_table(sqlite_engine)
+    record_work_units(sqlite_engine, plan)
+
+    price_sync.load_price_requests(
+        sqlite_engine, plan, fetch, TokenBucket(rate=1000.0, capacity=10)
+    )
+
+    assert seen == {
+        "AAA": {"AAA": "running", "BBB": "pending", "CCC": "pending"},
+        "BBB": {"AAA": "done", "BBB": "running", "CCC": "pending"},
+        "CCC": {"AAA": "done", "BBB": "done", "CCC": "running"},
+    }
+
+
+def test_a_failed_load_leaves_queued_units_pending(sqlite_engine, monkeypatch):
+    plan = [
+        {"tickers": [ticker], "start_date": "2024-01-02", "end_date": "2024-02-01"}
+        for ticker in ("AAA", "BBB")
+    ]
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("stock_prices is gone")
+
+    def fetch(tickers, start_date, end_date):
+        return pd.DataFrame({"ticker": tickers, "date": [pd.Timestamp(start_date)]})
+
+    monkeypatch.setattr(price_sync.config, "FETCH_WORKERS", 1)
+    monkeypatch.setattr(price_sync, "filter_valid_prices", lambda data, engine: data)
+    monkeypatch.setattr(
+        price_sync, "load_corporate_actions", lambda data, engine: pl.DataFrame()
+    )
+    monkeypatch.setattr(price_sync, "load_data_to_db", fail)
+    create_work_units_table(sqlite_engine)
+    record_work_units(sqlite_engine, plan)
+
+    with pytest.raises(RuntimeError):
+        price_sync.load_price_requests(
+            sqlite_engine, plan, fetch, TokenBucket(rate=1000.0, capacity=10)
+        )
+
+    assert _statuses(sqlite_engine) == {"AAA": "failed", "BBB": "pending"}
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import pytest
+
+import negative_cache
+from database import create_price_quarantine_table, create_unavailable_prices_table
+from price_validation import filter_valid_prices
+
+NAN = float("nan")
+
+
+def _bar(ticker, day, open, high, low, close, volume=100):
+    return {
+        "ticker": ticker,
+        "date": pd.Timestamp(2024, 1, day),
+        "open": open,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": volume,
+    }
+
+
+@pytest.fixture
+def validation_engine(monkeypatch, sqlite_engine):
+    monkeypatch.setattr(negative_cache, "_pending", [])
+    create_price_quarantine_table(sqlite_engine)
+    create_unavailable_prices_table(sqlite_engine)
+    return sqlite_engine
+
+
+def test_each_rule_quarantines_its_row(validation_engine):
+    prices = pd.DataFrame(
+        [
+            _bar("OK", 2, 10.0, 11.0, 9.0, 10.0),
+            # A session added by the reshape for a ticker that didn't trade.
+            _bar("OK", 3, NAN, NAN, NAN, NAN, None),
+            _bar("INC", 2, 10.0, 11.0, 9.0, 10.0, None),
+            _bar("NEG", 2, 0.0, 1.0, 0.0, 0.5),
+            _bar("HBL", 2, 10.0, 9.95, 10.0, 10.0),
+            _bar("OUT", 2, 12.0, 11.0, 9.0, 10.0),
+            _bar("NVOL", 2, 10.0, 11.0, 9.0, 10.0, -5),
+            _bar("ZVOL", 2, 10.0, 11.0, 9.0, 10.0, 0),
+            _bar("SPK", 2, 10.0, 10.0, 10.0, 10.0),
+            _bar("SPK", 3, 200.0, 200.0, 200.0, 200.0),
+            _bar("SPK", 4, 10.0, 10.0, 10.0, 10.0),
+        ]
+    )
+
+    valid = filter_valid_prices(prices, validation_engine)
+
+    assert isinstance(valid, pd.DataFrame)
+    assert sorted(zip(valid["ticker"], valid["date"].dt.day)) == [
+        ("OK", 2),
+        ("SPK", 2),
+        ("SPK", 4),
+    ]
+    quarantined = pd.read_sql(
+        "SELECT ticker, date, reasons FROM stock_prices_quarantine",
+        validation_engine,
+    )
+    assert dict(zip(quarantined["ticker"], quarantined["reasons"])) == {
+        "INC": "incomplete_bar",
+        "NEG": "non_positive_price",
+        "HBL": "high_below_low",
+        "OUT": "price_outside_range",
+        "NVOL": "negative_volume",
+        "ZVOL": "zero_volume",
+        "SPK": "price_spike",
+    }
+    unavailable = pd.read_sql(
+        "SELECT ticker, start_date, end_date, reason, detail "
+        "FROM stock_prices_unavailable",
+        validation_engine,
+    )
+    assert len(unavailable) == 7
+    assert (unavailable["reason"] == negative_cache.INVALID).all()
+    assert (unavailable["start_date"] == unavailable["end_date"]).all()
+    spike = unavailable[unavailable["ticker"] == "SPK"].iloc[0]
+    assert str(spike["start_date"]) == "2024-01-03"
+    assert spike["detail"] == "price_spike"
+
+
+def test_a_valid_batch_records_nothing(validation_engine):
+    prices = pd.DataFrame([_bar("OK", 2, 10.0, 11.0, 9.0, 10.0)])
+
+    valid = filter_valid_prices(prices, validation_engine)
+
+    assert len(valid) == 1
+    with validation_engine.connect() as connection:
+        for table in ("stock_prices_quarantine", "stock_prices_unavailable"):
+            count = connection.exec_driver_sql(f"SELECT COUNT(*) FROM {table}")
+            assert count.scalar() == 0
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import numpy as np
+import sqlalchemy as db
+
+import quote_stream
+from database import create_quotes_table
+from quote_stream import QuoteIngestionService, TickBatch
+
+
+def _service(engine):
+    return QuoteIngestionService(None, engine, ["AAA", "BBB"], capacity=8)
+
+
+def _ticks(*ticks):
+    tickers, timestamps, prices = zip(*ticks)
+    return TickBatch(
+        np.array(tickers),
+        np.array(timestamps, dtype=float),
+        np.array(prices, dtype=float),
+        np.ones(len(ticks), dtype=np.int64),
+    )
+
+
+def _stored(engine):
+    with engine.connect() as connection:
+        return connection.execute(
+            db.text("SELECT ticker, price FROM stock_quotes ORDER BY ticker, price")
+        ).all()
+
+
+def test_flush_keeps_ticks_that_share_a_timestamp(sqlite_engine):
+    create_quotes_table(sqlite_engine)
+    service = _service(sqlite_engine)
+    service._ingest(_ticks(("AAA", 1e9, 10.0), ("AAA", 1e9, 10.5)))
+    service._ingest(_ticks(("AAA", 1e9, 11.0), ("BBB", 1e9, 20.0)))
+
+    asyncio.run(service.flush())
+
+    assert service.persisted == 4
+    assert _stored(sqlite_engine) == [
+        ("AAA", 10.0),
+        ("AAA", 10.5),
+        ("AAA", 11.0),
+        ("BBB", 20.0),
+    ]
+
+
+def test_failed_flush_counts_the_ticks_as_dropped(sqlite_engine, monkeypatch):
+    def fail(frame, table_name, engine):
+        raise db.exc.OperationalError("INSERT", {}, Exception("database is gone"))
+
+    monkeypatch.setattr(quote_stream, "copy_frame_to_db", fail)
+    service = _service(sqlite_engine)
+    service._ingest(_ticks(("AAA", 1e9, 10.0), ("BBB", 1e9, 20.0)))
+
+    asyncio.run(service.flush())
+
+    assert (service.persisted, service.dropped) == (0, 2)
+
+
+def test_quotes_table_keyed_on_ticker_and_time_is_rebuilt(sqlite_engine):
+    with sqlite_engine.begin() as connection:
+        connection.execute(
+            db.text(
+                "CREATE TABLE stock_quotes (ticker VARCHAR(10), quoted_at TIMESTAMP, "
+                "price FLOAT NOT NULL, size BIGINT, PRIMARY KEY (ticker, quoted_at))"
+            )
+        )
+        connection.execute(
+            db.text(
+                "INSERT INTO stock_quotes VALUES ('AAA', '2024-01-02 15:00:00', 10, 1)"
+            )
+        )
+
+    create_quotes_table(sqlite_engine)
+    service = _service(sqlite_engine)
+    service._ingest(_ticks(("AAA", 1704207600.0, 10.5)))
+    asyncio.run(service.flush())
+
+    assert _stored(sqlite_engine) == [("AAA", 10.0), ("AAA", 10.5)]
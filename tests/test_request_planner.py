@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from request_planner import plan_price_requests
+
+
+def _missing(ticker, first, last):
+    return {"ticker": ticker, "first_missing_date": first, "last_missing_date": last}
+
+
+def test_overlapping_ranges_share_a_request_when_it_saves_a_request():
+    ranges = [
+        _missing("AAA", "2024-01-02", "2024-01-05"),
+        _missing("BBB", "2024-01-03", "2024-01-05"),
+    ]
+
+    plan = plan_price_requests(ranges)
+
+    assert plan == [
+        {
+            "tickers": ["AAA", "BBB"],
+            "start_date": "2024-01-02",
+            "end_date": "2024-01-06",
+            "rows_needed": 7,
+            "rows_fetched": 8,
+            "ranges": 2,
+        }
+    ]
+
+
+def test_distant_ranges_stay_apart_when_over_fetching_costs_more():
+    ranges = [
+        _missing("AAA", "2024-01-02", "2024-01-05"),
+        _missing("BBB", "2024-06-03", "2024-06-07"),
+    ]
+
+    plan = plan_price_requests(ranges, request_overhead=10.0)
+
+    assert [(r["tickers"], r["start_date"], r["end_date"]) for r in plan] == [
+        (["AAA"], "2024-01-02", "2024-01-06"),
+        (["BBB"], "2024-06-03", "2024-06-08"),
+    ]
+    assert all(r["rows_needed"] == r["rows_fetched"] for r in plan)
+
+
+def test_requests_never_hold_more_than_max_tickers():
+    tickers = ["AAA", "BBB", "CCC", "DDD", "EEE"]
+    ranges = [_missing(ticker, "2024-01-02", "2024-01-05") for ticker in tickers]
+
+    plan = plan_price_requests(ranges, max_tickers=2)
+
+    assert len(plan) == 3
+    assert all(len(request["tickers"]) <= 2 for request in plan)
+    assert sorted(t for request in plan for t in request["tickers"]) == tickers
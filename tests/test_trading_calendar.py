@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import numpy as np
+import pytest
+
+import trading_calendar
+from trading_calendar import last_closed_session, next_session, previous_session
+
+SESSIONS = np.array(["2024-01-02", "2024-01-03", "2024-01-05"], dtype="datetime64[D]")
+
+
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch):
+    monkeypatch.setattr(trading_calendar, "_sessions", SESSIONS)
+
+
+def test_neighbouring_sessions_inside_the_calendar():
+    days = np.array(["2024-01-03", "2024-01-04"], dtype="datetime64[D]")
+
+    assert next_session(days).tolist() == [dt.date(2024, 1, 5)] * 2
+    assert previous_session(days).tolist() == [dt.date(2024, 1, 2), dt.date(2024, 1, 3)]
+
+
+def test_neighbouring_sessions_beyond_the_calendar_are_nat():
+    assert np.isnat(previous_session(np.datetime64("2024-01-02")))
+    assert np.isnat(previous_session(np.datetime64("2023-06-01")))
+    assert np.isnat(next_session(np.datetime64("2024-01-05")))
+    assert np.isnat(next_session(["2024-01-02", "2025-01-01"])).tolist() == [
+        False,
+        True,
+    ]
+
+
+def test_last_closed_session_is_a_date():
+    now = dt.datetime(2024, 1, 4, 12, tzinfo=dt.timezone.utc)
+
+    assert last_closed_session(now) == dt.date(2024, 1, 3)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+
+import polars as pl
+import pytest
+
+from database import (
+    create_price_coverage_table,
+    create_price_table,
+    create_sp500_companies_table,
+    create_unavailable_prices_table,
+    load_data_to_db,
+)
+from transformations import (
+    catch_missing_prices,
+    creating_sp500_index_timeline,
+    dates_to_intervals,
+    expand_sp500_index_timeline,
+    export_stock_prices_to_parquet,
+    get_tail_price_ranges,
+    iter_stock_prices,
+    merge_intervals,
+    scan_stock_prices,
+    sessions_index,
+    subtract_intervals,
+)
+
+
+@pytest.fixture
+def price_engine(sqlite_engine):
+    create_price_table(sqlite_engine)
+    rows = [
+        {
+            "ticker": ticker,
+            "date": dt.date(2023, 12, 1) + dt.timedelta(days=day),
+            "open": 10.0,
+            "high": 11.0,
+            "low": 9.0,
+            "close": 10.0 + day,
+            "volume": 100,
+        }
+        for ticker in ("AAA", "BBB", "CCC")
+        for day in range(90)
+    ]
+    load_data_to_db(rows, "stock_prices", sqlite_engine, mode="upsert")
+    return sqlite_engine
+
+
+def test_scan_reads_the_database_even_when_an_export_exists(price_engine, tmp_path):
+    export_stock_prices_to_parquet(price_engine, tmp_path)
+    load_data_to_db(
+        [
+            {
+                "ticker": "DDD",
+                "date": dt.date(2024, 1, 2),
+                "open": 1.0,
+                "high": 1.0,
+                "low": 1.0,
+                "close": 1.0,
+                "volume": 1,
+            }
+        ],
+        "stock_prices",
+        price_engine,
+        mode="upsert",
+    )
+
+    prices = scan_stock_prices(price_engine, parquet_dir=tmp_path).collect()
+
+    assert "DDD" in prices["ticker"].to_list()
+
+
+@pytest.mark.parametrize("source", ["database", "parquet"])
+def test_iter_streams_batches_of_at_most_batch_size(price_engine, tmp_path, source):
+    export_stock_prices_to_parquet(price_engine, tmp_path)
+    options = {
+        "tickers": ["AAA", "CCC"],
+        "start_date": "2023-12-15",
+        "end_date": "2024-01-20",
+        "parquet_dir": tmp_path,
+    }
+
+    batches = list(
+        iter_stock_prices(price_engine, batch_size=10, source=source, **options)
+    )
+
+    assert max(len(batch) for batch in batches) <= 10
+    streamed = pl.concat(batches).sort("ticker", "date")
+    expected = scan_stock_prices(price_engine, **options).collect()
+    assert streamed.equals(expected.sort("ticker", "date"))
+
+
+def test_tail_ranges_start_after_the_latest_stored_or_unavailable_session(
+    sqlite_engine,
+):
+    for create in (
+        create_sp500_companies_table,
+        create_price_coverage_table,
+        create_unavailable_prices_table,
+    ):
+        create(sqlite_engine)
+    load_data_to_db(
+        [
+            {"symbol": ticker, "date_added": "2000-01-03"}
+            for ticker in ("AAA", "BBB", "CCC", "DDD")
+        ],
+        "sp500_companies",
+        sqlite_engine,
+    )
+    load_data_to_db(
+        [
+            {"ticker": ticker, "start_date": dt.date(2023, 1, 3), "end_date": end}
+            for ticker, end in (
+                ("AAA", dt.date(2024, 1, 12)),
+                ("BBB", dt.date(2024, 1, 5)),
+                ("CCC", dt.date(2024, 1, 16)),
+                ("ZZZ", dt.date(2024, 1, 2)),
+            )
+        ],
+        "stock_prices_coverage",
+        sqlite_engine,
+    )
+    load_data_to_db(
+        [
+            {
+                "ticker": "BBB",
+                "start_date": dt.date(2024, 1, 8),
+                "end_date": dt.date(2024, 1, 10),
+                "reason": "no_data",
+                "recorded_at": dt.datetime(2024, 1, 11),
+                "expires_at": dt.datetime.now() + dt.timedelta(days=1),
+            }
+        ],
+        "stock_prices_unavailable",
+        sqlite_engine,
+    )
+
+    missing_ranges, unseen = get_tail_price_ranges("2024-01-16", sqlite_engine)
+
+    # AAA skips the Martin Luther King Jr. Day holiday, BBB starts after its
+    # unavailable sessions and CCC is already stored through the 16th.
+    assert missing_ranges == [
+        {
+            "ticker": "AAA",
+            "first_missing_date": "2024-01-16",
+            "last_missing_date": "2024-01-16",
+        },
+        {
+            "ticker": "BBB",
+            "first_missing_date": "2024-01-11",
+            "last_missing_date": "2024-01-16",
+        },
+    ]
+    assert unseen == ["DDD"]
+
+
+def _intervals(rows):
+    return pl.DataFrame(
+        rows,
+        schema={
+            "ticker": pl.String,
+            "start_session": pl.Int64,
+            "end_session": pl.Int64,
+        },
+        orient="row",
+    )
+
+
+def _rows(df):
+    return sorted(df.select("ticker", "start_session", "end_session").rows())
+
+
+def test_dates_to_intervals_splits_runs_at_missing_sessions():
+    days = [dt.date(2024, 1, 2) + dt.timedelta(days=day) for day in range(6)]
+    sessions = sessions_index(pl.Series(days))
+    df = pl.DataFrame(
+        {
+            "ticker": ["AAA", "AAA", "AAA", "AAA", "AAA", "BBB", "BBB"],
+            # The duplicate counts once and 2024-01-20 is no session.
+            "date": [days[0], days[1], days[1], days[2], days[4], days[3]]
+            + [dt.date(2024, 1, 20)],
+        }
+    )
+
+    intervals = dates_to_intervals(df, sessions)
+
+    assert _rows(intervals) == [("AAA", 0, 2), ("AAA", 4, 4), ("BBB", 3, 3)]
+
+
+def test_merge_intervals_joins_overlapping_and_adjacent_runs():
+    df = _intervals(
+        [("AAA", 3, 5), ("AAA", 0, 2), ("AAA", 1, 1), ("AAA", 7, 8), ("BBB", 6, 6)]
+    )
+
+    merged = merge_intervals(df)
+
+    assert _rows(merged) == [("AAA", 0, 5), ("AAA", 7, 8), ("BBB", 6, 6)]
+
+
+def test_subtract_intervals_keeps_the_uncovered_parts():
+    members = _intervals([("AAA", 0, 9), ("BBB", 0, 4), ("CCC", 1, 2)])
+    covered = _intervals([("AAA", 2, 3), ("AAA", 6, 6), ("CCC", 0, 5), ("DDD", 0, 9)])
+
+    gaps = subtract_intervals(members, covered)
+
+    assert _rows(gaps) == [("AAA", 0, 1), ("AAA", 4, 5), ("AAA", 7, 9), ("BBB", 0, 4)]
+
+
+def test_catch_missing_prices_reports_gaps_of_two_sessions_or_more():
+    trading_days = pl.Series(
+        [dt.date(2024, 1, 2) + dt.timedelta(days=day) for day in range(10)]
+    )
+    timeline = pl.DataFrame(
+        {
+            "ticker": ["AAA", "BBB", "CCC"],
+            "added_date": [
+                dt.date(2024, 1, 2),
+                dt.date(2024, 1, 4),
+                dt.date(2024, 1, 2),
+            ],
+            "removed_date": [
+                dt.date(2024, 1, 12),
+                dt.date(2024, 1, 8),
+                dt.date(2024, 1, 12),
+            ],
+        }
+    )
+    coverage = pl.DataFrame(
+        {
+            "ticker": ["AAA", "CCC", "CCC"],
+            "start_date": [
+                dt.date(2024, 1, 2),
+                dt.date(2024, 1, 2),
+                dt.date(2024, 1, 6),
+            ],
+            "end_date": [
+                dt.date(2024, 1, 6),
+                dt.date(2024, 1, 4),
+                dt.date(2024, 1, 11),
+            ],
+        }
+    )
+
+    missing = catch_missing_prices(coverage, timeline, trading_days)
+
+    # removed_date is exclusive; CCC's single missing session is not worth a request.
+    assert missing.rows() == [
+        ("AAA", dt.date(2024, 1, 7), dt.date(2024, 1, 11)),
+        ("BBB", dt.date(2024, 1, 4), dt.date(2024, 1, 7)),
+    ]
+
+
+def _day(day):
+    return dt.date(2024, 1, day)
+
+
+@pytest.fixture
+def membership_changes():
+    trading_days = pl.Series([_day(day) for day in range(2, 32)])
+    changes = pl.DataFrame(
+        {
+            "effective_date": [
+                _day(10),
+                _day(15),
+                _day(20),
+                _day(5),
+                _day(12),
+                _day(12),
+            ],
+            "added_ticker": ["AAA", None, "AAA", None, "CCC", None],
+            "removed_ticker": [None, "AAA", None, "BBB", None, "CCC"],
+        }
+    )
+    companies = pl.DataFrame({"ticker": ["AAA", "CCC", "DDD"]})
+    return changes, companies, trading_days
+
+
+def test_timeline_pairs_additions_and_removals_into_spells(membership_changes):
+    changes, companies, trading_days = membership_changes
+
+    timeline = creating_sp500_index_timeline(changes, companies, trading_days)
+
+    window_end = dt.date(2024, 2, 1)
+    assert timeline.rows() == [
+        ("AAA", _day(10), _day(15)),
+        ("AAA", _day(20), window_end),
+        # A leading removal: member since before the first change.
+        ("BBB", _day(2), _day(5)),
+        # Removed and added back on the same day.
+        ("CCC", _day(2), _day(12)),
+        ("CCC", _day(12), window_end),
+        # A current constituent without any change.
+        ("DDD", _day(2), window_end),
+    ]
+
+
+def test_expanded_timeline_excludes_the_removal_day(membership_changes):
+    changes, companies, trading_days = membership_changes
+    timeline = creating_sp500_index_timeline(changes, companies, trading_days)
+
+    expanded = expand_sp500_index_timeline(timeline, trading_days).collect()
+
+    dates = {
+        ticker: group["date"].to_list()
+        for (ticker,), group in expanded.sort("date").group_by("ticker")
+    }
+    assert dates["AAA"] == [_day(day) for day in [*range(10, 15), *range(20, 32)]]
+    assert dates["BBB"] == [_day(2), _day(3), _day(4)]
+    assert dates["CCC"] == trading_days.to_list()
+    assert dates["DDD"] == trading_days.to_list()
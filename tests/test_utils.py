@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from utils import extract_wikipedia_tables
+
+PAGE = """
+<html><body>
+<table id="constituents">
+  <tr><th>Symbol</th><th>Security</th></tr>
+  <tr><td>AAA</td><td>Aaa Inc.</td></tr>
+  <tr><td>BBB</td><td>Bbb <a href="#">Corp.</a></td></tr>
+</table>
+<table id="changes">
+  <tr>
+    <th rowspan="2">Effective Date</th>
+    <th colspan="2">Added</th>
+    <th colspan="2">Removed</th>
+    <th rowspan="2">Reason</th>
+  </tr>
+  <tr><th>Ticker</th><th>Security</th><th>Ticker</th><th>Security</th></tr>
+  <tr>
+    <td rowspan="2">June 24, 2024</td>
+    <td>AAA</td><td>Aaa Inc.</td><td>ZZZ</td><td>Zzz Co.</td>
+    <td rowspan="2">Market cap change.</td>
+  </tr>
+  <tr><td>BBB</td><td>Bbb Corp.</td><td>YYY</td><td>Yyy Co.</td></tr>
+  <tr>
+    <td>March 18, 2024</td>
+    <td>CCC</td><td>Ccc Ltd.</td><td colspan="2"></td><td>Spin-off.</td>
+  </tr>
+</table>
+</body></html>
+"""
+
+
+def test_extract_wikipedia_tables_reads_spanned_headers_and_cells():
+    tables = extract_wikipedia_tables(PAGE, ["constituents", "changes"])
+
+    assert tables["constituents"] == [
+        {"symbol": "AAA", "security": "Aaa Inc."},
+        {"symbol": "BBB", "security": "Bbb Corp."},
+    ]
+    assert [list(row.values()) for row in tables["changes"]] == [
+        ["June 24, 2024", "AAA", "Aaa Inc.", "ZZZ", "Zzz Co.", "Market cap change."],
+        ["June 24, 2024", "BBB", "Bbb Corp.", "YYY", "Yyy Co.", "Market cap change."],
+        ["March 18, 2024", "CCC", "Ccc Ltd.", "", "", "Spin-off."],
+    ]
+    assert list(tables["changes"][0]) == [
+        "effective_date",
+        "added_ticker",
+        "added_security",
+        "removed_ticker",
+        "removed_security",
+        "reason",
+    ]
+
+
+def test_extract_wikipedia_tables_skips_missing_tables():
+    tables = extract_wikipedia_tables(PAGE.encode("utf-8"), ["changes", "missing"])
+
+    assert list(tables) == ["changes"]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import sqlalchemy as db
+
+import work_ledger
+from database import create_work_units_table, get_table
+from work_ledger import record_work_units, resume_work_units, start_work_units
+
+PLAN = [
+    {"tickers": ["AAA", "BBB"], "start_date": "2024-01-02", "end_date": "2024-02-01"},
+    {"tickers": ["CCC"], "start_date": "2024-02-01", "end_date": "2024-03-01"},
+]
+
+
+def _statuses(engine):
+    table = get_table(engine, work_ledger.WORK_UNITS_TABLE)
+    with engine.connect() as connection:
+        return dict(
+            connection.execute(db.select(table.c.tickers, table.c.status)).all()
+        )
+
+
+def _age_running_units(engine, minutes):
+    table = get_table(engine, work_ledger.WORK_UNITS_TABLE)
+    with engine.begin() as connection:
+        connection.execute(
+            table.update()
+            .where(table.c.tickers == "AAA,BBB")
+            .values(started_at=db.func.datetime("now", f"-{minutes} minutes"))
+        )
+
+
+def test_resume_leaves_recently_started_units_to_their_owner(sqlite_engine):
+    create_work_units_table(sqlite_engine)
+    record_work_units(sqlite_engine, PLAN)
+    start_work_units(sqlite_engine, PLAN[:1])
+
+    assert resume_work_units(sqlite_engine) == PLAN[1:]
+    assert _statuses(sqlite_engine) == {"AAA,BBB": "running", "CCC": "pending"}
+
+
+def test_resume_reclaims_units_past_their_lease(sqlite_engine, monkeypatch):
+    monkeypatch.setattr(work_ledger.config, "WORK_UNIT_LEASE_MINUTES", 30)
+    create_work_units_table(sqlite_engine)
+    record_work_units(sqlite_engine, PLAN)
+    start_work_units(sqlite_engine, PLAN[:1])
+    _age_running_units(sqlite_engine, 31)
+
+    assert resume_work_units(sqlite_engine, reclaim=False) == PLAN
+    assert _statuses(sqlite_engine)["AAA,BBB"] == "running"
+
+    assert resume_work_units(sqlite_engine) == PLAN
+    assert _statuses(sqlite_engine) == {"AAA,BBB": "pending", "CCC": "pending"}
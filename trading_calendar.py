@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import logging
+import threading
+import numpy as np
+import polars as pl
+from pandas_market_calendars import get_calendar
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+
+_sessions_lock = threading.Lock()
+_sessions: np.ndarray | None = None
+
+
+def _required_span() -> tuple[np.datetime64, np.datetime64]:
+    """First and last day the persisted calendar has to cover."""
+    start = np.datetime64(config.CALENDAR_START_DATE, "D")
+    end = np.datetime64(f"{dt.date.today().year + config.CALENDAR_YEARS_AHEAD}-12-31")
+    return start, end
+
+
+def build_sessions(start: np.datetime64, end: np.datetime64) -> np.ndarray:
+    """Computes the NYSE sessions between start and end (inclusive)."""
+    valid_days = get_calendar("NYSE").valid_days(
+        start_date=str(start), end_date=str(end)
+    )
+    return valid_days.tz_localize(None).values.astype("datetime64[D]")
+
+
+def load_sessions(path: Path | None = None) -> np.ndarray:
+    """
+    Returns every NYSE session of the supported span as a sorted datetime64[D] array.
+
+    The sessions are computed once, persisted as a NumPy file and kept in
+    memory, so later calls cost nothing. The file is rebuilt when it does not
+    cover the required span anymore.
+    """
+    global _sessions
+    path = path or config.CALENDAR_FILE_PATH
+    if _sessions is not None:
+        return _sessions
+    with _sessions_lock:
+        if _sessions is not None:
+            return _sessions
+        start, end = _required_span()
+        sessions = None
+        if path.exists():
+            sessions = np.load(path)
+            if len(sessions) == 0 or sessions[0] > start + 7 or sessions[-1] < end - 7:
+                sessions = None
+        if sessions is None:
+            logging.info(f"Building NYSE trading calendar from {start} to {end}...")
+            sessions = build_sessions(start, end)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            np.save(path, sessions)
+        _sessions = sessions
+    return _sessions
+
+
+def _as_days(dates) -> np.ndarray:
+    """Converts a date, string, Series or array-like into datetime64[D] values."""
+    if isinstance(dates, pl.Series):
+        dates = dates.cast(pl.Date).to_numpy()
+    return np.asarray(dates, dtype="datetime64[D]")
+
+
+def session_index(dates) -> np.ndarray:
+    """Index of the first session on or after each date."""
+    return np.searchsorted(load_sessions(), _as_days(dates), side="left")
+
+
+def is_session(dates) -> np.ndarray:
+    """Whether each date is a trading session."""
+    sessions = load_sessions()
+    days = _as_days(dates)
+    index = np.searchsorted(sessions, days, side="left")
+    return (index < len(sessions)) & (
+        sessions[np.minimum(index, len(sessions) - 1)] == days
+    )
+
+
+def count_sessions(start_dates, end_dates) -> np.ndarray:
+    """Number of sessions between each start and end date (both inclusive)."""
+    sessions = load_sessions()
+    return np.maximum(
+        np.searchsorted(sessions, _as_days(end_dates), side="right")
+        - np.searchsorted(sessions, _as_days(start_dates), side="left"),
+        0,
+    )
+
+
+def sessions_between(start_date, end_date) -> np.ndarray:
+    """Sessions between start_date and end_date (both inclusive)."""
+    sessions = load_sessions()
+    first = np.searchsorted(sessions, _as_days(start_date), side="left")
+    last = np.searchsorted(sessions, _as_days(end_date), side="right")
+    return sessions[first:last]
+
+
+def sessions_series(start_date, end_date) -> pl.Series:
+    """Sessions between start_date and end_date (both inclusive) as a Polars Series."""
+    return pl.Series("date", sessions_between(start_date, end_date), dtype=pl.Date)
+
+
+def _session_at(sessions: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Sessions at each index, NaT where the index falls outside the calendar."""
+    inside = (index >= 0) & (index < len(sessions))
+    return np.where(
+        inside,
+        sessions[np.clip(index, 0, len(sessions) - 1)],
+        np.datetime64("NaT", "D"),
+    )[()]
+
+
+def next_session(dates) -> np.ndarray:
+    """First session strictly after each date, NaT after the last known session."""
+    sessions = load_sessions()
+    return _session_at(sessions, np.searchsorted(sessions, _as_days(dates), "right"))
+
+
+def previous_session(dates) -> np.ndarray:
+    """Last session strictly before each date, NaT on or before the first session."""
+    sessions = load_sessions()
+    return _session_at(sessions, np.searchsorted(sessions, _as_days(dates), "left") - 1)
+
+
+def last_closed_session(now: dt.datetime | None = None) -> dt.date:
+    """
+    Latest session whose end-of-day prices should be available at now.
+
+    A session counts as closed MARKET_CLOSE_DELAY_MINUTES after the regular
+    close, in the exchange time zone. Early closes are treated as regular ones.
+    """
+    timezone = ZoneInfo(config.MARKET_TIMEZONE)
+    local_now = (now or dt.datetime.now(timezone)).astimezone(timezone)
+    close = dt.datetime.combine(
+        local_now.date(), dt.time.fromisoformat(config.MARKET_CLOSE_TIME), timezone
+    ) + dt.timedelta(minutes=config.MARKET_CLOSE_DELAY_MINUTES)
+    today = np.datetime64(local_now.date(), "D")
+    if is_session(today) and local_now >= close:
+        return local_now.date()
+    return previous_session(today).astype(dt.date)
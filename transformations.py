@@ -1,198 +1,756 @@
 # -*- coding: utf-8 -*-
 
+import config
 import datetime as dt
+import os
 import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
 import sqlalchemy as db
-from data_sourcing import get_market_working_days
+from pathlib import Path
+from typing import Iterator
+from corporate_actions import apply_factors, scan_adjustment_factors
+from negative_cache import scan_unavailable
+from trading_calendar import next_session, sessions_series
 from utils import pivoting_dict
 import logging
 
 
+COMPANIES_SCHEMA = {
+    "ticker": pl.String,
+    "company_name": pl.String,
+    "sector": pl.String,
+    "sub_industry": pl.String,
+    "headquarters": pl.String,
+    "date_added": pl.String,
+    "cik": pl.String,
+    "founded_year": pl.Int8,
+}
+CHANGES_SCHEMA = {
+    "effective_date": pl.Date,
+    "added_ticker": pl.String,
+    "added_security": pl.String,
+    "removed_ticker": pl.String,
+    "removed_security": pl.String,
+    "reason": pl.String,
+}
+PRICES_SCHEMA = {
+    "ticker": pl.String,
+    "date": pl.Date,
+    "open": pl.Float64,
+    "high": pl.Float64,
+    "low": pl.Float64,
+    "close": pl.Float64,
+    "volume": pl.Int64,
+}
+PRICE_KEY_COLUMNS = ["ticker", "date"]
+
+
+def _projection(schema: dict, columns: list[str] | None, keys: list[str]) -> dict:
+    """Restricts a schema to the requested columns, always keeping the key columns."""
+    if columns is None:
+        return schema
+    unknown = set(columns) - set(schema)
+    if unknown:
+        raise ValueError(f"Unknown columns requested: {sorted(unknown)}")
+    return {
+        name: dtype for name, dtype in schema.items() if name in keys or name in columns
+    }
+
+
+def scan_sp500_companies(
+    engine: db.Engine,
+    tickers: list[str] | None = None,
+    sectors: list[str] | None = None,
+    columns: list[str] | None = None,
+) -> pl.LazyFrame:
+    """
+    Lazily reads the transformed sp500_companies table.
+
+    Ticker and sector filters are pushed down into the SQL query, which only
+    runs when the LazyFrame is collected.
+    """
+    schema = _projection(COMPANIES_SCHEMA, columns, ["ticker", "date_added"])
+    source_columns = {
+        "ticker": "symbol",
+        "company_name": "security",
+        "sector": "gics_sector",
+        "sub_industry": "gics_sub_industry",
+        "headquarters": "headquarters_location",
+        "date_added": "date_added",
+        "cik": "cik",
+        "founded_year": "founded",
+    }
+    table = db.table(
+        "sp500_companies", *[db.column(source_columns[name]) for name in schema]
+    )
+    query = db.select(*table.c)
+    if tickers is not None:
+        query = query.where(
+            db.func.replace(db.func.trim(db.column("symbol")), ".", "").in_(tickers)
+        )
+    if sectors is not None:
+        query = query.where(db.func.trim(db.column("gics_sector")).in_(sectors))
+
+    def read() -> pl.DataFrame:
+        df = pl.read_database(query, engine)
+        if df.is_empty():
+            logging.warning("sp500_companies table is empty.")
+            return pl.DataFrame(schema=schema)
+        expressions = {
+            "ticker": pl.col("symbol")
+            .str.strip_chars()
+            .str.replace(".", "", literal=True),
+            "company_name": pl.col("security").str.strip_chars(),
+            "sector": pl.col("gics_sector").str.strip_chars(),
+            "sub_industry": pl.col("gics_sub_industry").str.strip_chars(),
+            "headquarters": pl.col("headquarters_location").str.strip_chars(),
+            "date_added": pl.col("date_added").str.strip_chars(),
+            "cik": pl.col("cik").str.strip_chars(),
+            "founded_year": pl.col("founded").cast(pl.Int8, strict=False),
+        }
+        df = df.select(
+            expressions[name].cast(dtype).alias(name) for name, dtype in schema.items()
+        )
+        df = df.drop_nulls(subset=["ticker"])
+        return df.unique(subset=["ticker", "date_added"])
+
+    return pl.defer(read, schema=schema)
+
+
 def sp500_companies_transformations(engine: db.Engine) -> pl.DataFrame:
     """Applies transformations to the sp500_companies table data."""
+    return scan_sp500_companies(engine).collect()
 
-    df = pl.read_database("SELECT * FROM sp500_companies", engine)
-    if df.is_empty():
-        df = df.rename(mapping={"symbol": "ticker"})
-        logging.warning("sp500_companies table is empty.")
-    else:
+
+def scan_sp500_changes(
+    engine: db.Engine,
+    tickers: list[str] | None = None,
+    start_date: dt.date | str | None = None,
+    end_date: dt.date | str | None = None,
+) -> pl.LazyFrame:
+    """
+    Lazily reads the transformed sp500_changes table.
+
+    The ticker filter is pushed down into the SQL query. Effective dates are
+    stored as free text, so date bounds are applied right after parsing.
+    """
+    query = db.select(
+        *db.table(
+            "sp500_changes",
+            db.column("effective_date"),
+            db.column("added_ticker"),
+            db.column("added_security"),
+            db.column("removed_ticker"),
+            db.column("removed_security"),
+            db.column("reason"),
+        ).c
+    )
+    if tickers is not None:
+        query = query.where(
+            db.func.trim(db.column("added_ticker")).in_(tickers)
+            | db.func.trim(db.column("removed_ticker")).in_(tickers)
+        )
+
+    def read() -> pl.DataFrame:
+        df = pl.read_database(query, engine)
+        if df.is_empty():
+            return pl.DataFrame(schema=CHANGES_SCHEMA)
         df = df.select(
-            pl.col("symbol")
-            .str.strip_chars()
-            .str.replace(".", "", literal=True)
-            .alias("ticker"),
-            pl.col("security").str.strip_chars().alias("company_name"),
-            pl.col("gics_sector").str.strip_chars().alias("sector"),
-            pl.col("gics_sub_industry").str.strip_chars().alias("sub_industry"),
-            pl.col("headquarters_location").str.strip_chars().alias("headquarters"),
-            pl.col("date_added").str.strip_chars().alias("date_added"),
-            pl.col("cik").str.strip_chars().alias("cik"),
-            pl.col("founded").cast(pl.Int8, strict=False).alias("founded_year"),
+            [
+                (
+                    pl.col("effective_date")
+                    .str.strip_chars()
+                    .str.strptime(pl.Date, format="%B %e, %Y", exact=True)
+                    .alias("effective_date")
+                ),
+                pl.col("added_ticker").str.strip_chars().alias("added_ticker"),
+                pl.col("added_security").str.strip_chars().alias("added_security"),
+                pl.col("removed_ticker").str.strip_chars().alias("removed_ticker"),
+                pl.col("removed_security").str.strip_chars().alias("removed_security"),
+                pl.col("reason").str.strip_chars().alias("reason"),
+            ]
         )
-        df = df.drop_nulls(subset=["ticker"])
-        df = df.unique(subset=["ticker", "date_added"])
-    return df
+        df = df.drop_nulls(subset=["effective_date"])
+        return (
+            df.with_columns(
+                pl.when(pl.col("added_ticker").str.len_chars() == 0)
+                .then(pl.lit(None))
+                .otherwise(pl.col("added_ticker"))
+                .alias("added_ticker"),
+                pl.when(pl.col("removed_ticker").str.len_chars() == 0)
+                .then(pl.lit(None))
+                .otherwise(pl.col("removed_ticker"))
+                .alias("removed_ticker"),
+            )
+            .unique(subset=["effective_date", "added_ticker", "removed_ticker"])
+            .cast(CHANGES_SCHEMA)
+        )
+
+    lf = pl.defer(read, schema=CHANGES_SCHEMA)
+    if start_date is not None:
+        lf = lf.filter(pl.col("effective_date") >= pl.lit(start_date).cast(pl.Date))
+    if end_date is not None:
+        lf = lf.filter(pl.col("effective_date") <= pl.lit(end_date).cast(pl.Date))
+    return lf
 
 
 def sp500_changes_transformations(engine: db.Engine) -> pl.DataFrame:
     """Applies transformations to the sp500_changes table data."""
+    return scan_sp500_changes(engine).collect()
 
-    df = pl.read_database("SELECT * FROM sp500_changes", engine)
+
+def _prices_query(
+    schema: dict,
+    tickers: list[str] | None,
+    start_date: dt.date | str | None,
+    end_date: dt.date | str | None,
+) -> db.Select:
+    """Builds the stock_prices query with filters and projection pushed down."""
+    table = db.table(
+        "stock_prices",
+        *[db.column(name, db.Date if name == "date" else None) for name in schema],
+    )
+    query = db.select(*table.c)
+    if tickers is not None:
+        query = query.where(table.c.ticker.in_(tickers))
+    if start_date is not None:
+        query = query.where(table.c.date >= dt.date.fromisoformat(str(start_date)))
+    if end_date is not None:
+        query = query.where(table.c.date <= dt.date.fromisoformat(str(end_date)))
+    return query
+
+
+def _normalize_prices(df: pl.DataFrame, schema: dict) -> pl.DataFrame:
+    """Applies the stock_prices transformations to a raw batch of rows."""
+    if df.is_empty():
+        return pl.DataFrame(schema=schema)
+    expressions = {
+        "ticker": pl.col("ticker").str.strip_chars(),
+        "date": pl.col("date").cast(pl.Date),
+    }
     df = df.select(
-        [
-            (
-                pl.col("effective_date")
-                .str.strip_chars()
-                .str.strptime(pl.Date, format="%B %e, %Y", exact=True)
-                .alias("effective_date")
-            ),
-            pl.col("added_ticker").str.strip_chars().alias("added_ticker"),
-            pl.col("added_security").str.strip_chars().alias("added_security"),
-            pl.col("removed_ticker").str.strip_chars().alias("removed_ticker"),
-            pl.col("removed_security").str.strip_chars().alias("removed_security"),
-            # pl.col('data_added').str.strptime(pl.Date, format='%Y-%m-%d', strict=False).alias('data_added'),
-            pl.col("reason").str.strip_chars().alias("reason"),
-        ]
+        expressions.get(name, pl.col(name)).cast(dtype).alias(name)
+        for name, dtype in schema.items()
     )
-    df = df.drop_nulls(subset=["effective_date"])
-    df = df.with_columns(
-        pl.when(pl.col("added_ticker").str.len_chars() == 0)
-        .then(pl.lit(None))
-        .otherwise(pl.col("added_ticker"))
-        .alias("added_ticker"),
-        pl.when(pl.col("removed_ticker").str.len_chars() == 0)
-        .then(pl.lit(None))
-        .otherwise(pl.col("removed_ticker"))
-        .alias("removed_ticker"),
-    ).unique(subset=["effective_date", "added_ticker", "removed_ticker"])
-    return df
+    df = df.drop_nulls(subset=PRICE_KEY_COLUMNS)
+    return df.unique(subset=PRICE_KEY_COLUMNS)
+
+
+def _prices_parquet_files(parquet_dir: Path) -> list[Path]:
+    """Files of the columnar stock_prices export, if there is one."""
+    return sorted(parquet_dir.glob("year=*/*.parquet"))
+
+
+def _scan_prices_parquet(
+    parquet_dir: Path,
+    schema: dict,
+    tickers: list[str] | None,
+    start_date: dt.date | str | None,
+    end_date: dt.date | str | None,
+) -> pl.LazyFrame:
+    """Scans the columnar stock_prices export with filters on partitions and rows."""
+    lf = pl.scan_parquet(
+        parquet_dir / "year=*" / "*.parquet",
+        hive_partitioning=True,
+        hive_schema={"year": pl.Int32},
+    )
+    if tickers is not None:
+        lf = lf.filter(pl.col("ticker").is_in(tickers))
+    if start_date is not None:
+        start_date = dt.date.fromisoformat(str(start_date))
+        lf = lf.filter(
+            (pl.col("year") >= start_date.year) & (pl.col("date") >= start_date)
+        )
+    if end_date is not None:
+        end_date = dt.date.fromisoformat(str(end_date))
+        lf = lf.filter((pl.col("year") <= end_date.year) & (pl.col("date") <= end_date))
+    return lf.select(pl.col(name).cast(dtype) for name, dtype in schema.items())
+
+
+def _iter_prices_parquet(
+    files: list[Path],
+    parquet_dir: Path,
+    schema: dict,
+    tickers: list[str] | None,
+    start_date: dt.date | str | None,
+    end_date: dt.date | str | None,
+    batch_size: int,
+) -> Iterator[pl.DataFrame]:
+    """Reads the columnar stock_prices export in batches of at most batch_size rows."""
+    dataset = ds.dataset(
+        [str(file) for file in files],
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("year", pa.int32())]), flavor="hive"),
+        partition_base_dir=str(parquet_dir),
+    )
+    condition = ds.scalar(True)
+    if tickers is not None:
+        condition &= ds.field("ticker").isin(tickers)
+    if start_date is not None:
+        start_date = dt.date.fromisoformat(str(start_date))
+        condition &= (ds.field("year") >= start_date.year) & (
+            ds.field("date") >= start_date
+        )
+    if end_date is not None:
+        end_date = dt.date.fromisoformat(str(end_date))
+        condition &= (ds.field("year") <= end_date.year) & (
+            ds.field("date") <= end_date
+        )
+    scanner = dataset.scanner(
+        columns=list(schema), filter=condition, batch_size=batch_size
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield pl.from_arrow(batch).select(
+                pl.col(name).cast(dtype) for name, dtype in schema.items()
+            )
+
+
+def scan_stock_prices(
+    engine: db.Engine,
+    tickers: list[str] | None = None,
+    start_date: dt.date | str | None = None,
+    end_date: dt.date | str | None = None,
+    columns: list[str] | None = None,
+    source: str = "database",
+    parquet_dir: Path | None = None,
+    adjusted: bool = True,
+) -> pl.LazyFrame:
+    """
+    Lazily reads the transformed stock_prices table.
+
+    Ticker sets, inclusive date bounds and column projections are pushed down
+    into the SQL query, or into a Parquet scan of the columnar export written
+    by export_stock_prices_to_parquet. ticker and date are always returned.
+
+    Args:
+        source: "database", "parquet", or "auto" to use the Parquet export
+            when it exists. The export is only as current as its last run of
+            export_stock_prices_to_parquet, so prices loaded since then are
+            missing from it.
+        adjusted: Whether to adjust the stored raw bars for splits and
+            dividends, with the cumulative factors of corporate_actions.
+    """
+    parquet_dir = parquet_dir or config.PRICES_PARQUET_DIR
+    schema = _projection(PRICES_SCHEMA, columns, PRICE_KEY_COLUMNS)
+    use_parquet = source == "parquet" or (
+        source == "auto" and bool(_prices_parquet_files(parquet_dir))
+    )
+    if use_parquet:
+        lf = _scan_prices_parquet(parquet_dir, schema, tickers, start_date, end_date)
+    else:
+        query = _prices_query(schema, tickers, start_date, end_date)
+        lf = pl.defer(
+            lambda: _normalize_prices(pl.read_database(query, engine), schema),
+            schema=schema,
+        )
+    if not adjusted:
+        return lf
+    return apply_factors(lf, scan_adjustment_factors(engine, tickers))
+
+
+def iter_stock_prices(
+    engine: db.Engine,
+    tickers: list[str] | None = None,
+    start_date: dt.date | str | None = None,
+    end_date: dt.date | str | None = None,
+    columns: list[str] | None = None,
+    batch_size: int = 250_000,
+    source: str = "database",
+    parquet_dir: Path | None = None,
+    adjusted: bool = True,
+) -> Iterator[pl.DataFrame]:
+    """
+    Streams transformed stock_prices rows in chunks of at most batch_size rows.
+
+    Accepts the same pushdown arguments as scan_stock_prices, so an analysis
+    can walk the price history within a fixed memory budget. Database rows
+    are fetched through a server-side cursor where the driver has one.
+    """
+    parquet_dir = parquet_dir or config.PRICES_PARQUET_DIR
+    schema = _projection(PRICES_SCHEMA, columns, PRICE_KEY_COLUMNS)
+    factors = scan_adjustment_factors(engine, tickers) if adjusted else None
+    files = _prices_parquet_files(parquet_dir)
+    if source == "parquet" or (source == "auto" and files):
+        batches = _iter_prices_parquet(
+            files, parquet_dir, schema, tickers, start_date, end_date, batch_size
+        )
+        for batch in batches:
+            if factors is not None:
+                batch = apply_factors(batch.lazy(), factors).collect()
+            yield batch
+        return
+
+    query = _prices_query(schema, tickers, start_date, end_date)
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for batch in pl.read_database(
+            query, connection, iter_batches=True, batch_size=batch_size
+        ):
+            batch = _normalize_prices(batch, schema)
+            if factors is not None:
+                batch = apply_factors(batch.lazy(), factors).collect()
+            yield batch
 
 
 def stock_prices_transformations(engine: db.Engine) -> pl.DataFrame:
     """Applies transformations to the stock_prices table data."""
-    df = pl.read_database("SELECT * FROM stock_prices", engine)
+    df = scan_stock_prices(engine, source="database").collect()
     if df.is_empty():
         logging.warning("stock_prices table is empty.")
-    else:
-        df = df.select(
-            pl.col("ticker").str.strip_chars().alias("ticker"),
-            pl.col("date").alias("date"),
-            pl.col("open").cast(pl.Float64).alias("open"),
-            pl.col("high").cast(pl.Float64).alias("high"),
-            pl.col("low").cast(pl.Float64).alias("low"),
-            pl.col("close").cast(pl.Float64).alias("close"),
-            pl.col("volume").cast(pl.Int64).alias("volume"),
-        )
-        df = df.drop_nulls(subset=["ticker", "date"])
-        df = df.unique(subset=["ticker", "date"])
     return df
 
 
+def export_stock_prices_to_parquet(
+    engine: db.Engine, parquet_dir: Path | None = None
+) -> None:
+    """
+    Writes stock_prices as a Parquet dataset partitioned by year, one year at a time.
+
+    The raw bars are exported, so the export stays valid after new corporate
+    actions; readers adjust them with the stored factors.
+    """
+    parquet_dir = parquet_dir or config.PRICES_PARQUET_DIR
+    with engine.connect() as connection:
+        first_date, last_date = connection.execute(
+            db.text("SELECT MIN(date), MAX(date) FROM stock_prices")
+        ).one()
+    if first_date is None:
+        logging.warning("stock_prices table is empty, nothing to export.")
+        return
+    first_year = dt.date.fromisoformat(str(first_date)[:10]).year
+    last_year = dt.date.fromisoformat(str(last_date)[:10]).year
+    for year in range(first_year, last_year + 1):
+        df = scan_stock_prices(
+            engine,
+            start_date=dt.date(year, 1, 1),
+            end_date=dt.date(year, 12, 31),
+            source="database",
+            adjusted=False,
+        ).collect()
+        if df.is_empty():
+            continue
+        path = parquet_dir / f"year={year}" / "data.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        df.sort(PRICE_KEY_COLUMNS).write_parquet(temporary_path)
+        os.replace(temporary_path, path)
+    logging.info(f"Exported stock_prices ({first_year}-{last_year}) to {parquet_dir}.")
+
+
+def price_coverage_transformations(
+    engine: db.Engine | db.Connection, tickers: list[str] | None = None
+) -> pl.DataFrame:
+    """Reads the coverage intervals of stock_prices, only those of tickers when given."""
+    query = db.select(
+        *db.table(
+            "stock_prices_coverage",
+            db.column("ticker"),
+            db.column("start_date"),
+            db.column("end_date"),
+        ).c
+    )
+    if tickers is not None:
+        query = query.where(db.column("ticker").in_(tickers))
+    df = pl.read_database(query, engine)
+    if df.is_empty():
+        return pl.DataFrame(
+            schema={"ticker": pl.String, "start_date": pl.Date, "end_date": pl.Date}
+        )
+    return df.select(
+        pl.col("ticker").str.strip_chars().alias("ticker"),
+        pl.col("start_date").cast(pl.Date).alias("start_date"),
+        pl.col("end_date").cast(pl.Date).alias("end_date"),
+    )
+
+
 def creating_sp500_index_timeline(
     changes_df: pl.DataFrame, companies_df: pl.DataFrame, trading_days: pl.Series
 ) -> pl.DataFrame:
-    """Creates a timeline of S&P 500 index changes."""
+    """
+    Creates the S&P 500 membership timeline as per-ticker intervals.
+
+    Additions and removals are paired in date order per ticker, so a ticker
+    that was added, removed and re-added gets one row per membership spell.
+    A leading removal means the ticker was a member since before the first
+    recorded change, a trailing addition that it still is, and current
+    constituents without any change are members over the whole window.
+
+    Returns:
+        Polars DataFrame with ticker, added_date (inclusive) and removed_date
+        (exclusive), clipped to the range covered by trading_days.
+    """
+    days = trading_days.cast(pl.Date)
+    min_date = days.min()
+    window_end = days.max() + dt.timedelta(days=1)
 
-    min_date = trading_days.min()
-    adjusted_changes_df = changes_df.filter(
-        pl.coalesce(pl.col("effective_date"), pl.lit(dt.date(1900, 1, 1))) >= min_date
+    events = (
+        changes_df.select(pl.col("effective_date", "added_ticker", "removed_ticker"))
+        .unpivot(
+            index="effective_date",
+            on=["added_ticker", "removed_ticker"],
+            variable_name="action",
+            value_name="ticker",
+        )
+        .drop_nulls(subset=["effective_date", "ticker"])
+        .with_columns((pl.col("action") == "added_ticker").alias("is_addition"))
+        .sort(["ticker", "effective_date", "is_addition"])
+        .filter(
+            pl.col("is_addition").ne_missing(
+                pl.col("is_addition").shift(1).over("ticker")
+            )
+        )
+    )
+    spells = events.with_columns(
+        pl.col("effective_date").shift(-1).over("ticker").alias("next_date"),
+        pl.col("ticker").shift(1).over("ticker").is_null().alias("is_first"),
+    ).select(
+        pl.col("ticker"),
+        pl.when(pl.col("is_addition"))
+        .then(pl.col("effective_date"))
+        .otherwise(None)
+        .alias("added_date"),
+        pl.when(pl.col("is_addition"))
+        .then(pl.col("next_date"))
+        .otherwise(pl.col("effective_date"))
+        .alias("removed_date"),
+        (pl.col("is_addition") | pl.col("is_first")).alias("is_spell"),
+    )
+    unchanged_members = (
+        companies_df.select(pl.col("ticker"))
+        .drop_nulls()
+        .unique()
+        .join(events.select(pl.col("ticker")), on="ticker", how="anti")
+        .with_columns(
+            pl.lit(None, dtype=pl.Date).alias("added_date"),
+            pl.lit(None, dtype=pl.Date).alias("removed_date"),
+        )
     )
 
-    pivoted_changes = (
-        adjusted_changes_df.select(
-            pl.col("effective_date", "added_ticker", "removed_ticker")
+    timeline = (
+        pl.concat(
+            [
+                spells.filter(pl.col("is_spell")).drop("is_spell"),
+                unchanged_members,
+            ]
         )
-        .unpivot(index="effective_date", on=["added_ticker", "removed_ticker"])
         .select(
-            pl.when(pl.col("variable") == "added_ticker")
-            .then(pl.coalesce(pl.col("effective_date"), pl.lit(min_date)))
-            .otherwise(None)
-            .alias("added_date"),
-            pl.when(pl.col("variable") == "removed_ticker")
-            .then(pl.coalesce(pl.col("effective_date"), pl.lit(dt.date.today())))
-            .otherwise(None)
-            .alias("removed_date"),
-            pl.col("value").alias("ticker"),
+            pl.col("ticker"),
+            pl.max_horizontal(
+                pl.coalesce(pl.col("added_date"), pl.lit(min_date)), pl.lit(min_date)
+            ).alias("added_date"),
+            pl.min_horizontal(
+                pl.coalesce(pl.col("removed_date"), pl.lit(window_end)),
+                pl.lit(window_end),
+            ).alias("removed_date"),
         )
-        .filter(pl.col("ticker").is_not_null())
+        .filter(pl.col("added_date") < pl.col("removed_date"))
+        .sort(["ticker", "added_date"])
     )
 
-    tickers = (
-        companies_df.select(pl.col("ticker"))
-        .vstack(pivoted_changes.select(pl.col("ticker")).drop_nulls(subset=["ticker"]))
+    return timeline
+
+
+def expand_sp500_index_timeline(
+    timeline_df: pl.DataFrame, trading_days: pl.Series
+) -> pl.LazyFrame:
+    """Lazily expands membership intervals into one row per ticker and trading day."""
+    sessions = sessions_index(trading_days)
+    days = sessions["date"]
+    spans = timeline_df.select(
+        pl.col("ticker"),
+        days.search_sorted(timeline_df["added_date"], side="left")
+        .cast(pl.Int64)
+        .alias("start_session"),
+        days.search_sorted(timeline_df["removed_date"], side="left")
+        .cast(pl.Int64)
+        .alias("end_session"),
+    )
+    return (
+        spans.lazy()
+        .select(
+            pl.col("ticker"),
+            pl.int_ranges("start_session", "end_session").alias("session"),
+        )
+        .explode("session")
+        .drop_nulls(subset=["session"])
+        .join(sessions.lazy(), on="session", how="inner")
+        .select(pl.col("ticker"), pl.col("date"))
+    )
+
+
+def sessions_index(trading_days: pl.Series) -> pl.DataFrame:
+    """Maps each trading day to its position in the trading calendar."""
+    return (
+        trading_days.cast(pl.Date)
+        .alias("date")
+        .to_frame()
         .unique()
+        .sort("date")
+        .with_row_index("session")
+        .with_columns(pl.col("session").cast(pl.Int64))
     )
 
-    target_dates = (
-        trading_days.to_frame()
-        .join(tickers, how="cross")
-        .rename({"": "date"})
-        .join(pivoted_changes, on="ticker", how="left")
-        .filter(
-            (pl.col("date") >= pl.coalesce(pl.col("added_date"), pl.lit(min_date)))
-            & (
-                pl.col("date")
-                < pl.coalesce(pl.col("removed_date"), pl.lit(dt.date.today()))
-            )
+
+def dates_to_intervals(df: pl.DataFrame, sessions: pl.DataFrame) -> pl.DataFrame:
+    """Compresses (ticker, date) rows into runs of consecutive trading sessions."""
+    return (
+        df.select(pl.col("ticker"), pl.col("date").cast(pl.Date))
+        .join(sessions, on="date", how="inner")
+        .unique(subset=["ticker", "session"])
+        .sort(["ticker", "session"])
+        .with_columns(
+            (pl.col("session").diff().over("ticker") != 1)
+            .fill_null(True)
+            .cum_sum()
+            .alias("run_id")
+        )
+        .group_by(["ticker", "run_id"])
+        .agg(
+            pl.col("session").min().alias("start_session"),
+            pl.col("session").max().alias("end_session"),
         )
+        .drop("run_id")
     )
 
-    return target_dates
 
+def intervals_to_sessions(
+    df: pl.DataFrame,
+    sessions: pl.DataFrame,
+    start_col: str = "start_date",
+    end_col: str = "end_date",
+) -> pl.DataFrame:
+    """Converts inclusive date intervals into inclusive session index intervals."""
+    days = sessions["date"]
+    start_session = days.search_sorted(df[start_col].cast(pl.Date), side="left")
+    end_session = days.search_sorted(df[end_col].cast(pl.Date), side="right")
+    return df.select(
+        pl.col("ticker"),
+        start_session.cast(pl.Int64).alias("start_session"),
+        (end_session.cast(pl.Int64) - 1).alias("end_session"),
+    ).filter(pl.col("end_session") >= pl.col("start_session"))
 
-def catch_missing_prices(
-    prices_df: pl.DataFrame, timeline_df: pl.DataFrame
+
+def sessions_to_intervals(
+    df: pl.DataFrame,
+    sessions: pl.DataFrame,
+    start_col: str = "start_date",
+    end_col: str = "end_date",
 ) -> pl.DataFrame:
-    """Identifies missing price entries in the stock_prices table."""
-    if prices_df.is_empty():
-        grouped = timeline_df.group_by("ticker").agg(
-            pl.min("date").alias("first_missing_date"),
-            pl.max("date").alias("last_missing_date"),
-        )
+    """Converts session index intervals back into inclusive date intervals."""
+    days = sessions["date"]
+    return df.with_columns(
+        days.gather(df["start_session"]).alias(start_col),
+        days.gather(df["end_session"]).alias(end_col),
+    )
 
-    else:
-        merged_df = timeline_df.with_columns(pl.col("date").cast(pl.Date)).join(
-            prices_df,
-            on=["ticker", "date"],
-            how="left",
-            suffix="_price",
-        )
 
-        missing_prices_df = (
-            merged_df.filter(pl.col("open").is_null())
-            .select(pl.col("ticker"), pl.col("date"))
-            .sort(["ticker", "date"])
+def merge_intervals(df: pl.DataFrame) -> pl.DataFrame:
+    """Merges overlapping or adjacent session intervals per ticker."""
+    return (
+        df.select("ticker", "start_session", "end_session")
+        .sort(["ticker", "start_session"])
+        .with_columns(
+            pl.col("end_session")
+            .cum_max()
+            .shift(1)
+            .over("ticker")
+            .alias("previous_end")
         )
-
-        missing_prices_df = missing_prices_df.with_columns(
-            (
-                pl.col("date").cast(pl.Int64) - pl.col("date").cast(pl.Int64).shift(1)
-            ).alias("date_diff"),
+        .with_columns(
             (
-                (pl.col("ticker") != pl.col("ticker").shift(1))
-                | (
-                    pl.col("date").cast(pl.Int64)
-                    - pl.col("date").cast(pl.Int64).shift(1)
-                    > 1
-                )
+                pl.col("previous_end").is_null()
+                | (pl.col("start_session") > pl.col("previous_end") + 1)
             )
             .cum_sum()
-            .alias("group_id"),
+            .alias("run_id")
+        )
+        .group_by(["ticker", "run_id"])
+        .agg(
+            pl.col("start_session").min(),
+            pl.col("end_session").max(),
         )
+        .drop("run_id")
+        .sort(["ticker", "start_session"])
+    )
 
-        grouped = (
-            missing_prices_df.group_by(["ticker", "group_id"])
-            .agg(
-                [
-                    pl.col("date").min().alias("first_missing_date"),
-                    pl.col("date").max().alias("last_missing_date"),
-                    pl.len().alias("missing_count"),
-                ]
-            )
-            .filter(pl.col("missing_count") >= 2)
-            .sort("missing_count", descending=True)
-            .select(["ticker", "first_missing_date", "last_missing_date"])
+
+def subtract_intervals(
+    intervals_df: pl.DataFrame, covered_df: pl.DataFrame
+) -> pl.DataFrame:
+    """Returns the parts of each session interval that are not covered."""
+    members = intervals_df.select(
+        "ticker", "start_session", "end_session"
+    ).with_row_index("interval_id")
+    covered = merge_intervals(covered_df).rename(
+        {"start_session": "covered_start", "end_session": "covered_end"}
+    )
+    overlaps = (
+        members.join(covered, on="ticker", how="inner")
+        .filter(
+            (pl.col("covered_end") >= pl.col("start_session"))
+            & (pl.col("covered_start") <= pl.col("end_session"))
+        )
+        .sort(["interval_id", "covered_start"])
+    )
+    leading_gaps = overlaps.select(
+        pl.col("ticker"),
+        pl.coalesce(
+            pl.col("covered_end").shift(1).over("interval_id") + 1,
+            pl.col("start_session"),
+        ).alias("start_session"),
+        (pl.col("covered_start") - 1).alias("end_session"),
+    )
+    trailing_gaps = overlaps.group_by("interval_id").agg(
+        pl.col("ticker").first(),
+        (pl.col("covered_end").max() + 1).alias("start_session"),
+        pl.col("end_session").first(),
+    )
+    uncovered = members.join(overlaps, on="interval_id", how="anti")
+    return pl.concat(
+        [
+            leading_gaps,
+            trailing_gaps.select("ticker", "start_session", "end_session"),
+            uncovered.select("ticker", "start_session", "end_session"),
+        ]
+    ).filter(pl.col("end_session") >= pl.col("start_session"))
+
+
+def catch_missing_prices(
+    coverage_df: pl.DataFrame, timeline_df: pl.DataFrame, trading_days: pl.Series
+) -> pl.DataFrame:
+    """Identifies missing price ranges by diffing membership against coverage."""
+    sessions = sessions_index(trading_days)
+    membership = merge_intervals(
+        intervals_to_sessions(
+            timeline_df.with_columns(
+                (pl.col("removed_date") - dt.timedelta(days=1)).alias("last_date")
+            ),
+            sessions,
+            start_col="added_date",
+            end_col="last_date",
+        )
+    )
+    if coverage_df.is_empty():
+        covered = membership.clear()
+    else:
+        covered = intervals_to_sessions(coverage_df, sessions)
+
+    gaps = subtract_intervals(membership, covered).with_columns(
+        (pl.col("end_session") - pl.col("start_session") + 1).alias("missing_count")
+    )
+    grouped = (
+        sessions_to_intervals(
+            gaps,
+            sessions,
+            start_col="first_missing_date",
+            end_col="last_missing_date",
         )
+        .filter(pl.col("missing_count") >= 2)
+        .sort("missing_count", descending=True)
+        .select(["ticker", "first_missing_date", "last_missing_date"])
+    )
     return grouped
 
 
@@ -202,13 +760,17 @@ def get_missing_price_ranges(start_date: str, end_date: str, engine=db.Engine) -
     adjusted_end_date = str(dt.date.fromisoformat(end_date) - dt.timedelta(days=1))
     companies_df = sp500_companies_transformations(engine=engine)
     changes_df = sp500_changes_transformations(engine=engine)
-    trading_days = pl.from_pandas(
-        get_market_working_days(start_date, adjusted_end_date)
-    )
+    trading_days = sessions_series(start_date, adjusted_end_date)
     timeline_df = creating_sp500_index_timeline(changes_df, companies_df, trading_days)
-    stock_prices = stock_prices_transformations(engine=engine)
+    # Ranges the provider is known not to have are treated as covered.
+    coverage_df = pl.concat(
+        [
+            price_coverage_transformations(engine=engine),
+            scan_unavailable(engine).select("ticker", "start_date", "end_date"),
+        ]
+    )
     missing_ranges = (
-        catch_missing_prices(stock_prices, timeline_df)
+        catch_missing_prices(coverage_df, timeline_df, trading_days)
         .with_columns(
             pl.col("first_missing_date")
             .dt.strftime("%Y-%m-%d")
@@ -220,3 +782,61 @@ def get_missing_price_ranges(start_date: str, end_date: str, engine=db.Engine) -
         .to_dict(as_series=False)
     )
     return pivoting_dict(missing_ranges)
+
+
+def get_tail_price_ranges(
+    through_date: dt.date | str, engine: db.Engine
+) -> tuple[list[dict], list[str]]:
+    """
+    Finds the sessions each current constituent is missing after its latest stored price.
+
+    Only the end of the coverage index is looked at, so older gaps are left to
+    the full gap scan of get_missing_price_ranges.
+
+    Returns:
+        Missing ranges (ticker, first_missing_date, last_missing_date) up to
+        through_date, and the current constituents without any stored price.
+    """
+    through_date = dt.date.fromisoformat(str(through_date))
+    members = scan_sp500_companies(engine, columns=["ticker"]).select("ticker")
+    latest = pl.read_database(
+        "SELECT ticker, MAX(end_date) AS last_date "
+        "FROM stock_prices_coverage GROUP BY ticker",
+        engine,
+    )
+    if latest.is_empty():
+        latest = pl.DataFrame(schema={"ticker": pl.String, "last_date": pl.Date})
+    latest = (
+        pl.concat(
+            [
+                latest.select(
+                    pl.col("ticker").str.strip_chars(),
+                    pl.col("last_date").cast(pl.Date),
+                ),
+                scan_unavailable(engine).select(
+                    "ticker", pl.col("end_date").alias("last_date")
+                ),
+            ]
+        )
+        .group_by("ticker")
+        .agg(pl.col("last_date").max())
+    )
+    tails = members.collect().unique().join(latest, on="ticker", how="left")
+    unseen = tails.filter(pl.col("last_date").is_null())["ticker"].sort().to_list()
+    tails = tails.drop_nulls("last_date")
+    missing_ranges = (
+        tails.with_columns(
+            pl.Series(
+                "first_missing_date", next_session(tails["last_date"]), dtype=pl.Date
+            ),
+            pl.lit(through_date).alias("last_missing_date"),
+        )
+        .filter(pl.col("first_missing_date") <= pl.col("last_missing_date"))
+        .select(
+            "ticker",
+            pl.col("first_missing_date").dt.strftime("%Y-%m-%d"),
+            pl.col("last_missing_date").dt.strftime("%Y-%m-%d"),
+        )
+        .sort("ticker")
+    )
+    return missing_ranges.to_dicts(), unseen
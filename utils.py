@@ -1,10 +1,11 @@
 # *-* coding: utf-8 -*-
 
-import datetime as dt
+import hashlib
+import io
 import json
 import logging
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import etree
 from sqlalchemy import Engine
 from pathlib import Path
 from datetime import date, timedelta
@@ -29,77 +30,121 @@ def sql_query_to_dataframe(engine: Engine, query_file: Path) -> pd.DataFrame:
     return df
 
 
-def parse_wikipedia_table(table_element: BeautifulSoup) -> dict:
+def _cell_text(cell: etree._Element) -> str:
+    return "".join(cell.itertext()).strip()
+
+
+def parse_wikipedia_table(table_element: etree._Element) -> list[dict]:
     """
     Parses a Wikipedia table, handling complex headers with rowspan and colspan.
 
+    Rows and cells are visited once. Leading rows holding <th> cells form the
+    header grid, and cells spanning several rows or columns are carried over
+    to the grid positions they cover, in the header as in the data rows.
+
     Args:
-        table_element: A BeautifulSoup object representing the <table> element.
+        table_element: An lxml element representing the <table> element.
 
     Returns:
-        Polars DataFrame containing the table data.
+        List of dictionaries keyed by the snake_cased column names.
     """
-    all_rows = table_element.find_all("tr")
-    header_rows = []
-    data_rows = []
+    header_grid: list[list[str]] = []
+    data_grid: list[list[str]] = []
+    pending: dict[int, tuple[int, str]] = {}  # column -> (rows left, text)
     header_ended = False
-    for row in all_rows:
-        is_header_row = len(row.find_all("th")) > 0
-        if not header_ended and is_header_row:
-            header_rows.append(row)
+    for row in table_element.iter("tr"):
+        cells = [cell for cell in row if cell.tag in ("th", "td")]
+        has_th = any(cell.tag == "th" for cell in cells)
+        if not header_ended and has_th:
+            grid = header_grid
         else:
-            header_ended = True
-            if len(row.find_all("td")) > 0:
-                data_rows.append(row)
-
-    header_grid = []
-    for r, row in enumerate(header_rows):
-        while len(header_grid) <= r:
-            header_grid.append([])
-
-        cells = row.find_all(["th", "td"])
-        for cell in cells:
-            c = 0
-            while c < len(header_grid[r]) and header_grid[r][c] is not None:
-                c += 1
-
-            rowspan = int(cell.get("rowspan", 1))
-            colspan = int(cell.get("colspan", 1))
-
-            for i in range(rowspan):
-                for j in range(colspan):
-                    while len(header_grid) <= r + i:
-                        header_grid.append([])
-                    while len(header_grid[r + i]) <= c + j:
-                        header_grid[r + i].append(None)
-
-                    header_grid[r + i][c + j] = cell.text.strip()
+            if not header_ended:
+                header_ended, pending = True, {}
+            cells = [cell for cell in cells if cell.tag == "td"]
+            if not cells:
+                continue
+            grid = data_grid
+
+        values: list[str] = []
+        cell_iter = iter(cells)
+        cell = next(cell_iter, None)
+        while cell is not None or any(column >= len(values) for column in pending):
+            column = len(values)
+            if column in pending:
+                rows_left, text = pending[column]
+                values.append(text)
+                if rows_left > 1:
+                    pending[column] = (rows_left - 1, text)
+                else:
+                    del pending[column]
+                continue
+            if cell is None:
+                values.append(None)
+                continue
+            text = _cell_text(cell)
+            rowspan = int(cell.get("rowspan", 1) or 1)
+            colspan = int(cell.get("colspan", 1) or 1)
+            for offset in range(colspan):
+                values.append(text)
+                if rowspan > 1:
+                    pending[column + offset] = (rowspan - 1, text)
+            cell = next(cell_iter, None)
+        grid.append(values)
 
     final_headers = []
     if header_grid:
-        max_cols = max(len(row) for row in header_grid)
-        for c in range(max_cols):
+        for c in range(max(len(row) for row in header_grid)):
             column_texts = []
-            for r in range(len(header_grid)):
-                if c < len(header_grid[r]) and header_grid[r][c] is not None:
-                    if header_grid[r][c] not in column_texts:
-                        column_texts.append(header_grid[r][c])
+            for row in header_grid:
+                if c < len(row) and row[c] is not None and row[c] not in column_texts:
+                    column_texts.append(row[c])
             final_headers.append(" ".join(column_texts))
 
-    extracted_data = []
-    for row in data_rows:
-        cells = row.find_all("td")
-        extracted_data.append([cell.text.strip() for cell in cells])
-
     adj_final_headers = list(map(snake_case, final_headers))
     if not final_headers:
-        return list_to_dict(extracted_data, headers=adj_final_headers)
+        return list_to_dict(data_grid, headers=adj_final_headers)
     else:
         num_cols = len(final_headers)
-        clean_data = [row for row in extracted_data if len(row) == num_cols]
+        clean_data = [row for row in data_grid if len(row) == num_cols]
         return list_to_dict(clean_data, adj_final_headers)
 
 
+def extract_wikipedia_tables(html: str | bytes, table_ids: list[str]) -> dict:
+    """
+    Parses the tables with the given ids from a Wikipedia page in one pass.
+
+    The page is streamed through lxml, each table is parsed as soon as it has
+    been read and parsing stops once every requested table was found.
+
+    Returns:
+        Dictionary mapping each table id found to its parsed rows.
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    tables = {}
+    for _, element in etree.iterparse(
+        io.BytesIO(html), events=("end",), tag="table", html=True, recover=True
+    ):
+        table_id = element.get("id")
+        if table_id in table_ids and table_id not in tables:
+            tables[table_id] = parse_wikipedia_table(element)
+            if len(tables) == len(table_ids):
+                break
+        if not any(ancestor.tag == "table" for ancestor in element.iterancestors()):
+            element.clear(keep_tail=True)
+    missing = set(table_ids) - set(tables)
+    if missing:
+        logging.warning(f"Tables not found in the page: {sorted(missing)}")
+    return tables
+
+
+def table_content_hash(rows: list[dict]) -> str:
+    """Stable hash of parsed table rows, used to detect unchanged tables."""
+    return hashlib.sha256(
+        json.dumps(rows, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
 def list_to_dict(data: list[list], headers: list) -> list[dict]:
     """Converts a list of lists to a list of dictionaries using the provided headers."""
     dict_list = []
@@ -121,26 +166,3 @@ def pivoting_dict(data: dict) -> dict:
     else:
         keys = data.keys()
         return [dict(zip(keys, values)) for values in zip(*data.values())]
-
-
-def group_tickers_by_dates_range(tickers_with_dates: list[dict]) -> dict:
-    """Groups tickers by their date ranges."""
-    grouped = {}
-    for item in tickers_with_dates:
-        dates_range = (item["first_missing_date"], item["last_missing_date"])
-        if dates_range not in grouped.keys():
-            grouped[dates_range] = []
-        grouped[dates_range].append(item["ticker"])
-    return grouped
-
-
-def save_missing_data_to_json(
-    tickers: list[str], start_date: str, end_date: str, path: Path
-) -> None:
-    if not path.exists():
-        path.mkdir()
-    adjusted_dict = {ticker: (start_date, end_date) for ticker in tickers}
-    filename = dt.date.today().strftime("%Y_%m_%d") + ".json"
-    full_path = path / filename
-    with full_path.open(mode='+w"') as file:
-        file.write(json.dump(adjusted_dict, indent=4))
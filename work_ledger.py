@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import config
+import datetime as dt
+import hashlib
+import logging
+import sqlalchemy as db
+from typing import Iterable, Sequence
+from sqlalchemy.dialects import postgresql, sqlite
+from database import get_table
+
+
+WORK_UNITS_TABLE = "etl_work_units"
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+KEY_BATCH_SIZE = 500
+
+
+def unit_key(tickers: Sequence[str], start_date: str, end_date: str) -> str:
+    """Stable identifier of the work unit fetching tickers over [start_date, end_date)."""
+    text = f"{','.join(sorted(tickers))}|{start_date}|{end_date}"
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _request_key(request: dict) -> str:
+    return unit_key(request["tickers"], request["start_date"], request["end_date"])
+
+
+def _transition(
+    engine: db.Engine,
+    keys: Iterable[str],
+    from_statuses: tuple[str, ...],
+    values: dict,
+) -> int:
+    """
+    Moves the units of keys that are in one of from_statuses to the new values.
+
+    Units in any other status are left untouched, so repeating a transition
+    is harmless. Returns the number of units moved.
+    """
+    table = get_table(engine, WORK_UNITS_TABLE)
+    keys = list(keys)
+    moved = 0
+    with engine.begin() as connection:
+        for i in range(0, len(keys), KEY_BATCH_SIZE):
+            result = connection.execute(
+                table.update()
+                .where(table.c.unit_key.in_(keys[i : i + KEY_BATCH_SIZE]))
+                .where(table.c.status.in_(from_statuses))
+                .values(**values)
+            )
+            moved += result.rowcount
+    return moved
+
+
+def record_work_units(engine: db.Engine, plan: list[dict]) -> int:
+    """
+    Records planned requests in the ledger as pending work units.
+
+    Units planned again after they finished or failed (their range is still
+    missing) are set back to pending; units already pending or running are
+    left as they are. Returns the number of units recorded.
+    """
+    if not plan:
+        return 0
+    if engine.dialect.name == "postgresql":
+        dialect_insert = postgresql.insert
+    else:
+        dialect_insert = sqlite.insert
+    table = get_table(engine, WORK_UNITS_TABLE)
+    rows = [
+        {
+            "unit_key": _request_key(request),
+            "tickers": ",".join(request["tickers"]),
+            "start_date": dt.date.fromisoformat(request["start_date"]),
+            "end_date": dt.date.fromisoformat(request["end_date"]),
+            "status": PENDING,
+        }
+        for request in plan
+    ]
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["unit_key"],
+        set_={"status": PENDING, "last_error": None, "planned_at": db.func.now()},
+        # Not an IN list: expanding parameters can't be used with executemany.
+        where=db.or_(table.c.status == DONE, table.c.status == FAILED),
+    )
+    with engine.begin() as connection:
+        connection.execute(statement, rows)
+    return len(rows)
+
+
+def _lease_expired(engine: db.Engine, table: db.Table) -> db.ColumnElement:
+    """Whether a running unit was started longer than WORK_UNIT_LEASE_MINUTES ago."""
+    minutes = config.WORK_UNIT_LEASE_MINUTES
+    # Compared on the database clock, the one that stamped started_at.
+    if engine.dialect.name == "postgresql":
+        cutoff = db.func.now() - dt.timedelta(minutes=minutes)
+    else:
+        cutoff = db.func.datetime("now", f"-{minutes} minutes")
+    return db.or_(table.c.started_at.is_(None), table.c.started_at < cutoff)
+
+
+def resume_work_units(engine: db.Engine, reclaim: bool = True) -> list[dict]:
+    """
+    Returns the unfinished units of previous runs as planned requests.
+
+    Units left running for longer than WORK_UNIT_LEASE_MINUTES belonged to a
+    process that died and are set back to pending first. Units started more
+    recently may still be running elsewhere, so they are left to their owner.
+    With reclaim=False nothing is written, and the expired units are returned
+    as they are.
+    """
+    table = get_table(engine, WORK_UNITS_TABLE)
+    running = table.c.status == RUNNING
+    expired = db.and_(running, _lease_expired(engine, table))
+    with engine.begin() as connection:
+        interrupted = 0
+        if reclaim:
+            interrupted = connection.execute(
+                table.update().where(expired).values(status=PENDING)
+            ).rowcount
+        unfinished = table.c.status == PENDING
+        if not reclaim:
+            unfinished = db.or_(unfinished, expired)
+        rows = connection.execute(
+            db.select(table.c.tickers, table.c.start_date, table.c.end_date)
+            .where(unfinished)
+            .order_by(table.c.start_date, table.c.end_date)
+        ).all()
+        leased = connection.execute(
+            db.select(db.func.count())
+            .select_from(table)
+            .where(running, db.not_(expired))
+        ).scalar_one()
+    if interrupted:
+        logging.warning(f"{interrupted} work units were interrupted and will resume.")
+    if leased:
+        logging.info(
+            f"{leased} work units are still running in another process and "
+            "were left to it."
+        )
+    return [
+        {
+            "tickers": tickers.split(","),
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+        }
+        for tickers, start_date, end_date in rows
+    ]
+
+
+def start_work_units(engine: db.Engine, plan: list[dict]) -> int:
+    """Marks pending or failed units as running and counts the attempt."""
+    table = get_table(engine, WORK_UNITS_TABLE)
+    return _transition(
+        engine,
+        map(_request_key, plan),
+        (PENDING, FAILED),
+        {
+            "status": RUNNING,
+            "attempts": table.c.attempts + 1,
+            "started_at": db.func.now(),
+            "finished_at": None,
+        },
+    )
+
+
+def finish_work_unit(
+    engine: db.Engine, key: str, rows_fetched: int = 0, counts: dict | None = None
+) -> bool:
+    """Marks a running unit as done with its fetched and loaded row counts."""
+    counts = counts or {"inserted": 0, "updated": 0, "skipped": 0}
+    return bool(
+        _transition(
+            engine,
+            [key],
+            (RUNNING,),
+            {
+                "status": DONE,
+                "rows_fetched": rows_fetched,
+                "rows_inserted": counts["inserted"],
+                "rows_updated": counts["updated"],
+                "rows_skipped": counts["skipped"],
+                "last_error": None,
+                "finished_at": db.func.now(),
+            },
+        )
+    )
+
+
+def fail_work_units(engine: db.Engine, keys: Iterable[str], error: str) -> int:
+    """Marks running units as failed with the reason."""
+    return _transition(
+        engine,
+        keys,
+        (RUNNING,),
+        {"status": FAILED, "last_error": error, "finished_at": db.func.now()},
+    )
+
+
+def work_unit_summary(engine: db.Engine) -> dict[str, int]:
+    """Number of work units in each status."""
+    table = get_table(engine, WORK_UNITS_TABLE)
+    with engine.connect() as connection:
+        rows = connection.execute(
+            db.select(table.c.status, db.func.count()).group_by(table.c.status)
+        ).all()
+    return dict(rows)